@@ -2,21 +2,42 @@
 """
 API Backend con FastAPI para el Chatbot Educativo
 """
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from contextlib import asynccontextmanager
+import asyncio
+import httpx
 import logging
+import time
 from datetime import datetime
+from typing import Optional, Tuple
 
+import fast_json
 from config import settings
+from fast_json import FastJSONResponse, FastJSONRoute
 from models import (
+    BatchChatRequest,
+    ChatMessage,
     ChatRequest, 
     ChatResponse, 
     HealthResponse, 
-    ErrorResponse
+    ErrorResponse,
+    TokenizeRequest,
+    TokenizeResponse
 )
 from services.vllm_service import vllm_service
+from services.admission import AdmissionRejected
+from services.circuit_breaker import CircuitOpenError
+from services.metrics import metrics, metrics_aggregator
+from services.preflight import PromptTooLong
+from services.session_store import new_session_id, session_store
+from services.state_backend import per_process_components, state_backends
+from services.tracing import record_since_start, span, trace_exporter
+from services.warmup import warmup
+from middleware.metrics import MetricsMiddleware
+from middleware.tracing import TracingMiddleware
+from middleware.rate_limit import RateLimitMiddleware, create_client_identity, create_rate_limit_backend
 
 # Configurar logging
 logging.basicConfig(
@@ -31,27 +52,72 @@ async def lifespan(app: FastAPI):
     """Ejecutar código al inicio y fin de la aplicación"""
     # Startup
     logger.info("🚀 Iniciando API Backend...")
-    logger.info(f"📦 Conectando a vLLM en {settings.VLLM_API_URL}")
+    logger.info(f"📦 Conectando a vLLM en {', '.join(r.url for r in vllm_service.router.replicas)}")
     
-    # Verificar conexión con vLLM
-    is_healthy = await vllm_service.check_health()
+    # Con varios workers el estado en memoria no se comparte entre procesos
+    local_state = per_process_components()
+    if settings.WORKERS > 1 and local_state:
+        logger.warning(
+            f"⚠️  WORKERS={settings.WORKERS} pero {', '.join(local_state)} usan estado por proceso; "
+            f"configura STATE_BACKEND=redis para compartirlo"
+        )
+    await metrics_aggregator.start()
+    await trace_exporter.start()
+    
+    # Abrir pool de conexiones compartido hacia vLLM
+    await vllm_service.start()
+    
+    # Verificar conexión con vLLM y seguir sondeando en segundo plano
+    is_healthy = await vllm_service.health_monitor.start()
     if is_healthy:
         logger.info("✅ Conexión con vLLM exitosa")
     else:
         logger.warning("⚠️  No se pudo conectar con vLLM al iniciar")
     
+    # Cargar tokenizer y cachés y calentar vLLM en segundo plano, con el
+    # servidor ya escuchando; /health no está listo hasta que termine
+    warmup.start()
+    
     yield
     
     # Shutdown
     logger.info("👋 Apagando API Backend...")
+    await warmup.stop()
+    await vllm_service.health_monitor.stop()
+    await metrics_aggregator.stop()
+    await trace_exporter.stop()
+    await vllm_service.close()
+    await session_store.close()
+    if rate_limit_backend is not None:
+        await rate_limit_backend.close()
 
 # Crear aplicación FastAPI
 app = FastAPI(
     title=settings.APP_NAME,
     version=settings.APP_VERSION,
     description="API REST para chatbot educativo con IA",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
 )
+# Parsear los cuerpos JSON con orjson (antes de declarar las rutas)
+app.router.route_class = FastJSONRoute
+
+# ==================== RATE LIMITING ====================
+
+# Identificación de clientes (rate limiting y tenants de la cola de admisión)
+client_identity = create_client_identity()
+
+# Se registra antes que CORS para que las respuestas 429 lleven cabeceras CORS
+rate_limit_backend = create_rate_limit_backend() if settings.RATE_LIMIT_ENABLED else None
+if rate_limit_backend is not None:
+    app.add_middleware(
+        RateLimitMiddleware,
+        backend=rate_limit_backend,
+        requests=settings.RATE_LIMIT_REQUESTS,
+        period=settings.RATE_LIMIT_PERIOD,
+        paths=settings.RATE_LIMIT_PATHS,
+        identity=client_identity
+    )
 
 # ==================== CORS ====================
 
@@ -65,12 +131,24 @@ app.add_middleware(
     expose_headers=["*"],
     max_age=3600,  # Cache de preflight por 1 hora
 )
+
+# ==================== MÉTRICAS ====================
+
+# Registrado al final para medir también las respuestas 429 y los preflight
+app.add_middleware(MetricsMiddleware, metrics=metrics)
+
+# ==================== TRAZAS ====================
+
+# El más externo: la traza cubre todos los demás middlewares
+if settings.TRACING_ENABLED:
+    app.add_middleware(TracingMiddleware, exporter=trace_exporter)
+
 # Exception handler global
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     """Manejar excepciones no capturadas"""
     logger.error(f"Error no manejado: {exc}", exc_info=True)
-    return JSONResponse(
+    return FastJSONResponse(
         status_code=500,
         content=ErrorResponse(
             error="Error interno del servidor",
@@ -91,15 +169,25 @@ async def root():
     }
 
 @app.get("/health", response_model=HealthResponse, tags=["Health"])
-async def health_check():
+async def health_check(response: Response):
     """
     Verificar el estado de la API y sus dependencias
+    
+    Responde desde el último sondeo del monitor de salud, sin llamar a vLLM.
+    Mientras se calienta vLLM al arrancar devuelve 503 (no listo).
     """
-    vllm_healthy = await vllm_service.check_health()
+    monitor = vllm_service.health_monitor
+    vllm_healthy = bool(monitor.healthy)
+    if not warmup.ready:
+        response.status_code = 503
     
     return HealthResponse(
-        status="ok" if vllm_healthy else "degraded",
+        status=("ok" if vllm_healthy else "degraded") if warmup.ready else "warming_up",
         vllm_status="connected" if vllm_healthy else "disconnected",
+        vllm_last_check=monitor.last_checked,
+        circuit_breaker=vllm_service.router.breaker_state,
+        ready=warmup.ready,
+        warmup=warmup.state,
         version=settings.APP_VERSION
     )
 
@@ -118,81 +206,436 @@ async def list_models():
             detail="No se pudo obtener la lista de modelos"
         )
 
+def _upstream_http_exception(exc: Exception) -> HTTPException:
+    """Traducir un error de la llamada a vLLM en una respuesta HTTP"""
+    if isinstance(exc, CircuitOpenError):
+        logger.warning("🔌 Circuito abierto: vLLM no disponible")
+        return HTTPException(
+            status_code=503,
+            detail="El modelo no está disponible en este momento",
+            headers={"Retry-After": str(max(1, int(exc.retry_after)))}
+        )
+    if isinstance(exc, AdmissionRejected):
+        logger.warning(f"🚦 Petición rechazada por control de admisión: {exc.reason}")
+        return HTTPException(
+            status_code=503,
+            detail="El servidor está saturado, intenta de nuevo en unos segundos",
+            headers={"Retry-After": str(max(1, int(exc.retry_after)))}
+        )
+    if isinstance(exc, PromptTooLong):
+        logger.warning(f"📏 Prompt demasiado largo: {exc.prompt_tokens} tokens (máximo {exc.max_prompt_tokens})")
+        return HTTPException(
+            status_code=413,
+            detail=f"{exc}; acorta el mensaje"
+        )
+    if isinstance(exc, httpx.TimeoutException):
+        logger.error("⏱️  Timeout esperando respuesta de vLLM")
+        return HTTPException(
+            status_code=504,
+            detail="El modelo tardó demasiado en responder"
+        )
+    if isinstance(exc, httpx.HTTPStatusError):
+        logger.error(f"❌ Error HTTP de vLLM: {exc}")
+        return HTTPException(
+            status_code=exc.response.status_code,
+            detail=f"Error del servidor vLLM: {exc.response.text}"
+        )
+    logger.error(f"❌ Error inesperado: {exc}", exc_info=True)
+    return HTTPException(
+        status_code=500,
+        detail=f"Error procesando la solicitud: {str(exc)}"
+    )
+
+def _scheduling(http_request: Request, requested: Optional[str], default: str) -> Tuple[str, str]:
+    """
+    Devolver (prioridad, tenant) para la cola de admisión
+    
+    La prioridad pedida no puede superar la de la X-API-Key en
+    PRIORITY_API_KEYS (sin clave, PRIORITY_DEFAULT). El tenant es el cliente
+    (API key conocida o IP); solo las claves de TENANT_HEADER_API_KEYS pueden
+    subdividirlo con la cabecera X-Tenant-ID (p. ej. un aula), para que nadie
+    gane turnos inventando un tenant distinto en cada petición.
+    """
+    priorities = vllm_service.admission.priorities
+    scope = http_request.scope
+    api_key = client_identity.api_key(scope)
+    ceiling = settings.PRIORITY_API_KEYS.get(api_key, settings.PRIORITY_DEFAULT)
+    priority = priorities[max(priorities.index(requested or default), priorities.index(ceiling))]
+    tenant = client_identity(scope)
+    sub_tenant = http_request.headers.get("x-tenant-id")
+    if sub_tenant and api_key in settings.TENANT_HEADER_API_KEYS:
+        tenant = f"{tenant}/{sub_tenant}"
+    return priority, tenant
+
+def _sse(event: str, data: dict) -> str:
+    """Formatear un evento Server-Sent Events"""
+    return f"event: {event}\ndata: {fast_json.dumps(data).decode()}\n\n"
+
+async def _resolve_history(request: ChatRequest):
+    """
+    Devolver (session_id, historial) para la petición
+    
+    Si el cliente envía `conversation_history` se usa tal cual y no se guarda
+    nada. Con `session_id` el historial sale del almacén de sesiones y con
+    `"session": true` se crea una sesión nueva. Sin nada de eso la petición no
+    tiene estado: no se crea ninguna sesión que solo se usaría una vez.
+    """
+    if request.conversation_history is not None:
+        return request.session_id, request.conversation_history
+    if request.session_id is None:
+        if not request.session:
+            return None, None
+        return new_session_id(), []
+    with span("session"):
+        return request.session_id, await session_store.get(request.session_id)
+
+async def _save_turn(session_id, request: ChatRequest, answer: str) -> None:
+    """Guardar el turno completado en la sesión"""
+    if session_id is None or request.conversation_history is not None:
+        return
+    with span("session.save"):
+        await session_store.append(session_id, [
+            ChatMessage.model_construct(role="user", content=request.message),
+            ChatMessage.model_construct(role="assistant", content=answer)
+        ])
+
+def _chat_response(result: dict, session_id=None) -> dict:
+    """
+    Cuerpo de la respuesta de /chat (campos de ChatResponse)
+    
+    Se construye como dict sin pasar por la validación de Pydantic: todos los
+    campos salen de vllm_service y ya tienen el tipo correcto.
+    """
+    usage = result.get("usage", {})
+    return {
+        "response": result["response"],
+        "model": result["model"],
+        "tokens_used": usage.get("total_tokens", 0),
+        "prompt_tokens": usage.get("prompt_tokens", 0),
+        "completion_tokens": usage.get("completion_tokens", 0),
+        "latency_seconds": result["latency_seconds"],
+        "ttft_seconds": result.get("ttft_seconds"),
+        "cached": result.get("cached", False),
+        "session_id": session_id,
+        "timestamp": datetime.now()
+    }
+
 @app.post("/chat", response_model=ChatResponse, tags=["Chat"])
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request):
     """
     Endpoint principal para chatear con el modelo
     
     - **message**: Mensaje del usuario (requerido)
     - **conversation_history**: Historial de mensajes previos (opcional)
+    - **session_id**: Sesión del servidor con el historial (opcional)
+    - **session**: Si es true y no hay `session_id`, crear una sesión y
+      devolverla en la respuesta
     - **max_tokens**: Máximo de tokens a generar (default: 500)
     - **temperature**: Temperatura de generación (default: 0.7)
+    - **stream**: Si es true, responde como Server-Sent Events (igual que /chat/stream)
+    - **priority**: Clase de prioridad si vLLM está saturado (default: interactive)
     """
+    if request.stream:
+        return await chat_stream(request, http_request)
+    
+    # Desde el inicio de la petición: middlewares, lectura del cuerpo y validación
+    record_since_start("validation")
     try:
         logger.info(f"📨 Nueva pregunta: {request.message[:50]}...")
         
+        session_id, history = await _resolve_history(request)
+        priority, tenant = _scheduling(http_request, request.priority, settings.PRIORITY_DEFAULT)
+        
         # Llamar al servicio vLLM
         result = await vllm_service.chat_completion(
             message=request.message,
-            conversation_history=request.conversation_history,
+            conversation_history=history,
             max_tokens=request.max_tokens,
             temperature=request.temperature,
-            stream=request.stream
+            session_id=session_id,
+            priority=priority,
+            tenant=tenant
         )
         
-        # Construir respuesta
-        usage = result.get("usage", {})
-        
-        response = ChatResponse(
-            response=result["response"],
-            model=result["model"],
-            tokens_used=usage.get("total_tokens", 0),
-            prompt_tokens=usage.get("prompt_tokens", 0),
-            completion_tokens=usage.get("completion_tokens", 0),
-            latency_seconds=result["latency_seconds"]
-        )
+        await _save_turn(session_id, request, result["response"])
         
         logger.info(f"✅ Respuesta generada en {result['latency_seconds']}s")
-        return response
+        # Devolver la respuesta ya serializada evita que FastAPI la revalide
+        # contra response_model
+        with span("serialize"):
+            return FastJSONResponse(_chat_response(result, session_id))
         
-    except httpx.TimeoutException:
-        logger.error("⏱️  Timeout esperando respuesta de vLLM")
-        raise HTTPException(
-            status_code=504,
-            detail="El modelo tardó demasiado en responder"
-        )
-    except httpx.HTTPStatusError as e:
-        logger.error(f"❌ Error HTTP de vLLM: {e}")
-        raise HTTPException(
-            status_code=e.response.status_code,
-            detail=f"Error del servidor vLLM: {e.response.text}"
-        )
     except Exception as e:
-        logger.error(f"❌ Error inesperado: {e}", exc_info=True)
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error procesando la solicitud: {str(e)}"
+        raise _upstream_http_exception(e)
+
+@app.post("/chat/stream", tags=["Chat"])
+async def chat_stream(request: ChatRequest, http_request: Request):
+    """
+    Chat con streaming de tokens vía Server-Sent Events
+    
+    Emite eventos `delta` con cada fragmento de texto, un evento final `done`
+    con el mismo contenido que /chat más `ttft_seconds`, o un evento `error`
+    si la generación falla a mitad de camino.
+    """
+    record_since_start("validation")
+    logger.info(f"📨 Nueva pregunta (stream): {request.message[:50]}...")
+    
+    session_id, history = await _resolve_history(request)
+    priority, tenant = _scheduling(http_request, request.priority, settings.PRIORITY_DEFAULT)
+    events = vllm_service.chat_completion_stream(
+        message=request.message,
+        conversation_history=history,
+        max_tokens=request.max_tokens,
+        temperature=request.temperature,
+        session_id=session_id,
+        priority=priority,
+        tenant=tenant
+    )
+    
+    # Esperar el primer evento antes de responder para poder devolver
+    # errores de conexión/HTTP de vLLM con su código de estado real
+    try:
+        first = await events.__anext__()
+    except Exception as e:
+        await events.aclose()
+        raise _upstream_http_exception(e)
+    
+    async def event_source():
+        parts = []
+        event = first
+        try:
+            while True:
+                if event["type"] == "delta":
+                    parts.append(event["content"])
+                    yield _sse("delta", {"content": event["content"]})
+                else:
+                    response = _chat_response(
+                        {**event, "response": "".join(parts).strip()}, session_id
+                    )
+                    await _save_turn(session_id, request, response["response"])
+                    logger.info(
+                        f"✅ Stream completado en {event['latency_seconds']}s "
+                        f"(TTFT {event['ttft_seconds']}s)"
+                    )
+                    yield _sse("done", response)
+                event = await events.__anext__()
+        except StopAsyncIteration:
+            pass
+        except Exception as e:
+            logger.error(f"❌ Error durante el streaming: {e}", exc_info=True)
+            yield _sse("error", ErrorResponse(
+                error="Error durante la generación",
+                detail=str(e) if settings.DEBUG else None
+            ).model_dump(mode="json"))
+        finally:
+            await events.aclose()
+    
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # Desactivar buffering en nginx
+        }
+    )
+
+@app.post("/chat/batch", tags=["Chat"])
+async def chat_batch(batch: BatchChatRequest, http_request: Request):
+    """
+    Procesar muchas peticiones de chat con paralelismo acotado
+    
+    Responde en NDJSON a medida que terminan (orden de finalización): una línea
+    `{"type": "result", "index": i, "status": "ok", "result": {...}}` o
+    `{"type": "result", "index": i, "status": "error", "status_code": ..., "error": ...}`
+    por petición y una línea final `{"type": "summary", ...}` con el
+    rendimiento agregado. Cada petición es independiente: se usa su
+    `conversation_history` y se ignoran `session_id` y `stream`.
+    
+    Por defecto las peticiones del lote van a vLLM con prioridad `batch`, por
+    detrás del chat interactivo.
+    """
+    record_since_start("validation")
+    concurrency = min(batch.concurrency or settings.BATCH_MAX_CONCURRENCY, settings.BATCH_MAX_CONCURRENCY)
+    semaphore = asyncio.Semaphore(concurrency)
+    logger.info(f"📦 Lote de {len(batch.requests)} peticiones (concurrencia {concurrency})")
+    
+    default_priority = batch.priority or settings.PRIORITY_BATCH_DEFAULT
+    
+    async def run_item(index: int, item: ChatRequest) -> dict:
+        priority, tenant = _scheduling(http_request, item.priority, default_priority)
+        async with semaphore:
+            try:
+                result = await vllm_service.chat_completion(
+                    message=item.message,
+                    conversation_history=item.conversation_history,
+                    max_tokens=item.max_tokens,
+                    temperature=item.temperature,
+                    priority=priority,
+                    tenant=tenant
+                )
+            except Exception as e:
+                error = _upstream_http_exception(e)
+                return {
+                    "type": "result",
+                    "index": index,
+                    "status": "error",
+                    "status_code": error.status_code,
+                    "error": error.detail
+                }
+        return {
+            "type": "result",
+            "index": index,
+            "status": "ok",
+            "result": _chat_response(result)
+        }
+    
+    async def lines():
+        start_time = time.perf_counter()
+        succeeded = failed = completion_tokens = 0
+        tasks = [asyncio.create_task(run_item(i, item)) for i, item in enumerate(batch.requests)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                line = await next_done
+                if line["status"] == "ok":
+                    succeeded += 1
+                    completion_tokens += line["result"]["completion_tokens"]
+                else:
+                    failed += 1
+                yield fast_json.dumps(line) + b"\n"
+        finally:
+            # Si el cliente se desconecta no seguir generando
+            for task in tasks:
+                task.cancel()
+        
+        elapsed = time.perf_counter() - start_time
+        logger.info(f"✅ Lote completado: {succeeded} ok, {failed} con error en {elapsed:.2f}s")
+        yield fast_json.dumps({
+            "type": "summary",
+            "total": len(batch.requests),
+            "succeeded": succeeded,
+            "failed": failed,
+            "concurrency": concurrency,
+            "elapsed_seconds": round(elapsed, 3),
+            "requests_per_second": round(len(batch.requests) / elapsed, 2) if elapsed else None,
+            "completion_tokens_per_second": round(completion_tokens / elapsed, 1) if elapsed else None
+        }) + b"\n"
+    
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"X-Accel-Buffering": "no"}
+    )
+
+@app.post("/tokenize", response_model=TokenizeResponse, tags=["Chat"])
+async def tokenize(request: TokenizeRequest):
+    """
+    Contar los tokens de una petición de chat sin enviarla a vLLM
+    
+    Aplica la misma comprobación previa que /chat: recorta el historial
+    (`conversation_history` o el de `session_id`), ajusta `max_tokens` a la
+    ventana de contexto e indica si la petición se rechazaría (`fits`).
+    """
+    history = request.conversation_history
+    if history is None and request.session_id:
+        history = await session_store.get(request.session_id)
+    
+    preflight = vllm_service.preflight
+    message_tokens = vllm_service.token_counter.count_text(request.message)
+    try:
+        plan = preflight.plan(request.message, history, request.max_tokens, record=False)
+    except PromptTooLong as e:
+        return TokenizeResponse(
+            fits=False,
+            message_tokens=message_tokens,
+            prompt_tokens=e.prompt_tokens,
+            max_tokens=0,
+            requested_max_tokens=request.max_tokens,
+            history_messages=0,
+            dropped_messages=len(history or []),
+            context_length=preflight.max_model_len,
+            tokenizer=vllm_service.token_counter.backend
         )
+    return TokenizeResponse(
+        fits=True,
+        message_tokens=message_tokens,
+        prompt_tokens=plan.prompt_tokens,
+        max_tokens=plan.max_tokens,
+        requested_max_tokens=plan.requested_max_tokens,
+        history_messages=len(plan.messages) - 2,
+        dropped_messages=plan.dropped_messages,
+        context_length=preflight.max_model_len,
+        tokenizer=vllm_service.token_counter.backend
+    )
+
+@app.delete("/sessions/{session_id}", tags=["Chat"])
+async def delete_session(session_id: str):
+    """Borrar el historial de una sesión"""
+    await session_store.delete(session_id)
+    return {"session_id": session_id, "deleted": True}
 
 @app.get("/stats", tags=["Stats"])
 async def get_stats():
     """
-    Obtener estadísticas del servidor (futuro)
+    Obtener estadísticas del servidor: peticiones, latencias (p50/p95/p99),
+    tokens/s, concurrencia y estado de la caché
+    
+    Las métricas de peticiones y tokens son de todos los workers si
+    METRICS_BACKEND=redis; el resto (admisión, réplicas, reintentos) son del
+    worker que atiende la petición.
     """
+    server_metrics = await metrics_aggregator.collect()
     return {
-        "message": "Stats endpoint - Por implementar",
-        "timestamp": datetime.now()
+        "timestamp": datetime.now(),
+        **server_metrics.snapshot(),
+        "workers": {
+            "configured": settings.WORKERS,
+            "state_backends": state_backends(),
+            "metrics": metrics_aggregator.stats()
+        },
+        "response_cache": vllm_service.cache.stats() if vllm_service.cache else None,
+        "semantic_cache": vllm_service.semantic_cache.stats() if vllm_service.semantic_cache else None,
+        "singleflight": vllm_service.singleflight.stats() if vllm_service.singleflight else None,
+        "admission": vllm_service.admission.stats(),
+        "health": vllm_service.health_monitor.stats(),
+        "warmup": warmup.stats(),
+        "upstreams": vllm_service.router.stats(),
+        "retries": vllm_service.retry_policy.stats(),
+        "tokenizer": vllm_service.token_counter.stats(),
+        "preflight": vllm_service.preflight.stats(),
+        "sessions": await session_store.stats(),
+        "tracing": trace_exporter.stats() if settings.TRACING_ENABLED else None
     }
 
+@app.get("/metrics", response_class=PlainTextResponse, tags=["Stats"])
+async def get_metrics():
+    """
+    Métricas en formato de texto de Prometheus
+    """
+    server_metrics = await metrics_aggregator.collect()
+    lines = (
+        vllm_service.admission.prometheus()
+        + vllm_service.router.prometheus()
+        + vllm_service.preflight.prometheus()
+    )
+    if vllm_service.semantic_cache is not None:
+        lines += vllm_service.semantic_cache.prometheus()
+    return PlainTextResponse(
+        server_metrics.prometheus() + "\n".join(lines) + "\n",
+        media_type="text/plain; version=0.0.4"
+    )
+
 # ==================== MAIN ====================
 
 if __name__ == "__main__":
     import uvicorn  # ← AGREGAR ESTA LÍNEA
     
+    # Con varios workers (o reload) uvicorn necesita la app como "módulo:atributo"
+    # para importarla en cada proceso; reload solo funciona con un worker
     uvicorn.run(
-        app,  # Referencia directa al objeto app
+        "app:app",
         host=settings.HOST,
         port=settings.PORT,
-        reload=settings.DEBUG,
+        workers=settings.WORKERS,
+        reload=settings.DEBUG and settings.WORKERS == 1,
         log_level="info"
     )
@@ -0,0 +1,285 @@
+"""
+Procesar un fichero JSONL de prompts contra vLLM con checkpoints reanudables
+
+Cada línea de entrada es un objeto JSON con el prompt en `--field` (por defecto
+"message") y opcionalmente `max_tokens` / `temperature`. Se escribe una línea
+de resultado por línea de entrada, en orden de finalización, con su número de
+línea (desde 0) y su estado.
+
+La entrada se lee de forma perezosa y solo hay `--concurrency` peticiones en
+vuelo, así que la memoria no depende del tamaño del fichero. El progreso se
+guarda en `<output>.ckpt`; si la ejecución se interrumpe, volver a lanzar el
+mismo comando continúa donde se quedó.
+
+Uso:
+    python batch_runner.py prompts.jsonl -o results.jsonl --concurrency 32
+    python batch_runner.py ../requests.jsonl -o out.jsonl --field body --id-field request_id
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from typing import Dict, Optional, Set
+
+from config import settings
+from services.vllm_service import VLLMService
+
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint:
+    """
+    Progreso reanudable de una ejecución
+
+    Los resultados terminan fuera de orden, así que se guarda una marca de
+    agua: todas las líneas anteriores a `line` están hechas. Las líneas
+    posteriores ya escritas (las que adelantaron a alguna petición más lenta)
+    se guardan aparte en `done`. `input_offset` y `output_size` permiten saltar
+    directamente a la marca en la entrada y descartar escrituras posteriores
+    al último checkpoint.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.line = 0
+        self.input_offset = 0
+        self.output_size = 0
+        self.done: Set[int] = set()
+        self.ok = 0
+        self.errors = 0
+
+    def load(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, encoding="utf-8") as f:
+            data = json.load(f)
+        self.line = data["line"]
+        self.input_offset = data["input_offset"]
+        self.output_size = data["output_size"]
+        self.done = set(data["done"])
+        self.ok = data.get("ok", 0)
+        self.errors = data.get("errors", 0)
+        return True
+
+    def save(self) -> None:
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({
+                "line": self.line,
+                "input_offset": self.input_offset,
+                "output_size": self.output_size,
+                "done": sorted(self.done),
+                "ok": self.ok,
+                "errors": self.errors,
+            }, f)
+        os.replace(tmp, self.path)
+
+
+class BatchRunner:
+    """Mantiene `concurrency` peticiones en vuelo sobre una entrada JSONL"""
+
+    def __init__(
+        self,
+        service: VLLMService,
+        input_path: str,
+        output_path: str,
+        concurrency: int = 16,
+        field: str = "message",
+        id_field: Optional[str] = None,
+        max_tokens: int = settings.DEFAULT_MAX_TOKENS,
+        temperature: float = settings.DEFAULT_TEMPERATURE,
+        checkpoint_every: float = 5.0
+    ):
+        self.service = service
+        self.input_path = input_path
+        self.output_path = output_path
+        self.concurrency = concurrency
+        self.field = field
+        self.id_field = id_field
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint = Checkpoint(f"{output_path}.ckpt")
+        self.total_lines: Optional[int] = None
+
+        # Líneas en vuelo: número de línea -> offset en la entrada
+        self._pending: Dict[int, int] = {}
+        self._completed_tokens = 0
+        self._processed = 0
+
+    async def _process(self, line_no: int, raw: bytes) -> Dict:
+        result = {"line": line_no}
+        try:
+            item = json.loads(raw)
+            if self.id_field:
+                result["id"] = item.get(self.id_field)
+            completion = await self.service.chat_completion(
+                message=item[self.field],
+                max_tokens=item.get("max_tokens", self.max_tokens),
+                temperature=item.get("temperature", self.temperature)
+            )
+        except Exception as e:
+            result.update(status="error", error=f"{type(e).__name__}: {e}")
+            return result
+
+        self._completed_tokens += completion["usage"].get("completion_tokens", 0)
+        result.update(
+            status="ok",
+            response=completion["response"],
+            usage=completion["usage"],
+            latency_seconds=completion["latency_seconds"]
+        )
+        return result
+
+    def _advance(self, output) -> None:
+        """Mover la marca de agua sobre las líneas consecutivas ya terminadas"""
+        ckpt = self.checkpoint
+        while ckpt.line in ckpt.done:
+            ckpt.done.remove(ckpt.line)
+            ckpt.line += 1
+        # Offset de la primera línea no terminada (o el fin de lo leído)
+        ckpt.input_offset = self._pending.get(ckpt.line, self._read_offset)
+        output.flush()
+        os.fsync(output.fileno())
+        ckpt.output_size = output.tell()
+
+    async def run(self) -> None:
+        ckpt = self.checkpoint
+        resumed = ckpt.load()
+        total = None if self.total_lines is None else self.total_lines - ckpt.line - len(ckpt.done)
+
+        mode = "r+b" if resumed and os.path.exists(self.output_path) else "wb"
+        with open(self.input_path, "rb") as source, open(self.output_path, mode) as output:
+            if resumed:
+                output.truncate(ckpt.output_size)
+                output.seek(ckpt.output_size)
+                source.seek(ckpt.input_offset)
+                logger.info(f"↩️  Reanudando desde la línea {ckpt.line} ({len(ckpt.done)} posteriores ya hechas)")
+
+            self._read_offset = source.tell()
+            line_no = ckpt.line
+            tasks: Set[asyncio.Task] = set()
+            start_time = last_report = last_save = time.monotonic()
+            eof = False
+
+            while tasks or not eof:
+                # Rellenar hasta `concurrency` peticiones en vuelo
+                while not eof and len(tasks) < self.concurrency:
+                    offset = source.tell()
+                    raw = source.readline()
+                    if not raw:
+                        eof = True
+                        break
+                    self._read_offset = source.tell()
+                    current, line_no = line_no, line_no + 1
+                    if current in ckpt.done or not raw.strip():
+                        ckpt.done.add(current)
+                        continue
+                    self._pending[current] = offset
+                    tasks.add(asyncio.create_task(self._process(current, raw)))
+
+                if not tasks:
+                    continue
+                finished, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    result = task.result()
+                    output.write(json.dumps(result, ensure_ascii=False).encode("utf-8") + b"\n")
+                    del self._pending[result["line"]]
+                    ckpt.done.add(result["line"])
+                    if result["status"] == "ok":
+                        ckpt.ok += 1
+                    else:
+                        ckpt.errors += 1
+                    self._processed += 1
+
+                now = time.monotonic()
+                if now - last_save >= self.checkpoint_every:
+                    self._advance(output)
+                    ckpt.save()
+                    last_save = now
+                if now - last_report >= 1.0:
+                    self._report(now - start_time, total)
+                    last_report = now
+
+            self._advance(output)
+            ckpt.save()
+            self._report(time.monotonic() - start_time, total, final=True)
+
+    def _report(self, elapsed: float, total: Optional[int], final: bool = False) -> None:
+        rate = self._processed / elapsed if elapsed else 0.0
+        tokens = self._completed_tokens / elapsed if elapsed else 0.0
+        progress = f"{self._processed}"
+        eta = ""
+        if total:
+            progress += f"/{total} ({self._processed / total:.1%})"
+            if rate and not final:
+                eta = f" ETA {(total - self._processed) / rate:,.0f}s"
+        line = (
+            f"{progress} | {rate:.1f} req/s | {tokens:.0f} tok/s | "
+            f"ok={self.checkpoint.ok} error={self.checkpoint.errors}{eta}"
+        )
+        end = "\n" if final else ""
+        print(f"\r{line}\033[K", end=end, file=sys.stderr, flush=True)
+
+
+def count_lines(path: str) -> int:
+    """Contar líneas en bloques (memoria constante)"""
+    lines = 0
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            lines += block.count(b"\n")
+    return lines
+
+
+async def main_async(args) -> None:
+    service = VLLMService()
+    # Cada prompt es distinto: la caché y la coalescencia solo gastarían memoria
+    service.cache = None
+    service.singleflight = None
+    service.semantic_cache = None
+    await service.start()
+    try:
+        runner = BatchRunner(
+            service,
+            args.input,
+            args.output,
+            concurrency=args.concurrency,
+            field=args.field,
+            id_field=args.id_field,
+            max_tokens=args.max_tokens,
+            temperature=args.temperature,
+            checkpoint_every=args.checkpoint_every
+        )
+        if not args.no_count:
+            runner.total_lines = count_lines(args.input)
+        await runner.run()
+    finally:
+        await service.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="Fichero JSONL de entrada")
+    parser.add_argument("-o", "--output", required=True, help="Fichero JSONL de resultados")
+    parser.add_argument("-c", "--concurrency", type=int, default=settings.BATCH_MAX_CONCURRENCY)
+    parser.add_argument("--field", default="message", help="Campo con el prompt")
+    parser.add_argument("--id-field", default=None, help="Campo a copiar como id en el resultado")
+    parser.add_argument("--max-tokens", type=int, default=settings.DEFAULT_MAX_TOKENS)
+    parser.add_argument("--temperature", type=float, default=settings.DEFAULT_TEMPERATURE)
+    parser.add_argument("--checkpoint-every", type=float, default=5.0, help="Segundos entre checkpoints")
+    parser.add_argument("--no-count", action="store_true", help="No contar las líneas (sin ETA)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    # El admission controller no debe rechazar trabajo propio (un solo proceso)
+    settings.WORKERS = 1
+    settings.ADMISSION_MAX_CONCURRENCY = max(settings.ADMISSION_MAX_CONCURRENCY, args.concurrency)
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
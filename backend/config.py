@@ -3,6 +3,7 @@ Configuración del backend
 """
 import os
 from typing import Optional
+from pydantic import model_validator
 from pydantic_settings import BaseSettings  # ✅ Correcto para pydantic v2.11+
 
 class Settings(BaseSettings):
@@ -17,20 +18,155 @@ class Settings(BaseSettings):
     HOST: str = "0.0.0.0"
     PORT: int = 8000
     
+    # Procesos del servidor (WORKERS > 1 requiere STATE_BACKEND=redis)
+    WORKERS: int = 1
+    STATE_BACKEND: str = "memory"  # "memory" (por proceso) o "redis" (compartido entre workers)
+    REDIS_URL: str = "redis://localhost:6379/0"
+    METRICS_BACKEND: Optional[str] = None  # Por defecto STATE_BACKEND
+    METRICS_PUBLISH_INTERVAL: float = 5.0  # Segundos entre publicaciones de cada worker
+    
     # vLLM Settings
     VLLM_API_URL: str = "http://localhost:8080"
     VLLM_MODEL_NAME: str = "/home/honores/.local/share/instructlab/checkpoints/hf_format/samples_0"
     VLLM_TIMEOUT: int = 120
     
+    # Varias réplicas de vLLM (si está vacío se usa solo VLLM_API_URL)
+    VLLM_API_URLS: list = []
+    UPSTREAM_AFFINITY_ENABLED: bool = True  # Misma conversación/prefijo → misma réplica
+    UPSTREAM_AFFINITY_LOAD_FACTOR: float = 1.5  # Carga máxima respecto a la media
+    UPSTREAM_AFFINITY_MIN_LOAD: int = 16  # Peticiones en curso por debajo de las que no se desborda
+    
+    # Pool de conexiones HTTP hacia vLLM
+    VLLM_POOL_MAX_CONNECTIONS: int = 100
+    VLLM_POOL_MAX_KEEPALIVE: int = 20
+    VLLM_KEEPALIVE_EXPIRY: float = 30.0
+    VLLM_HTTP2: bool = False  # Requiere el paquete h2 (httpx[http2])
+    
+    # Monitor de salud de vLLM (sondeo en segundo plano)
+    HEALTH_CHECK_INTERVAL: float = 10.0
+    HEALTH_CHECK_JITTER: float = 0.2  # Fracción aleatoria del intervalo
+    HEALTH_CHECK_TIMEOUT: float = 5.0
+    HEALTH_FAILURE_THRESHOLD: int = 2  # Sondeos fallidos seguidos para marcar caída
+    
+    # Circuit breaker y reintentos hacia vLLM
+    BREAKER_FAILURE_THRESHOLD: int = 5  # Fallos seguidos para abrir el circuito
+    BREAKER_RESET_TIMEOUT: float = 10.0  # Segundos en open antes de probar (half-open)
+    BREAKER_PROBE_INTERVAL: float = 1.0  # Una llamada de prueba por intervalo en half-open
+    UPSTREAM_MAX_RETRIES: int = 2  # Solo errores de conexión/transporte y 502/503/504
+    UPSTREAM_RETRY_BASE_DELAY: float = 0.2
+    UPSTREAM_RETRY_MAX_DELAY: float = 2.0
+    UPSTREAM_RETRY_BUDGET_RATIO: float = 0.2  # Reintentos por petición original
+    UPSTREAM_RETRY_BUDGET_MIN_PER_SECOND: float = 1.0
+    
+    # Control de admisión hacia vLLM (concurrencia y cola de espera; totales,
+    # se reparten entre los WORKERS)
+    ADMISSION_MAX_CONCURRENCY: int = 32
+    ADMISSION_MAX_QUEUE: int = 128
+    ADMISSION_MAX_QUEUE_TIME: float = 30.0
+    ADMISSION_ADAPTIVE: bool = False  # Ajustar el límite con AIMD según la latencia
+    ADMISSION_MIN_CONCURRENCY: int = 4
+    ADMISSION_TARGET_LATENCY: float = 10.0
+    
+    # Prioridades en la cola de admisión (en orden de mayor a menor; el peso
+    # es la parte de los huecos que recibe cada clase cuando hay cola)
+    PRIORITY_WEIGHTS: dict = {"interactive": 8, "batch": 2, "background": 1}
+    PRIORITY_DEFAULT: str = "interactive"  # /chat y /chat/stream
+    PRIORITY_BATCH_DEFAULT: str = "batch"  # /chat/batch
+    PRIORITY_API_KEYS: dict = {}  # X-API-Key -> prioridad máxima que puede pedir
+    # Claves que pueden repartir su tráfico entre tenants con X-Tenant-ID (p. ej.
+    # una plataforma que agrupa varias aulas); para el resto el tenant es el cliente
+    TENANT_HEADER_API_KEYS: list = []
+    
+    # Calentamiento al arrancar (/health responde 503 hasta terminar); el
+    # tokenizer y las cachés se cargan siempre, WARMUP_ENABLED añade las
+    # peticiones sintéticas a vLLM
+    WARMUP_ENABLED: bool = True
+    WARMUP_REQUESTS: int = 8  # Por réplica
+    WARMUP_CONCURRENCY: int = 4
+    WARMUP_CONNECTIONS: int = 8  # Conexiones abiertas por réplica (hasta VLLM_POOL_MAX_KEEPALIVE)
+    WARMUP_PROMPT_LENGTHS: list = [16, 128, 512]  # Palabras de los mensajes sintéticos
+    WARMUP_MAX_TOKENS: int = 16
+    WARMUP_TIMEOUT: float = 300.0  # Después se acepta tráfico igualmente
+    
     # Generation Settings
     DEFAULT_MAX_TOKENS: int = 500
     DEFAULT_TEMPERATURE: float = 0.7
     MAX_TOKENS_LIMIT: int = 2000
     
+    # Ventana de contexto e historial (--max-model-len de vLLM)
+    MAX_MODEL_LEN: int = 4096
+    # Tokenizer del modelo (tokenizer.json con el paquete `tokenizers`, o
+    # `transformers`); sin él, y mientras carga al arrancar, los conteos son
+    # una estimación de TOKENIZER_CHARS_PER_TOKEN caracteres por token
+    TOKENIZER_PATH: Optional[str] = None  # Por defecto VLLM_MODEL_NAME
+    TOKENIZER_CHARS_PER_TOKEN: float = 3.0
+    TOKEN_COUNT_CACHE_SIZE: int = 10000  # Conteos de mensajes memorizados
+    PROMPT_TEMPLATE_OVERHEAD: int = 16  # Tokens extra de la plantilla de chat
+    HISTORY_MAX_MESSAGES: Optional[int] = None  # Tope opcional además del presupuesto
+    # Comprobación previa: rechazar (413) prompts que no caben y ajustar
+    # max_tokens a lo que queda de la ventana antes de llamar a vLLM
+    PREFLIGHT_ENABLED: bool = True
+    PREFLIGHT_MIN_COMPLETION_TOKENS: int = 16  # Respuesta mínima que debe caber
+    
+    # Response Cache (solo peticiones deterministas, temperature=0)
+    RESPONSE_CACHE_ENABLED: bool = True
+    RESPONSE_CACHE_BACKEND: Optional[str] = None  # Por defecto STATE_BACKEND
+    RESPONSE_CACHE_MAX_ENTRIES: int = 1000
+    RESPONSE_CACHE_MAX_BYTES: int = 32 * 1024 * 1024
+    RESPONSE_CACHE_TTL: int = 3600
+    RESPONSE_CACHE_ALLOW_NONDETERMINISTIC: bool = False
+    
+    # Caché semántica: preguntas sin historial parecidas a una ya respondida
+    # (requiere numpy; con varios workers cada uno tiene la suya en memoria)
+    SEMANTIC_CACHE_ENABLED: bool = False
+    SEMANTIC_CACHE_THRESHOLD: float = 0.85  # Similitud coseno mínima
+    SEMANTIC_CACHE_MAX_ENTRIES: int = 5000
+    SEMANTIC_CACHE_TTL: int = 86400
+    SEMANTIC_CACHE_EMBEDDER: str = "hashing"  # O un modelo de sentence-transformers
+    SEMANTIC_CACHE_DIM: int = 512  # Solo "hashing" (potencia de 2)
+    SEMANTIC_CACHE_PATH: Optional[str] = None  # Prefijo de los ficheros .npy/.json
+    SEMANTIC_CACHE_SAVE_INTERVAL: float = 60.0
+    
+    # Coalescencia de peticiones idénticas en vuelo (mismas reglas que la caché)
+    SINGLEFLIGHT_ENABLED: bool = True
+    
+    # Chat por lotes (/chat/batch)
+    BATCH_MAX_ITEMS: int = 1000
+    BATCH_MAX_CONCURRENCY: int = 16  # Conviene no superar ADMISSION_MAX_CONCURRENCY
+    
+    # Sesiones de conversación en el servidor
+    SESSION_BACKEND: Optional[str] = None  # Por defecto STATE_BACKEND; también "sqlite"
+    SESSION_SQLITE_PATH: str = "sessions.db"
+    SESSION_TTL: int = 3600  # Segundos sin actividad antes de caducar
+    SESSION_MAX_MESSAGES: int = 50  # Mensajes guardados por sesión
+    SESSION_MAX_SESSIONS: int = 10000  # Solo memoria
+    SESSION_MAX_BYTES: int = 64 * 1024 * 1024  # Solo memoria
+    
+    # Claves de cliente (X-API-Key) reconocidas, además de las de
+    # PRIORITY_API_KEYS y TENANT_HEADER_API_KEYS; una clave desconocida se
+    # trata como si no viniera
+    API_KEYS: list = []
+    
     # Rate Limiting
     RATE_LIMIT_ENABLED: bool = True
     RATE_LIMIT_REQUESTS: int = 10
     RATE_LIMIT_PERIOD: int = 60
+    RATE_LIMIT_PATHS: list = ["/chat"]  # Prefijos de ruta limitados
+    RATE_LIMIT_BACKEND: Optional[str] = None  # Por defecto STATE_BACKEND
+    RATE_LIMIT_REDIS_URL: Optional[str] = None  # Por defecto REDIS_URL
+    RATE_LIMIT_MAX_KEYS: int = 10000  # Máximo de clientes en memoria
+    # X-Real-IP / X-Forwarded-For solo se usan si la conexión viene de uno de
+    # los proxies de confianza (IPs o redes CIDR, p. ej. el contenedor de nginx)
+    RATE_LIMIT_TRUST_PROXY: bool = False
+    RATE_LIMIT_TRUSTED_PROXIES: list = ["127.0.0.1", "::1"]
+    
+    # Trazas por petición (Server-Timing, X-Request-ID y exportación OTLP/JSON)
+    TRACING_ENABLED: bool = True
+    TRACING_EXPORTER: str = "none"  # "none", "file" (TRACING_FILE) u "otlp" (collector)
+    TRACING_FILE: str = "traces.jsonl"
+    TRACING_OTLP_ENDPOINT: str = "http://localhost:4318/v1/traces"
+    TRACING_SERVICE_NAME: str = "chatbot-backend"
+    TRACING_SAMPLE_RATE: float = 1.0  # Fracción de trazas exportadas
     
     # CORS
     CORS_ORIGINS: list = [
@@ -43,9 +179,26 @@ class Settings(BaseSettings):
     # System Prompt
     SYSTEM_PROMPT: str = "Eres un asistente experto en Inteligencia Artificial aplicada a la educación. Respondes de manera clara, precisa y pedagógica."
     
+    @model_validator(mode="after")
+    def validate_priorities(self):
+        """Las prioridades configuradas deben existir en PRIORITY_WEIGHTS"""
+        configured = {
+            "PRIORITY_DEFAULT": self.PRIORITY_DEFAULT,
+            "PRIORITY_BATCH_DEFAULT": self.PRIORITY_BATCH_DEFAULT,
+            **{f"PRIORITY_API_KEYS[{key!r}]": value for key, value in self.PRIORITY_API_KEYS.items()},
+        }
+        for name, priority in configured.items():
+            if priority not in self.PRIORITY_WEIGHTS:
+                raise ValueError(
+                    f"{name}={priority!r} no es una prioridad de PRIORITY_WEIGHTS "
+                    f"({', '.join(self.PRIORITY_WEIGHTS)})"
+                )
+        return self
+    
     model_config = {  # ✅ Cambiado de 'class Config' a 'model_config'
         "env_file": ".env",
-        "case_sensitive": True
+        "case_sensitive": True,
+        "extra": "ignore"  # El .env de la raíz también contiene variables de docker-compose
     }
 
 # Instancia global de configuración
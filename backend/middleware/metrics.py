@@ -0,0 +1,45 @@
+"""
+Middleware ASGI que registra conteos, estados y latencia extremo a extremo
+"""
+import time
+
+from services.metrics import Metrics
+
+
+class MetricsMiddleware:
+    """
+    Registrar cada petición HTTP en el registro de métricas
+
+    La latencia se mide hasta que se envía el último fragmento del cuerpo, por
+    lo que en las respuestas en streaming incluye toda la generación.
+    """
+
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+        self.metrics.request_started()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # El router de Starlette deja la ruta resuelta en el scope
+            route = scope.get("route")
+            self.metrics.request_finished(
+                route.path if route is not None else "other",
+                status,
+                time.perf_counter() - start
+            )
@@ -0,0 +1,286 @@
+"""
+Middleware ASGI de rate limiting con token bucket por cliente
+"""
+import json
+import math
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from ipaddress import ip_address, ip_network
+from typing import Iterable, NamedTuple, Optional
+
+from config import settings
+from models import ErrorResponse
+from services.state_backend import MEMORY, REDIS, create_redis, resolve_backend
+
+
+class RateLimitResult(NamedTuple):
+    """Resultado de consumir un token del bucket de un cliente"""
+    allowed: bool
+    remaining: int
+    retry_after: float
+
+
+class RateLimitBackend(ABC):
+    """Interfaz de almacenamiento de los buckets"""
+
+    @abstractmethod
+    async def hit(self, key: str, capacity: int, refill_rate: float) -> RateLimitResult:
+        """Consumir un token del bucket `key` (capacity tokens, refill_rate tokens/s)"""
+
+    async def close(self) -> None:
+        """Liberar recursos del backend"""
+
+
+class InMemoryRateLimitBackend(RateLimitBackend):
+    """
+    Buckets en memoria del proceso, O(1) por petición
+
+    Las claves se guardan en orden LRU. Un bucket inactivo durante más tiempo
+    del que tarda en rellenarse es equivalente a uno nuevo, así que se puede
+    descartar sin perder información; además nunca se superan `max_keys`.
+    """
+
+    def __init__(self, max_keys: int = 10000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    async def hit(self, key: str, capacity: int, refill_rate: float) -> RateLimitResult:
+        now = time.monotonic()
+        self._evict_idle(now, capacity / refill_rate)
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._buckets.popitem(last=False)
+            bucket = self._buckets[key] = [float(capacity), now]
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * refill_rate)
+            bucket[1] = now
+
+        if bucket[0] >= 1.0:
+            bucket[0] -= 1.0
+            return RateLimitResult(True, int(bucket[0]), 0.0)
+        return RateLimitResult(False, 0, (1.0 - bucket[0]) / refill_rate)
+
+    def _evict_idle(self, now: float, idle_after: float) -> None:
+        """Descartar como mucho dos buckets inactivos del inicio del LRU"""
+        for _ in range(2):
+            if not self._buckets:
+                return
+            key, (_, last_seen) = next(iter(self._buckets.items()))
+            if now - last_seen < idle_after:
+                return
+            del self._buckets[key]
+
+
+class RedisRateLimitBackend(RateLimitBackend):
+    """
+    Buckets compartidos en Redis para aplicar un único límite entre varios workers
+
+    El bucket se actualiza de forma atómica con un script Lua que usa el reloj
+    del propio Redis, y cada clave expira cuando el bucket estaría lleno.
+    """
+
+    SCRIPT = """
+    local capacity = tonumber(ARGV[1])
+    local rate = tonumber(ARGV[2])
+    local t = redis.call('TIME')
+    local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    local allowed = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+    redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+    return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, url: Optional[str] = None, prefix: str = "ratelimit:"):
+        self.prefix = prefix
+        self._redis = create_redis(url, setting="RATE_LIMIT_BACKEND")
+        self._script = self._redis.register_script(self.SCRIPT)
+
+    async def hit(self, key: str, capacity: int, refill_rate: float) -> RateLimitResult:
+        allowed, tokens = await self._script(keys=[self.prefix + key], args=[capacity, refill_rate])
+        tokens = float(tokens)
+        if allowed:
+            return RateLimitResult(True, int(tokens), 0.0)
+        return RateLimitResult(False, 0, (1.0 - tokens) / refill_rate)
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+
+def create_rate_limit_backend() -> RateLimitBackend:
+    """Crear el backend configurado en RATE_LIMIT_BACKEND (o STATE_BACKEND)"""
+    backend = resolve_backend(settings.RATE_LIMIT_BACKEND)
+    if backend == REDIS:
+        return RedisRateLimitBackend(settings.RATE_LIMIT_REDIS_URL)
+    if backend == MEMORY:
+        return InMemoryRateLimitBackend(max_keys=settings.RATE_LIMIT_MAX_KEYS)
+    raise ValueError(f"RATE_LIMIT_BACKEND desconocido: {backend}")
+
+
+class ClientIdentity:
+    """
+    Identificar al cliente de una petición: "key:<X-API-Key>" o "ip:<IP>"
+
+    Solo se acepta como identidad una X-API-Key de `api_keys`; cualquier otra
+    se ignora y se usa la IP, para que cambiar de clave en cada petición no
+    dé un bucket nuevo. Las cabeceras X-Real-IP / X-Forwarded-For solo se
+    creen con `trust_proxy` y si la conexión viene de `trusted_proxies` (IPs o
+    redes CIDR, p. ej. la de nginx); de X-Forwarded-For se toma la última
+    dirección que no es un proxy de confianza, ya que las anteriores las pudo
+    escribir el propio cliente.
+    """
+
+    def __init__(
+        self,
+        api_keys: Iterable[str] = (),
+        trust_proxy: bool = False,
+        trusted_proxies: Iterable[str] = ()
+    ):
+        self.api_keys = frozenset(api_keys)
+        self.trust_proxy = trust_proxy
+        self.trusted_proxies = tuple(ip_network(proxy, strict=False) for proxy in trusted_proxies)
+
+    def __call__(self, scope) -> str:
+        api_key = self.api_key(scope)
+        if api_key is not None:
+            return "key:" + api_key
+        return "ip:" + self.ip(scope)
+
+    def api_key(self, scope) -> Optional[str]:
+        """X-API-Key de la petición si es una de las claves conocidas"""
+        for name, value in scope.get("headers") or ():
+            if name == b"x-api-key":
+                api_key = value.decode("latin-1")
+                return api_key if api_key in self.api_keys else None
+        return None
+
+    def ip(self, scope) -> str:
+        client = scope.get("client")
+        peer = client[0] if client else "unknown"
+        if not self.trust_proxy or not self._is_trusted(peer):
+            return peer
+
+        headers = dict(scope.get("headers") or [])
+        real_ip = headers.get(b"x-real-ip")
+        if real_ip:
+            return real_ip.decode("latin-1").strip()
+        forwarded = headers.get(b"x-forwarded-for")
+        if forwarded:
+            for address in reversed(forwarded.decode("latin-1").split(",")):
+                address = address.strip()
+                if address and not self._is_trusted(address):
+                    return address
+        return peer
+
+    def _is_trusted(self, address: str) -> bool:
+        try:
+            ip = ip_address(address)
+        except ValueError:
+            return False
+        return any(ip in network for network in self.trusted_proxies)
+
+
+def known_api_keys() -> frozenset:
+    """Claves de cliente configuradas (API_KEYS, PRIORITY_API_KEYS y TENANT_HEADER_API_KEYS)"""
+    return (
+        frozenset(settings.API_KEYS)
+        | frozenset(settings.PRIORITY_API_KEYS)
+        | frozenset(settings.TENANT_HEADER_API_KEYS)
+    )
+
+
+def create_client_identity() -> ClientIdentity:
+    """Identificación de clientes según la configuración"""
+    return ClientIdentity(
+        api_keys=known_api_keys(),
+        trust_proxy=settings.RATE_LIMIT_TRUST_PROXY,
+        trusted_proxies=settings.RATE_LIMIT_TRUSTED_PROXIES
+    )
+
+
+class RateLimitMiddleware:
+    """
+    Middleware ASGI que limita las peticiones por cliente
+
+    El cliente se identifica con `identity` (ver ClientIdentity): una
+    X-API-Key conocida o, en su defecto, la IP. Solo se limitan las rutas con
+    alguno de los prefijos indicados.
+    """
+
+    def __init__(
+        self,
+        app,
+        backend: RateLimitBackend,
+        requests: int,
+        period: int,
+        paths: Iterable[str] = ("/chat",),
+        identity: Optional[ClientIdentity] = None
+    ):
+        self.app = app
+        self.backend = backend
+        self.capacity = requests
+        self.refill_rate = requests / period
+        self.paths = tuple(paths)
+        self.identity = identity or ClientIdentity()
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] == "OPTIONS"
+            or not scope["path"].startswith(self.paths)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        result = await self.backend.hit(self.client_key(scope), self.capacity, self.refill_rate)
+        rate_headers = [
+            (b"x-ratelimit-limit", str(self.capacity).encode()),
+            (b"x-ratelimit-remaining", str(result.remaining).encode()),
+        ]
+
+        if not result.allowed:
+            await self._reject(send, result, rate_headers)
+            return
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + rate_headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+    def client_key(self, scope) -> str:
+        """Obtener la clave del cliente a partir de la petición"""
+        return self.identity(scope)
+
+    async def _reject(self, send, result: RateLimitResult, rate_headers: list) -> None:
+        """Responder 429 con Retry-After"""
+        body = json.dumps(ErrorResponse(
+            error="Demasiadas solicitudes",
+            detail=f"Límite de {self.capacity} solicitudes superado, reintenta más tarde"
+        ).model_dump(mode="json")).encode()
+
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(result.retry_after))).encode()),
+            ] + rate_headers,
+        })
+        await send({"type": "http.response.body", "body": body})
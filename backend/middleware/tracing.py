@@ -0,0 +1,57 @@
+"""
+Middleware ASGI que abre una traza por petición y añade X-Request-ID y
+Server-Timing a la respuesta
+"""
+import re
+import uuid
+
+from services.tracing import Trace, TraceExporter, current_span, current_trace
+
+# Ids de petición aceptados del cliente (el resto se sustituye por uno nuevo)
+REQUEST_ID_PATTERN = re.compile(rb"^[A-Za-z0-9._-]{1,128}$")
+
+
+class TracingMiddleware:
+    """
+    Crear la traza de cada petición HTTP
+
+    El id de petición se toma de la cabecera X-Request-ID si es válido y se
+    devuelve en la respuesta. Server-Timing lleva las etapas terminadas al
+    enviar las cabeceras; en streaming eso incluye hasta el primer token.
+    """
+
+    def __init__(self, app, exporter: TraceExporter):
+        self.app = app
+        self.exporter = exporter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = dict(scope.get("headers") or []).get(b"x-request-id")
+        if request_id is None or not REQUEST_ID_PATTERN.match(request_id):
+            request_id = uuid.uuid4().hex.encode()
+        trace = Trace(request_id.decode(), f"{scope['method']} {scope['path']}")
+        trace_token = current_trace.set(trace)
+        span_token = current_span.set(trace.root)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                trace.root.attributes["http.status_code"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-request-id", request_id),
+                    (b"server-timing", trace.server_timing().encode()),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            trace.root.end()
+            route = scope.get("route")
+            if route is not None:
+                trace.root.name = f"{scope['method']} {route.path}"
+            current_span.reset(span_token)
+            current_trace.reset(trace_token)
+            self.exporter.submit(trace)
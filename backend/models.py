@@ -4,6 +4,7 @@ Modelos Pydantic para validación de datos
 from pydantic import BaseModel, Field, field_validator
 from typing import Optional, List
 from datetime import datetime
+from config import settings
 
 class ChatMessage(BaseModel):
     """Mensaje individual en una conversación"""
@@ -21,9 +22,19 @@ class ChatRequest(BaseModel):
     """Request para el endpoint de chat"""
     message: str = Field(..., min_length=1, max_length=2000, description="Mensaje del usuario")
     conversation_history: Optional[List[ChatMessage]] = Field(default=None, description="Historial de conversación")
+    session_id: Optional[str] = Field(default=None, max_length=64, pattern=r"^[A-Za-z0-9_-]+$", description="Sesión cuyo historial guarda el servidor")
+    session: bool = Field(default=False, description="Crear una sesión en el servidor si no se envía session_id")
     max_tokens: Optional[int] = Field(default=500, ge=1, le=2000, description="Máximo de tokens a generar")
     temperature: Optional[float] = Field(default=0.7, ge=0.0, le=2.0, description="Temperatura para generación")
     stream: Optional[bool] = Field(default=False, description="Streaming de respuesta")
+    priority: Optional[str] = Field(default=None, description="Clase de prioridad (interactive, batch, background)")
+    
+    @field_validator('priority')
+    @classmethod
+    def validate_priority(cls, v):
+        if v is not None and v not in settings.PRIORITY_WEIGHTS:
+            raise ValueError(f'Prioridad no válida; opciones: {", ".join(settings.PRIORITY_WEIGHTS)}')
+        return v
     
     model_config = {  # ✅ Actualizado
         "json_schema_extra": {
@@ -35,6 +46,43 @@ class ChatRequest(BaseModel):
         }
     }
 
+class BatchChatRequest(BaseModel):
+    """Request para el endpoint de chat por lotes"""
+    requests: List[ChatRequest] = Field(..., min_length=1, description="Peticiones de chat a procesar")
+    concurrency: Optional[int] = Field(default=None, ge=1, description="Peticiones en paralelo (por defecto BATCH_MAX_CONCURRENCY)")
+    priority: Optional[str] = Field(default=None, description="Prioridad de las peticiones sin prioridad propia (por defecto PRIORITY_BATCH_DEFAULT)")
+    
+    @field_validator('priority')
+    @classmethod
+    def validate_priority(cls, v):
+        return ChatRequest.validate_priority(v)
+    
+    @field_validator('requests')
+    @classmethod
+    def validate_size(cls, v):
+        if len(v) > settings.BATCH_MAX_ITEMS:
+            raise ValueError(f'Como máximo {settings.BATCH_MAX_ITEMS} peticiones por lote')
+        return v
+
+class TokenizeRequest(BaseModel):
+    """Request para contar los tokens de una petición de chat sin enviarla"""
+    message: str = Field(..., min_length=1, max_length=2000, description="Mensaje del usuario")
+    conversation_history: Optional[List[ChatMessage]] = Field(default=None, description="Historial de conversación")
+    session_id: Optional[str] = Field(default=None, max_length=64, pattern=r"^[A-Za-z0-9_-]+$", description="Sesión cuyo historial guarda el servidor")
+    max_tokens: Optional[int] = Field(default=500, ge=1, le=2000, description="Máximo de tokens a generar")
+
+class TokenizeResponse(BaseModel):
+    """Response de /tokenize: cómo se enviaría la petición a vLLM"""
+    fits: bool = Field(..., description="La petición cabe en la ventana de contexto")
+    message_tokens: int = Field(..., description="Tokens del mensaje")
+    prompt_tokens: int = Field(..., description="Tokens del prompt completo (system prompt, historial y plantilla)")
+    max_tokens: int = Field(..., description="max_tokens que se enviaría, ajustado a la ventana")
+    requested_max_tokens: int = Field(..., description="max_tokens pedido")
+    history_messages: int = Field(..., description="Turnos del historial que se enviarían")
+    dropped_messages: int = Field(..., description="Turnos del historial que no caben")
+    context_length: int = Field(..., description="Ventana de contexto del modelo (MAX_MODEL_LEN)")
+    tokenizer: str = Field(..., description="Tokenizer usado para contar")
+
 class ChatResponse(BaseModel):
     """Response del endpoint de chat"""
     response: str = Field(..., description="Respuesta del modelo")
@@ -43,6 +91,9 @@ class ChatResponse(BaseModel):
     prompt_tokens: int = Field(..., description="Tokens del prompt")
     completion_tokens: int = Field(..., description="Tokens de la respuesta")
     latency_seconds: float = Field(..., description="Tiempo de respuesta en segundos")
+    ttft_seconds: Optional[float] = Field(default=None, description="Tiempo hasta el primer token (solo streaming)")
+    cached: bool = Field(default=False, description="Respuesta servida desde la caché")
+    session_id: Optional[str] = Field(default=None, description="Sesión a enviar en la siguiente petición")
     timestamp: datetime = Field(default_factory=datetime.now, description="Timestamp de la respuesta")
     
     model_config = {  # ✅ Actualizado
@@ -63,6 +114,10 @@ class HealthResponse(BaseModel):
     """Response del health check"""
     status: str
     vllm_status: str
+    vllm_last_check: Optional[datetime] = None
+    circuit_breaker: Optional[str] = None
+    ready: bool = True  # False mientras se calienta vLLM (HTTP 503)
+    warmup: Optional[str] = None
     timestamp: datetime = Field(default_factory=datetime.now)
     version: str
 
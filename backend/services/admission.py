@@ -0,0 +1,322 @@
+"""
+Control de admisión: concurrencia acotada hacia vLLM con cola de espera
+por prioridades y reparto justo entre tenants
+"""
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, List, Optional
+
+import httpx
+
+from services.metrics import LATENCY_BUCKETS, Histogram
+from services.tracing import span
+
+DEFAULT_PRIORITY = "interactive"
+
+
+class AdmissionRejected(Exception):
+    """La petición no se admitió (cola llena o espera demasiado larga)"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _ClassQueue:
+    """Cola de una clase de prioridad: una cola FIFO por tenant, atendidas por turnos"""
+
+    __slots__ = ("name", "weight", "tenants", "pass_", "queued", "admitted", "rejected", "queue_wait")
+
+    def __init__(self, name: str, weight: float):
+        self.name = name
+        self.weight = weight
+        self.tenants: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        # Tiempo virtual del stride scheduling: avanza 1/weight por hueco concedido
+        self.pass_ = 0.0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {"queue_full": 0, "queue_timeout": 0, "preempted": 0}
+        self.queue_wait = Histogram(LATENCY_BUCKETS)
+
+    def push(self, tenant: str, waiter: asyncio.Future) -> None:
+        queue = self.tenants.get(tenant)
+        if queue is None:
+            queue = self.tenants[tenant] = deque()
+        queue.append(waiter)
+
+    def pop(self) -> Optional[asyncio.Future]:
+        """Primer waiter pendiente del siguiente tenant (round robin)"""
+        while self.tenants:
+            tenant, queue = next(iter(self.tenants.items()))
+            waiter = queue.popleft()
+            if queue:
+                self.tenants.move_to_end(tenant)
+            else:
+                del self.tenants[tenant]
+            if not waiter.done():  # Cancelado o expirado
+                return waiter
+        return None
+
+    def pop_newest(self) -> Optional[asyncio.Future]:
+        """Último waiter pendiente del tenant con más peticiones en cola"""
+        while self.tenants:
+            tenant = max(self.tenants, key=lambda t: len(self.tenants[t]))
+            queue = self.tenants[tenant]
+            waiter = queue.pop()
+            if not queue:
+                del self.tenants[tenant]
+            if not waiter.done():
+                return waiter
+        return None
+
+    def stats(self) -> Dict:
+        return {
+            "weight": self.weight,
+            "queue_depth": self.queued,
+            "tenants_waiting": len(self.tenants),
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "queue_wait_seconds": self.queue_wait.summary(),
+        }
+
+
+class AdmissionController:
+    """
+    Limita las llamadas concurrentes a vLLM y decide quién pasa primero
+
+    Hasta `limit` llamadas se ejecutan a la vez; el resto espera en una cola
+    de como mucho `max_queue` peticiones durante `max_queue_time` segundos.
+    Con la cola llena se rechaza al instante (load shedding), salvo que haya
+    en cola peticiones de una clase menos prioritaria: entonces se expulsa la
+    más reciente de ellas.
+
+    La cola reparte los huecos entre clases de prioridad en proporción a su
+    peso en `weights` (stride scheduling), así que las clases bajas avanzan
+    más despacio pero nunca se quedan paradas. Dentro de una clase cada
+    tenant tiene su propia cola y se turnan, de modo que un tenant con cientos
+    de peticiones no retrasa a los demás. El orden de `weights` es el de
+    prioridad (la primera clase es la más alta).
+
+    En modo adaptativo el límite sigue un esquema AIMD: sube 1/limit por cada
+    llamada que termina por debajo de `target_latency` y se multiplica por
+    `backoff` (como mucho una vez por `target_latency`) cuando una llamada es
+    lenta o falla por sobrecarga (timeout o 5xx).
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        max_queue: int,
+        max_queue_time: float,
+        adaptive: bool = False,
+        min_concurrency: int = 1,
+        target_latency: float = 10.0,
+        backoff: float = 0.9,
+        weights: Optional[Dict[str, float]] = None,
+        default_priority: Optional[str] = None
+    ):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min(min_concurrency, max_concurrency)
+        self.max_queue = max_queue
+        self.max_queue_time = max_queue_time
+        self.adaptive = adaptive
+        self.target_latency = target_latency
+        self.backoff = backoff
+
+        weights = weights or {DEFAULT_PRIORITY: 1.0}
+        self._classes: Dict[str, _ClassQueue] = {
+            name: _ClassQueue(name, float(weight)) for name, weight in weights.items()
+        }
+        self._rank = {name: i for i, name in enumerate(self._classes)}
+        self.default_priority = default_priority or next(iter(self._classes))
+        self._virtual_time = 0.0
+
+        self.limit = float(max_concurrency)
+        self.active = 0
+        self.queued = 0
+        self._last_decrease = 0.0
+
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {"queue_full": 0, "queue_timeout": 0, "preempted": 0}
+        self.queue_wait = Histogram(LATENCY_BUCKETS)
+
+    @property
+    def priorities(self) -> List[str]:
+        """Clases de prioridad de mayor a menor"""
+        return list(self._classes)
+
+    @asynccontextmanager
+    async def slot(self, priority: Optional[str] = None, tenant: str = "default") -> AsyncIterator[None]:
+        """Ocupar un hueco de concurrencia durante el bloque"""
+        await self.acquire(priority, tenant)
+        start = time.perf_counter()
+        overloaded = False
+        try:
+            yield
+        except (httpx.TimeoutException, httpx.TransportError):
+            overloaded = True
+            raise
+        except httpx.HTTPStatusError as e:
+            overloaded = e.response.status_code >= 500
+            raise
+        finally:
+            self.release(time.perf_counter() - start, overloaded)
+
+    def _class(self, priority: Optional[str]) -> _ClassQueue:
+        queue = self._classes.get(priority or self.default_priority)
+        if queue is None:
+            raise ValueError(f"Prioridad desconocida: {priority}")
+        return queue
+
+    async def acquire(self, priority: Optional[str] = None, tenant: str = "default") -> None:
+        """Esperar un hueco libre o lanzar AdmissionRejected"""
+        with span("admission", priority=priority or self.default_priority):
+            await self._acquire(priority, tenant)
+
+    async def _acquire(self, priority: Optional[str], tenant: str) -> None:
+        start = time.perf_counter()
+        queue = self._class(priority)
+        if self.active < int(self.limit) and not self.queued:
+            self.active += 1
+            self._admitted(queue, 0.0)
+            return
+
+        if self.queued >= self.max_queue and not self._preempt(queue):
+            self._rejected(queue, "queue_full")
+            raise AdmissionRejected("queue_full", retry_after=self.max_queue_time)
+
+        waiter = asyncio.get_running_loop().create_future()
+        if not queue.tenants:
+            # Una clase que estaba vacía no acumula turnos de cuando no tenía cola
+            queue.pass_ = max(queue.pass_, self._virtual_time)
+        queue.push(tenant, waiter)
+        self.queued += 1
+        queue.queued += 1
+        try:
+            await asyncio.wait_for(waiter, timeout=self.max_queue_time)
+        except asyncio.TimeoutError:
+            self._rejected(queue, "queue_timeout")
+            raise AdmissionRejected("queue_timeout", retry_after=self.max_queue_time)
+        except AdmissionRejected:
+            self._rejected(queue, "preempted")
+            raise
+        except asyncio.CancelledError:
+            # El hueco pudo concederse justo antes de cancelar: devolverlo
+            if waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+                self.active -= 1
+                self._wake()
+            raise
+        finally:
+            self.queued -= 1
+            queue.queued -= 1
+
+        self._admitted(queue, time.perf_counter() - start)
+
+    def _preempt(self, incoming: _ClassQueue) -> bool:
+        """Expulsar de la cola una petición de una clase menos prioritaria que `incoming`"""
+        for queue in reversed(list(self._classes.values())):
+            if self._rank[queue.name] <= self._rank[incoming.name]:
+                return False
+            waiter = queue.pop_newest()
+            if waiter is not None:
+                waiter.set_exception(
+                    AdmissionRejected("preempted", retry_after=self.max_queue_time)
+                )
+                return True
+        return False
+
+    def _admitted(self, queue: _ClassQueue, wait: float) -> None:
+        self.admitted += 1
+        queue.admitted += 1
+        self.queue_wait.observe(wait)
+        queue.queue_wait.observe(wait)
+
+    def _rejected(self, queue: _ClassQueue, reason: str) -> None:
+        self.rejected[reason] += 1
+        queue.rejected[reason] += 1
+
+    def release(self, latency: float, overloaded: bool = False) -> None:
+        """Liberar un hueco y ajustar el límite si es adaptativo"""
+        self.active -= 1
+        if self.adaptive:
+            self._adjust(latency, overloaded)
+        self._wake()
+
+    def _adjust(self, latency: float, overloaded: bool) -> None:
+        if overloaded or latency > self.target_latency:
+            now = time.monotonic()
+            if now - self._last_decrease >= self.target_latency:
+                self._last_decrease = now
+                self.limit = max(self.min_concurrency, self.limit * self.backoff)
+        else:
+            self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+
+    def _wake(self) -> None:
+        """Conceder huecos libres según el reparto ponderado"""
+        while self.active < int(self.limit):
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            self.active += 1
+            waiter.set_result(None)
+
+    def _next_waiter(self) -> Optional[asyncio.Future]:
+        """Siguiente waiter: la clase con menor tiempo virtual y, en ella, el siguiente tenant"""
+        while True:
+            pending = [queue for queue in self._classes.values() if queue.tenants]
+            if not pending:
+                return None
+            queue = min(pending, key=lambda q: q.pass_)
+            waiter = queue.pop()
+            if waiter is not None:
+                self._virtual_time = queue.pass_
+                queue.pass_ += 1.0 / queue.weight
+                return waiter
+
+    def stats(self) -> Dict:
+        return {
+            "limit": int(self.limit),
+            "adaptive": self.adaptive,
+            "active": self.active,
+            "queue_depth": self.queued,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "queue_wait_seconds": self.queue_wait.summary(),
+            "classes": {name: queue.stats() for name, queue in self._classes.items()},
+        }
+
+    def prometheus(self) -> List[str]:
+        lines = [
+            "# TYPE chatbot_admission_limit gauge",
+            f"chatbot_admission_limit {int(self.limit)}",
+            "# TYPE chatbot_admission_active gauge",
+            f"chatbot_admission_active {self.active}",
+            "# TYPE chatbot_admission_queue_depth gauge",
+            f"chatbot_admission_queue_depth {self.queued}",
+            "# TYPE chatbot_admission_rejected_total counter",
+            *(
+                f'chatbot_admission_rejected_total{{reason="{reason}"}} {count}'
+                for reason, count in self.rejected.items()
+            ),
+            "# TYPE chatbot_admission_class_queue_depth gauge",
+            *(
+                f'chatbot_admission_class_queue_depth{{priority="{name}"}} {queue.queued}'
+                for name, queue in self._classes.items()
+            ),
+            "# TYPE chatbot_admission_class_rejected_total counter",
+            *(
+                f'chatbot_admission_class_rejected_total{{priority="{name}",reason="{reason}"}} {count}'
+                for name, queue in self._classes.items()
+                for reason, count in queue.rejected.items()
+            ),
+            "# TYPE chatbot_admission_queue_wait_seconds histogram",
+        ]
+        lines += self.queue_wait.prometheus("chatbot_admission_queue_wait_seconds")
+        lines.append("# TYPE chatbot_admission_class_queue_wait_seconds histogram")
+        for name, queue in self._classes.items():
+            lines += queue.queue_wait.prometheus("chatbot_admission_class_queue_wait_seconds", f'priority="{name}"')
+        return lines
@@ -0,0 +1,104 @@
+"""
+Circuit breaker para las llamadas a vLLM
+"""
+import time
+from typing import Dict
+
+
+class CircuitOpenError(Exception):
+    """vLLM se considera caído: la llamada se rechaza sin intentarla"""
+
+    def __init__(self, retry_after: float):
+        super().__init__("Circuito abierto: vLLM no disponible")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Corta las llamadas a vLLM mientras se sabe que está caído
+
+    - closed: las llamadas pasan; `failure_threshold` fallos seguidos lo abren.
+    - open: las llamadas fallan al instante; tras `reset_timeout` segundos (o
+      cuando el monitor de salud ve a vLLM sano) pasa a half-open.
+    - half-open: deja pasar una llamada de prueba cada `probe_interval`
+      segundos; si tiene éxito se cierra, si falla vuelve a abrirse.
+
+    El monitor de salud también lo alimenta: al detectar la caída lo abre
+    aunque todavía no haya fallado ninguna llamada.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 10.0,
+        probe_interval: float = 1.0
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe_interval = probe_interval
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._last_probe = 0.0
+        self.rejected = 0
+        self.times_opened = 0
+
+    def record_health(self, healthy: bool) -> None:
+        """Listener del monitor de salud"""
+        if not healthy:
+            self._open()
+        elif self.state == self.OPEN:
+            self.state = self.HALF_OPEN
+
+    def is_open(self) -> bool:
+        """Abierto y sin llegar todavía a half-open (no consume la llamada de prueba)"""
+        return self.state == self.OPEN and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def before_call(self) -> None:
+        """Lanzar CircuitOpenError si la llamada no debe intentarse"""
+        if self.state == self.CLOSED:
+            return
+
+        now = time.monotonic()
+        if self.state == self.OPEN and now - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+
+        if self.state == self.HALF_OPEN and now - self._last_probe >= self.probe_interval:
+            self._last_probe = now
+            return
+
+        self.rejected += 1
+        raise CircuitOpenError(self.retry_after())
+
+    def record_success(self) -> None:
+        self.consecutive_failures = 0
+        self.state = self.CLOSED
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self._open()
+
+    def retry_after(self) -> float:
+        if self.state == self.OPEN:
+            return max(self.probe_interval, self.reset_timeout - (time.monotonic() - self.opened_at))
+        return self.probe_interval
+
+    def _open(self) -> None:
+        if self.state != self.OPEN:
+            self.times_opened += 1
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+
+    def stats(self) -> Dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "open_for_seconds": round(time.monotonic() - self.opened_at, 1) if self.state == self.OPEN else 0.0,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+        }
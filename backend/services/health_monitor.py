@@ -0,0 +1,111 @@
+"""
+Monitor de salud de vLLM en segundo plano
+"""
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class HealthMonitor:
+    """
+    Sondea vLLM cada `interval` segundos (± `jitter`) y guarda el último estado
+
+    /health responde desde este estado en memoria. vLLM se marca caído tras
+    `failure_threshold` sondeos fallidos seguidos y vuelve a estar sano con el
+    primer sondeo correcto. El estado de cada réplica (y de su circuit
+    breaker) lo actualiza el propio sondeo, ver VLLMService.check_health.
+    """
+
+    def __init__(
+        self,
+        probe: Callable[[], Awaitable[bool]],
+        interval: float = 10.0,
+        jitter: float = 0.2,
+        failure_threshold: int = 2
+    ):
+        self.probe = probe
+        self.interval = interval
+        self.jitter = jitter
+        self.failure_threshold = failure_threshold
+
+        self.healthy: Optional[bool] = None  # None: todavía sin sondear
+        self.last_checked: Optional[datetime] = None
+        self.last_change: Optional[datetime] = None
+        self.last_latency: Optional[float] = None
+        self.consecutive_failures = 0
+        self._became_healthy = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> bool:
+        """Hacer un primer sondeo y lanzar el bucle en segundo plano"""
+        healthy = await self.check_now()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return healthy
+
+    async def wait_healthy(self) -> None:
+        """Esperar a que un sondeo vea vLLM sano (sin sondear aquí)"""
+        await self._became_healthy.wait()
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def check_now(self) -> bool:
+        """Sondear vLLM y actualizar el estado"""
+        start = time.perf_counter()
+        try:
+            ok = await self.probe()
+        except Exception:
+            ok = False
+        self.last_latency = time.perf_counter() - start
+        self.last_checked = datetime.now()
+
+        if ok:
+            self.consecutive_failures = 0
+            self._set_healthy(True)
+        else:
+            self.consecutive_failures += 1
+            if self.healthy is None or self.consecutive_failures >= self.failure_threshold:
+                self._set_healthy(False)
+        return bool(self.healthy)
+
+    def _set_healthy(self, healthy: bool) -> None:
+        if healthy == self.healthy:
+            return
+        if self.healthy is not None:
+            if healthy:
+                logger.info("✅ vLLM disponible de nuevo")
+            else:
+                logger.warning(f"⚠️  vLLM no responde ({self.consecutive_failures} sondeos fallidos)")
+        self.healthy = healthy
+        self.last_change = datetime.now()
+        if healthy:
+            self._became_healthy.set()
+        else:
+            self._became_healthy.clear()
+
+    async def _run(self) -> None:
+        while True:
+            delay = self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+            await asyncio.sleep(delay)
+            await self.check_now()
+
+    def stats(self) -> Dict:
+        return {
+            "healthy": self.healthy,
+            "last_checked": self.last_checked,
+            "last_change": self.last_change,
+            "last_latency_seconds": round(self.last_latency, 4) if self.last_latency is not None else None,
+            "consecutive_failures": self.consecutive_failures,
+        }
@@ -0,0 +1,411 @@
+"""
+Métricas de rendimiento del backend (contadores e histogramas)
+
+Todo se registra desde el event loop de asyncio, que es de un solo hilo, así
+que las actualizaciones son simples operaciones sobre enteros y listas sin
+locks. Cada registro cuesta unos cientos de nanosegundos.
+
+Con varios workers cada proceso registra sus propias métricas; con
+METRICS_BACKEND=redis cada uno publica su estado y /stats y /metrics
+devuelven la suma de todos.
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from config import settings
+from fast_json import dumps as json_dumps, loads as json_loads
+from services.state_backend import MEMORY, REDIS, create_redis, resolve_backend
+
+logger = logging.getLogger(__name__)
+
+# Límites superiores de los buckets (segundos)
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.25, 0.35,
+    0.5, 0.75, 1.0, 1.5, 2.5, 5.0, 7.5, 10.0, 15.0, 30.0, 60.0, 120.0
+)
+
+# Límites superiores de los buckets (tokens/segundo)
+THROUGHPUT_BUCKETS = (1, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500, 1000)
+
+
+class Histogram:
+    """Histograma de buckets fijos con percentiles aproximados"""
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # El último es +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_state(self) -> Dict:
+        return {"counts": self.counts, "sum": self.sum, "count": self.count}
+
+    def merge_state(self, state: Dict) -> None:
+        """Sumar el estado de otro histograma con los mismos buckets"""
+        for i, bucket_count in enumerate(state["counts"]):
+            self.counts[i] += bucket_count
+        self.sum += state["sum"]
+        self.count += state["count"]
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Percentil `q` (0-1) interpolando linealmente dentro del bucket"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                if i == len(self.bounds):
+                    return lower
+                upper = self.bounds[i]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.bounds[-1]
+
+    def summary(self, digits: int = 4) -> Dict:
+        return {
+            "count": self.count,
+            "mean": round(self.sum / self.count, digits) if self.count else None,
+            "p50": _round(self.percentile(0.50), digits),
+            "p95": _round(self.percentile(0.95), digits),
+            "p99": _round(self.percentile(0.99), digits),
+        }
+
+    def prometheus(self, name: str, labels: str = "") -> List[str]:
+        sep = "," if labels else ""
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.bounds, self.counts):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {self.count}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.sum}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+
+class RateCounter:
+    """Tasa por segundo sobre una ventana deslizante (anillo de contadores por segundo)"""
+
+    __slots__ = ("window", "slots", "seconds")
+
+    def __init__(self, window: int = 60):
+        self.window = window
+        self.slots = [0.0] * window
+        self.seconds = [0] * window
+
+    def add(self, amount: float, now: Optional[float] = None) -> None:
+        second = int(now if now is not None else time.monotonic())
+        i = second % self.window
+        if self.seconds[i] != second:
+            self.seconds[i] = second
+            self.slots[i] = 0.0
+        self.slots[i] += amount
+
+    def rate(self, now: Optional[float] = None) -> float:
+        second = int(now if now is not None else time.monotonic())
+        total = sum(
+            amount for amount, s in zip(self.slots, self.seconds)
+            if second - self.window < s <= second
+        )
+        return total / self.window
+
+
+class FixedRate:
+    """Tasa ya calculada (la suma de las de varios workers)"""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value: float = 0.0):
+        self.value = value
+
+    def rate(self, now: Optional[float] = None) -> float:
+        return self.value
+
+
+def _round(value: Optional[float], digits: int) -> Optional[float]:
+    return round(value, digits) if value is not None else None
+
+
+class Metrics:
+    """Registro central de métricas del backend"""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.requests: Dict[Tuple[str, int], int] = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.request_latency: Dict[str, Histogram] = {}
+        self.upstream_latency = Histogram(LATENCY_BUCKETS)
+        self.upstream_ttft = Histogram(LATENCY_BUCKETS)
+        self.upstream_errors: Dict[str, int] = {}
+        self.tokens_per_second = Histogram(THROUGHPUT_BUCKETS)
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.completion_token_rate = RateCounter()
+
+    # -------------------- Registro --------------------
+
+    def request_started(self) -> None:
+        self.in_flight += 1
+        if self.in_flight > self.max_in_flight:
+            self.max_in_flight = self.in_flight
+
+    def request_finished(self, route: str, status: int, seconds: float) -> None:
+        self.in_flight -= 1
+        key = (route, status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+        histogram = self.request_latency.get(route)
+        if histogram is None:
+            histogram = self.request_latency[route] = Histogram(LATENCY_BUCKETS)
+        histogram.observe(seconds)
+
+    def record_upstream(self, seconds: float, usage: Dict, ttft: Optional[float] = None) -> None:
+        """Registrar una llamada exitosa a vLLM con su bloque `usage`"""
+        self.upstream_latency.observe(seconds)
+        if ttft is not None:
+            self.upstream_ttft.observe(ttft)
+
+        completion_tokens = usage.get("completion_tokens", 0)
+        self.prompt_tokens += usage.get("prompt_tokens", 0)
+        self.completion_tokens += completion_tokens
+        self.completion_token_rate.add(completion_tokens)
+        if completion_tokens and seconds > 0:
+            self.tokens_per_second.observe(completion_tokens / seconds)
+
+    def record_upstream_error(self, kind: str) -> None:
+        self.upstream_errors[kind] = self.upstream_errors.get(kind, 0) + 1
+
+    # -------------------- Agregación entre workers --------------------
+
+    def export_state(self) -> Dict:
+        """Estado serializable para sumarlo con el de otros workers"""
+        return {
+            "started_at": self.started_at,
+            "requests": [[route, status, count] for (route, status), count in self.requests.items()],
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "request_latency": {route: h.to_state() for route, h in self.request_latency.items()},
+            "upstream_latency": self.upstream_latency.to_state(),
+            "upstream_ttft": self.upstream_ttft.to_state(),
+            "upstream_errors": self.upstream_errors,
+            "tokens_per_second": self.tokens_per_second.to_state(),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "completion_token_rate": self.completion_token_rate.rate(),
+        }
+
+    @classmethod
+    def from_states(cls, states: List[Dict]) -> "Metrics":
+        """
+        Métricas de todo el servidor a partir del estado de cada worker
+
+        Contadores y buckets se suman; max_in_flight es la suma de los máximos
+        de cada worker (una cota superior del máximo conjunto).
+        """
+        merged = cls()
+        merged.completion_token_rate = FixedRate()
+        for state in states:
+            merged.started_at = min(merged.started_at, state["started_at"])
+            for route, status, count in state["requests"]:
+                merged.requests[(route, status)] = merged.requests.get((route, status), 0) + count
+            merged.in_flight += state["in_flight"]
+            merged.max_in_flight += state["max_in_flight"]
+            for route, histogram in state["request_latency"].items():
+                if route not in merged.request_latency:
+                    merged.request_latency[route] = Histogram(LATENCY_BUCKETS)
+                merged.request_latency[route].merge_state(histogram)
+            merged.upstream_latency.merge_state(state["upstream_latency"])
+            merged.upstream_ttft.merge_state(state["upstream_ttft"])
+            for kind, count in state["upstream_errors"].items():
+                merged.upstream_errors[kind] = merged.upstream_errors.get(kind, 0) + count
+            merged.tokens_per_second.merge_state(state["tokens_per_second"])
+            merged.prompt_tokens += state["prompt_tokens"]
+            merged.completion_tokens += state["completion_tokens"]
+            merged.completion_token_rate.value += state["completion_token_rate"]
+        return merged
+
+    # -------------------- Exportación --------------------
+
+    def snapshot(self) -> Dict:
+        """Métricas en formato JSON para /stats"""
+        by_status: Dict[str, int] = {}
+        errors_by_status: Dict[str, int] = {}
+        for (_, status), count in self.requests.items():
+            by_status[str(status)] = by_status.get(str(status), 0) + count
+            if status >= 400:
+                errors_by_status[str(status)] = errors_by_status.get(str(status), 0) + count
+
+        return {
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "requests": {
+                "total": sum(self.requests.values()),
+                "by_status": by_status,
+                "errors_by_status": errors_by_status,
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+            },
+            "latency_seconds": {
+                "end_to_end": {route: h.summary() for route, h in self.request_latency.items()},
+                "upstream": self.upstream_latency.summary(),
+                "upstream_ttft": self.upstream_ttft.summary(),
+            },
+            "upstream_errors": dict(self.upstream_errors),
+            "tokens": {
+                "prompt_total": self.prompt_tokens,
+                "completion_total": self.completion_tokens,
+                "completion_per_second_1m": round(self.completion_token_rate.rate(), 2),
+                "per_request_tokens_per_second": self.tokens_per_second.summary(digits=1),
+            },
+        }
+
+    def prometheus(self) -> str:
+        """Métricas en formato de texto de Prometheus para /metrics"""
+        lines = [
+            "# TYPE chatbot_requests_total counter",
+            *(
+                f'chatbot_requests_total{{route="{route}",status="{status}"}} {count}'
+                for (route, status), count in sorted(self.requests.items())
+            ),
+            "# TYPE chatbot_requests_in_flight gauge",
+            f"chatbot_requests_in_flight {self.in_flight}",
+            "# TYPE chatbot_request_latency_seconds histogram",
+        ]
+        for route, histogram in sorted(self.request_latency.items()):
+            lines += histogram.prometheus("chatbot_request_latency_seconds", f'route="{route}"')
+        lines.append("# TYPE chatbot_upstream_latency_seconds histogram")
+        lines += self.upstream_latency.prometheus("chatbot_upstream_latency_seconds")
+        lines.append("# TYPE chatbot_upstream_ttft_seconds histogram")
+        lines += self.upstream_ttft.prometheus("chatbot_upstream_ttft_seconds")
+        lines.append("# TYPE chatbot_upstream_errors_total counter")
+        lines += [
+            f'chatbot_upstream_errors_total{{kind="{kind}"}} {count}'
+            for kind, count in sorted(self.upstream_errors.items())
+        ]
+        lines.append("# TYPE chatbot_tokens_per_second histogram")
+        lines += self.tokens_per_second.prometheus("chatbot_tokens_per_second")
+        lines += [
+            "# TYPE chatbot_prompt_tokens_total counter",
+            f"chatbot_prompt_tokens_total {self.prompt_tokens}",
+            "# TYPE chatbot_completion_tokens_total counter",
+            f"chatbot_completion_tokens_total {self.completion_tokens}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+class MetricsAggregator:
+    """Métricas del servidor cuando solo hay un worker: las del propio proceso"""
+
+    def __init__(self, local: Metrics):
+        self.local = local
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    async def collect(self) -> Metrics:
+        return self.local
+
+    def stats(self) -> Dict:
+        return {"backend": MEMORY, "workers": 1}
+
+
+class RedisMetricsAggregator(MetricsAggregator):
+    """
+    Suma de las métricas de todos los workers a través de Redis
+
+    Cada worker publica su estado cada `interval` segundos en un hash (un
+    campo por worker) y al atender /stats o /metrics. Se ignoran los workers
+    que llevan más de tres intervalos sin publicar (procesos terminados).
+    """
+
+    def __init__(self, local: Metrics, url: Optional[str] = None, interval: float = 5.0, key: str = "metrics:workers"):
+        super().__init__(local)
+        self.interval = interval
+        self.key = key
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.workers = 0
+        self._redis = create_redis(url, setting="METRICS_BACKEND")
+        self._task: Optional[asyncio.Task] = None
+
+    async def publish(self) -> None:
+        state = self.local.export_state()
+        state["published_at"] = time.time()
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.hset(self.key, self.worker_id, json_dumps(state))
+            pipe.expire(self.key, max(60, int(self.interval * 10)))
+            await pipe.execute()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.publish()
+            except Exception as e:
+                logger.warning(f"⚠️  No se pudieron publicar las métricas: {e}")
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self._redis.hdel(self.key, self.worker_id)
+        except Exception:
+            pass
+        await self._redis.aclose()
+
+    async def collect(self) -> Metrics:
+        try:
+            await self.publish()
+            raw = await self._redis.hgetall(self.key)
+        except Exception as e:
+            logger.warning(f"⚠️  Métricas compartidas no disponibles, se devuelven las del worker: {e}")
+            return self.local
+        cutoff = time.time() - 3 * self.interval
+        states = [state for state in map(json_loads, raw.values()) if state["published_at"] >= cutoff]
+        self.workers = len(states)
+        return Metrics.from_states(states)
+
+    def stats(self) -> Dict:
+        return {"backend": REDIS, "workers": self.workers, "worker_id": self.worker_id}
+
+
+def create_metrics_aggregator(local: Metrics) -> MetricsAggregator:
+    """Crear el agregador configurado en METRICS_BACKEND (o STATE_BACKEND)"""
+    backend = resolve_backend(settings.METRICS_BACKEND)
+    if backend == REDIS:
+        return RedisMetricsAggregator(local, interval=settings.METRICS_PUBLISH_INTERVAL)
+    if backend == MEMORY:
+        return MetricsAggregator(local)
+    raise ValueError(f"METRICS_BACKEND desconocido: {backend}")
+
+
+# Instancia global de métricas (las de este worker)
+metrics = Metrics()
+
+# Instancia global del agregador (las de todos los workers)
+metrics_aggregator = create_metrics_aggregator(metrics)
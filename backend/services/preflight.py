@@ -0,0 +1,174 @@
+"""
+Comprobación previa del tamaño del prompt antes de llamar a vLLM
+
+vLLM rechaza (HTTP 400) las peticiones cuyo prompt más `max_tokens` no cabe
+en --max-model-len, pero solo después del viaje de red y, si está saturado,
+después de esperar en la cola de admisión. Aquí se cuenta el prompt con el
+tokenizer local (conteos memorizados) y se decide antes de gastar nada:
+
+- El historial se recorta a los turnos más recientes que caben.
+- `max_tokens` se reduce a lo que queda de la ventana de contexto.
+- Si el system prompt y el mensaje no dejan sitio para `min_completion_tokens`
+  tokens de respuesta, la petición se rechaza con PromptTooLong.
+"""
+from typing import Dict, List, NamedTuple, Optional
+
+from models import ChatMessage
+from services.metrics import Histogram
+from services.tokenizer import TokenCounter
+
+# Límites de los histogramas de tokens del prompt
+PROMPT_TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 3072, 4096, 8192, 16384, 32768)
+
+
+class PromptTooLong(Exception):
+    """El prompt no deja sitio para la respuesta dentro de la ventana de contexto"""
+
+    def __init__(self, prompt_tokens: int, max_prompt_tokens: int):
+        super().__init__(
+            f"El mensaje ocupa {prompt_tokens} tokens y el máximo es {max_prompt_tokens}"
+        )
+        self.prompt_tokens = prompt_tokens
+        self.max_prompt_tokens = max_prompt_tokens
+
+
+class PromptPlan(NamedTuple):
+    """Resultado de la comprobación previa"""
+    messages: List[Dict[str, str]]
+    prompt_tokens: int  # Estimados, incluida la plantilla de chat
+    max_tokens: int  # Ya ajustado a la ventana de contexto
+    requested_max_tokens: int
+    dropped_messages: int  # Turnos del historial que no se envían
+
+
+class Preflight:
+    """
+    Construye el prompt de una petición y lo ajusta a la ventana de contexto
+
+    Se reservan `max_tokens` para la respuesta y el historial se llena con los
+    turnos más recientes que quepan (como mucho `history_max_messages`). Con
+    `enabled=False` solo se recorta el historial y no se rechaza ni se ajusta
+    nada, como si vLLM fuese a decidir.
+    """
+
+    def __init__(
+        self,
+        token_counter: TokenCounter,
+        system_prompt: str,
+        max_model_len: int,
+        template_overhead: int = 16,
+        min_completion_tokens: int = 16,
+        history_max_messages: Optional[int] = None,
+        enabled: bool = True
+    ):
+        self.token_counter = token_counter
+        self.system_prompt = system_prompt
+        self.max_model_len = max_model_len
+        self.template_overhead = template_overhead
+        self.min_completion_tokens = min_completion_tokens
+        self.history_max_messages = history_max_messages
+        self.enabled = enabled
+
+        self.rejected = 0
+        self.clamped = 0
+        self.trimmed = 0
+        self.dropped_messages = 0
+        self.prompt_tokens = Histogram(PROMPT_TOKEN_BUCKETS)
+
+    @property
+    def max_prompt_tokens(self) -> int:
+        """Tokens de prompt que aún dejan sitio para la respuesta mínima"""
+        return self.max_model_len - self.min_completion_tokens
+
+    def plan(
+        self,
+        user_message: str,
+        conversation_history: Optional[List[ChatMessage]] = None,
+        max_tokens: int = 500,
+        record: bool = True
+    ) -> PromptPlan:
+        """
+        Mensajes para vLLM, tokens del prompt y `max_tokens` ajustado
+
+        Con `record=False` (p. ej. /tokenize) no se cuenta en las estadísticas.
+
+        Raises:
+            PromptTooLong: el system prompt y el mensaje no caben
+        """
+        system = {"role": "system", "content": self.system_prompt}
+        user = {"role": "user", "content": user_message}
+        count = self.token_counter.count_message
+
+        base_tokens = self.template_overhead + count(system) + count(user)
+        if self.enabled and base_tokens > self.max_prompt_tokens:
+            if record:
+                self.rejected += 1
+            raise PromptTooLong(base_tokens, self.max_prompt_tokens)
+
+        history = []
+        history_tokens = 0
+        dropped = 0
+        if conversation_history:
+            if self.history_max_messages is not None and len(conversation_history) > self.history_max_messages:
+                dropped = len(conversation_history) - self.history_max_messages
+                conversation_history = conversation_history[dropped:]
+
+            budget = self.max_model_len - max_tokens - base_tokens
+            for msg in reversed(conversation_history):
+                message = {"role": msg.role, "content": msg.content}
+                tokens = count(message)
+                if tokens > budget:
+                    break
+                budget -= tokens
+                history_tokens += tokens
+                history.append((message, tokens))
+            history.reverse()
+
+            # Empezar el historial con un turno de usuario (algunas plantillas
+            # de chat exigen alternar user/assistant)
+            if history and history[0][0]["role"] == "assistant":
+                history_tokens -= history.pop(0)[1]
+            dropped += len(conversation_history) - len(history)
+
+        prompt_tokens = base_tokens + history_tokens
+        requested = max_tokens
+        if self.enabled and prompt_tokens + max_tokens > self.max_model_len:
+            max_tokens = self.max_model_len - prompt_tokens
+        if record:
+            self.clamped += max_tokens < requested
+            if dropped:
+                self.trimmed += 1
+                self.dropped_messages += dropped
+            self.prompt_tokens.observe(prompt_tokens)
+
+        return PromptPlan(
+            messages=[system, *(message for message, _ in history), user],
+            prompt_tokens=prompt_tokens,
+            max_tokens=max_tokens,
+            requested_max_tokens=requested,
+            dropped_messages=dropped
+        )
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "max_model_len": self.max_model_len,
+            "max_prompt_tokens": self.max_prompt_tokens,
+            "rejected": self.rejected,
+            "clamped": self.clamped,
+            "trimmed": self.trimmed,
+            "dropped_messages": self.dropped_messages,
+            "prompt_tokens": self.prompt_tokens.summary(digits=1),
+        }
+
+    def prometheus(self) -> List[str]:
+        return [
+            "# TYPE chatbot_preflight_total counter",
+            f'chatbot_preflight_total{{result="rejected"}} {self.rejected}',
+            f'chatbot_preflight_total{{result="clamped"}} {self.clamped}',
+            f'chatbot_preflight_total{{result="trimmed"}} {self.trimmed}',
+            "# TYPE chatbot_preflight_dropped_messages_total counter",
+            f"chatbot_preflight_dropped_messages_total {self.dropped_messages}",
+            "# TYPE chatbot_prompt_tokens histogram",
+            *self.prompt_tokens.prometheus("chatbot_prompt_tokens"),
+        ]
@@ -0,0 +1,173 @@
+"""
+Caché exacta de respuestas del modelo con expulsión LRU/TTL
+"""
+import hashlib
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from config import settings
+from fast_json import dumps as json_dumps, loads as json_loads
+from services.state_backend import MEMORY, REDIS, create_redis, resolve_backend
+
+
+class ResponseCache(ABC):
+    """Caché de respuestas de chat completions por hash del payload"""
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, ttl: float = 3600):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(payload: Dict) -> str:
+        """Hash estable del payload enviado a vLLM (modelo, mensajes y parámetros)"""
+        return hashlib.sha256(json_dumps(payload, sort_keys=True)).hexdigest()
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[Dict]:
+        """Obtener una respuesta si existe y no ha caducado"""
+
+    @abstractmethod
+    async def set(self, key: str, value: Dict) -> None:
+        """Guardar una respuesta"""
+
+    def stats(self) -> Dict:
+        """Contadores de uso de la caché (de este proceso)"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+    async def close(self) -> None:
+        pass
+
+
+class InMemoryResponseCache(ResponseCache):
+    """
+    Caché en memoria del proceso
+
+    Limita el número de entradas y el tamaño total (bytes del JSON de cada
+    respuesta); al superar cualquiera de los dos se expulsa la entrada usada
+    hace más tiempo. Las entradas caducan tras `ttl` segundos.
+    """
+
+    def __init__(self, max_entries: int = 1000, max_bytes: int = 32 * 1024 * 1024, ttl: float = 3600):
+        super().__init__(max_bytes, ttl)
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self.evictions = 0
+
+    async def get(self, key: str) -> Optional[Dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, size, value = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    async def set(self, key: str, value: Dict) -> None:
+        """Guardar una respuesta, expulsando entradas antiguas si hace falta"""
+        size = len(json_dumps(value))
+        if size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl, size, value)
+        self._bytes += size
+
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+    def _remove(self, key: str) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self) -> Dict:
+        return {
+            "backend": MEMORY,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            **super().stats(),
+            "evictions": self.evictions,
+        }
+
+
+class RedisResponseCache(ResponseCache):
+    """
+    Caché compartida en Redis entre todos los workers
+
+    Cada respuesta es una clave con expiración `ttl`. El límite de memoria y la
+    expulsión LRU son los de Redis (maxmemory y maxmemory-policy allkeys-lru);
+    aquí solo se descartan respuestas mayores que `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        url: Optional[str] = None,
+        max_bytes: int = 32 * 1024 * 1024,
+        ttl: float = 3600,
+        prefix: str = "cache:"
+    ):
+        super().__init__(max_bytes, ttl)
+        self.prefix = prefix
+        self._redis = create_redis(url, setting="RESPONSE_CACHE_BACKEND")
+
+    async def get(self, key: str) -> Optional[Dict]:
+        raw = await self._redis.get(self.prefix + key)
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json_loads(raw)
+
+    async def set(self, key: str, value: Dict) -> None:
+        raw = json_dumps(value)
+        if len(raw) > self.max_bytes:
+            return
+        await self._redis.set(self.prefix + key, raw, px=int(self.ttl * 1000))
+
+    def stats(self) -> Dict:
+        return {"backend": REDIS, **super().stats()}
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+
+def create_response_cache() -> Optional[ResponseCache]:
+    """Crear la caché configurada en RESPONSE_CACHE_BACKEND (o STATE_BACKEND)"""
+    if not settings.RESPONSE_CACHE_ENABLED:
+        return None
+    backend = resolve_backend(settings.RESPONSE_CACHE_BACKEND)
+    if backend == REDIS:
+        return RedisResponseCache(
+            max_bytes=settings.RESPONSE_CACHE_MAX_BYTES,
+            ttl=settings.RESPONSE_CACHE_TTL
+        )
+    if backend == MEMORY:
+        return InMemoryResponseCache(
+            max_entries=settings.RESPONSE_CACHE_MAX_ENTRIES,
+            max_bytes=settings.RESPONSE_CACHE_MAX_BYTES,
+            ttl=settings.RESPONSE_CACHE_TTL
+        )
+    raise ValueError(f"RESPONSE_CACHE_BACKEND desconocido: {backend}")
@@ -0,0 +1,129 @@
+"""
+Reintentos con backoff exponencial y presupuesto de reintentos
+"""
+import asyncio
+import random
+import time
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+import httpx
+
+T = TypeVar("T")
+
+# Clases de error de las llamadas a vLLM
+CLIENT_ERROR = "client"            # 4xx: la petición es incorrecta, no se reintenta
+SERVER_ERROR = "server"            # 500 y otros 5xx no transitorios
+UNAVAILABLE = "unavailable"        # 502/503/504: vLLM reiniciando o saturado
+CONNECT_ERROR = "connection"       # No se llegó a enviar la petición
+TRANSPORT_ERROR = "transport"      # Conexión cortada ya enviada (vLLM pudo empezar a generar)
+TIMEOUT = "timeout"                # Sin respuesta a tiempo (la generación pudo ejecutarse)
+OTHER = "other"
+
+# Errores que se reintentan con backoff y presupuesto. Solo CONNECT_ERROR es
+# seguro del todo; con TRANSPORT_ERROR la petición pudo llegar a vLLM, y el
+# presupuesto acota cuánto trabajo se puede duplicar en la GPU
+RETRYABLE = {UNAVAILABLE, CONNECT_ERROR, TRANSPORT_ERROR}
+
+# Errores que indican que vLLM no está sano (abren el circuito)
+BREAKER_FAILURES = {SERVER_ERROR, UNAVAILABLE, CONNECT_ERROR, TRANSPORT_ERROR, TIMEOUT}
+
+
+def classify_error(exc: BaseException) -> str:
+    """Clasificar un error de httpx"""
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        if status in (502, 503, 504):
+            return UNAVAILABLE
+        return SERVER_ERROR if status >= 500 else CLIENT_ERROR
+    if isinstance(exc, (httpx.ConnectError, httpx.ConnectTimeout)):
+        return CONNECT_ERROR
+    if isinstance(exc, httpx.TimeoutException):
+        return TIMEOUT
+    if isinstance(exc, httpx.TransportError):
+        # ReadError, WriteError, RemoteProtocolError, CloseError...
+        return TRANSPORT_ERROR
+    return OTHER
+
+
+class RetryBudget:
+    """
+    Limita los reintentos a una fracción de las peticiones
+
+    Cada petición original deposita `ratio` tokens y cada reintento gasta uno;
+    además se recargan `min_per_second` tokens por segundo para que con poco
+    tráfico se pueda reintentar algo. Así los reintentos nunca multiplican la
+    carga sobre un vLLM que ya está sufriendo.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0, max_balance: float = 10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_balance = max_balance
+        self.balance = max_balance
+        self._last_refill = time.monotonic()
+        self.exhausted = 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.balance = min(self.max_balance, self.balance + (now - self._last_refill) * self.min_per_second)
+        self._last_refill = now
+
+    def deposit(self) -> None:
+        self._refill()
+        self.balance = min(self.max_balance, self.balance + self.ratio)
+
+    def try_withdraw(self) -> bool:
+        self._refill()
+        if self.balance >= 1.0:
+            self.balance -= 1.0
+            return True
+        self.exhausted += 1
+        return False
+
+
+class RetryPolicy:
+    """Reintentos acotados con backoff exponencial y jitter completo"""
+
+    def __init__(
+        self,
+        max_retries: int = 2,
+        base_delay: float = 0.2,
+        max_delay: float = 2.0,
+        budget: Optional[RetryBudget] = None
+    ):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget or RetryBudget()
+        self.calls = 0
+        self.retries = 0
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    async def run(self, fn: Callable[[], Awaitable[T]]) -> T:
+        """Ejecutar `fn` reintentando solo los errores transitorios"""
+        self.calls += 1
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            try:
+                return await fn()
+            except httpx.HTTPError as e:
+                if (
+                    classify_error(e) not in RETRYABLE
+                    or attempt >= self.max_retries
+                    or not self.budget.try_withdraw()
+                ):
+                    raise
+            await asyncio.sleep(self.backoff(attempt))
+            attempt += 1
+            self.retries += 1
+
+    def stats(self) -> Dict:
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "budget_balance": round(self.budget.balance, 2),
+            "budget_exhausted": self.budget.exhausted,
+        }
@@ -0,0 +1,569 @@
+"""
+Caché semántica de respuestas: preguntas parecidas comparten respuesta
+
+La caché exacta solo acierta si el prompt es idéntico byte a byte. Esta capa
+convierte cada pregunta sin historial en un vector y busca en un índice en
+memoria la pregunta guardada más parecida (similitud coseno con NumPy); si
+supera SEMANTIC_CACHE_THRESHOLD se devuelve su respuesta sin llamar a vLLM.
+
+El índice tiene un tamaño fijo, expulsa la entrada usada hace más tiempo y,
+con SEMANTIC_CACHE_PATH, guarda los vectores en un fichero .npy abierto como
+memmap (no hay que cargarlo al arrancar) y las respuestas en un .json.
+
+NumPy es opcional: sin él la caché semántica se desactiva con un aviso.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import time
+import unicodedata
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+from config import settings
+from fast_json import dumps as json_dumps, loads as json_loads
+from services.metrics import Histogram
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Límites superiores de los buckets de la búsqueda (segundos)
+LOOKUP_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+_WORD = re.compile(r"\w+")
+
+# Palabras sin contenido y fórmulas de pregunta ("explícame", "qué significa"):
+# no distinguen una pregunta de otra
+STOPWORDS = frozenset("""
+    a al algo como con cual cuales de del el en es esta este esto la las lo los
+    me mi para por que se sea son su te tu un una uno y o sobre favor dime
+    cuentame explica explicame explicas significa define definicion
+    the an of to is are what how why in on for and or do does can you about
+    explain mean means describe please
+""".split())
+
+
+# Palabras que invierten el sentido de una pregunta: dos preguntas solo
+# comparten respuesta si tienen las mismas (además de los mismos números)
+NEGATIONS = frozenset("""
+    no ni nunca jamas sin tampoco nada ningun ninguno ninguna
+    not never without none nor non
+""".split())
+
+
+def _words(text: str) -> List[str]:
+    """Palabras en minúsculas y sin tildes"""
+    text = unicodedata.normalize("NFKD", text.lower())
+    return _WORD.findall("".join(c for c in text if not unicodedata.combining(c)))
+
+
+def guard_terms(text: str) -> frozenset:
+    """
+    Números y negaciones de una pregunta
+
+    El embedding puede dar una similitud alta a "¿qué pasó en 2010?" y "¿qué
+    pasó en 2014?", o a "aprendizaje supervisado" y "no supervisado"; una
+    coincidencia solo vale si estos términos son idénticos.
+    """
+    return frozenset(w for w in _words(text) if w in NEGATIONS or w.isdigit())
+
+
+class HashingEmbedder:
+    """
+    Embedding léxico sin modelo: palabras, bigramas y trigramas de caracteres
+    proyectados con feature hashing a `dim` dimensiones
+
+    Ignora mayúsculas, tildes, puntuación, orden de las palabras sueltas y
+    fórmulas de pregunta, y los trigramas acercan variantes de una misma
+    palabra (personalizado/personalizada). No entiende sinónimos: para eso
+    hay que usar un modelo (SEMANTIC_CACHE_EMBEDDER).
+    """
+
+    blocking = False
+
+    def __init__(self, dim: int = 512):
+        if dim & (dim - 1):
+            raise ValueError("SEMANTIC_CACHE_DIM debe ser potencia de 2")
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def load(self) -> None:
+        pass
+
+    @staticmethod
+    def _features(text: str) -> Tuple[List[str], List[float]]:
+        words = _words(text)
+        words = [w for w in words if w not in STOPWORDS] or words
+
+        features, weights = [], []
+        for word in words:
+            features.append("w:" + word)
+            weights.append(1.0)
+            padded = f" {word} "
+            grams = [padded[i:i + 3] for i in range(len(padded) - 2)]
+            for gram in grams:
+                features.append("c:" + gram)
+                weights.append(2.0 / len(grams))
+        for first, second in zip(words, words[1:]):
+            features.append(f"b:{first} {second}")
+            weights.append(0.5)
+        return features, weights
+
+    def embed(self, texts: List[str]) -> "np.ndarray":
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            features, weights = self._features(text)
+            if not features:
+                continue
+            # crc32 es estable entre procesos (hash() no), necesario para persistir
+            hashes = np.fromiter((zlib.crc32(f.encode()) for f in features), dtype=np.uint32, count=len(features))
+            signs = np.where(hashes >> 31, -1.0, 1.0)
+            vectors[row] = np.bincount(
+                (hashes & (self.dim - 1)).astype(np.intp),
+                weights=signs * np.asarray(weights),
+                minlength=self.dim
+            )
+        return _normalize(vectors)
+
+
+class SentenceTransformerEmbedder:
+    """Embedding con un modelo de sentence-transformers en CPU (se carga al arrancar)"""
+
+    blocking = True
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.name = model_name
+        self._model = None
+        self.dim: Optional[int] = None
+
+    def load(self) -> None:
+        if self._model is not None:
+            return
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise RuntimeError(
+                f"SEMANTIC_CACHE_EMBEDDER={self.model_name} requiere el paquete 'sentence-transformers'"
+            ) from e
+        self._model = SentenceTransformer(self.model_name, device="cpu")
+        self.dim = self._model.get_sentence_embedding_dimension()
+
+    def embed(self, texts: List[str]) -> "np.ndarray":
+        self.load()
+        vectors = self._model.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+        return vectors.astype(np.float32, copy=False)
+
+
+def _normalize(vectors: "np.ndarray") -> "np.ndarray":
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _namespace_id(namespace: str) -> int:
+    return int.from_bytes(hashlib.sha256(namespace.encode()).digest()[:8], "little", signed=True)
+
+
+class VectorIndex:
+    """
+    Índice de vectores normalizados con búsqueda exhaustiva vectorizada
+
+    Cada entrada ocupa un hueco fijo de una matriz `capacity` × `dim`; los
+    metadatos que filtran la búsqueda (espacio de nombres, caducidad, tokens
+    de la respuesta, max_tokens con el que se generó, si terminó de forma
+    natural, último uso) son arrays paralelos, así que una búsqueda
+    es un producto matriz-vector y una máscara. Con unos miles de entradas
+    cuesta menos de un milisegundo.
+    """
+
+    def __init__(self, dim: int, capacity: int, path: Optional[str] = None, embedder_name: str = ""):
+        self.dim = dim
+        self.capacity = capacity
+        self.path = path
+        self.embedder_name = embedder_name
+        self.namespaces = np.zeros(capacity, dtype=np.int64)
+        # Tiempos Unix para que sigan valiendo tras reiniciar
+        self.expires_at = np.zeros(capacity, dtype=np.float64)
+        self.tokens = np.zeros(capacity, dtype=np.int64)
+        self.max_tokens = np.zeros(capacity, dtype=np.int64)
+        self.complete = np.zeros(capacity, dtype=bool)  # finish_reason == "stop"
+        self.last_used = np.zeros(capacity, dtype=np.float64)
+        self.valid = np.zeros(capacity, dtype=bool)
+        self.entries: List[Optional[Dict]] = [None] * capacity
+        self._free = list(range(capacity - 1, -1, -1))
+        self._high_water = 0  # Huecos [0, high_water) usados alguna vez
+        self.evictions = 0
+        self.dirty = False
+        self.vectors = self._open_vectors()
+
+    # ----- persistencia -----
+
+    @property
+    def _vectors_path(self) -> str:
+        return self.path + ".npy"
+
+    @property
+    def _metadata_path(self) -> str:
+        return self.path + ".json"
+
+    def _open_vectors(self) -> "np.ndarray":
+        if self.path is None:
+            return np.zeros((self.capacity, self.dim), dtype=np.float32)
+
+        shape = (self.capacity, self.dim)
+        if os.path.exists(self._vectors_path) and os.path.exists(self._metadata_path):
+            try:
+                vectors = np.lib.format.open_memmap(self._vectors_path, mode="r+")
+                with open(self._metadata_path, "rb") as f:
+                    metadata = json_loads(f.read())
+                if vectors.shape == shape and vectors.dtype == np.float32 and metadata["embedder"] == self.embedder_name:
+                    self._restore(metadata, vectors)
+                    logger.info(f"🧠 Caché semántica: {int(self.valid.sum())} entradas cargadas de {self.path}")
+                    return vectors
+                logger.warning("⚠️  La caché semántica guardada no coincide con la configuración; se descarta")
+                del vectors
+            except Exception as e:
+                logger.warning(f"⚠️  No se pudo abrir la caché semántica guardada: {e}")
+
+        os.makedirs(os.path.dirname(os.path.abspath(self._vectors_path)), exist_ok=True)
+        return np.lib.format.open_memmap(self._vectors_path, mode="w+", dtype=np.float32, shape=shape)
+
+    def _restore(self, metadata: Dict, vectors: "np.ndarray") -> None:
+        now = time.time()
+        used = set()
+        for slot, entry in metadata["entries"].items():
+            slot = int(slot)
+            if slot >= self.capacity or entry["expires_at"] < now:
+                continue
+            # Un hueco reescrito después de guardar los metadatos ya no es
+            # de esta pregunta
+            if zlib.crc32(vectors[slot].tobytes()) != entry["crc"]:
+                continue
+            self.namespaces[slot] = entry["namespace"]
+            self.expires_at[slot] = entry["expires_at"]
+            self.tokens[slot] = entry["tokens"]
+            # Entradas guardadas sin estos campos: se tratan como cortadas
+            self.max_tokens[slot] = entry.get("max_tokens", entry["tokens"])
+            self.complete[slot] = entry.get("complete", False)
+            self.last_used[slot] = entry["last_used"]
+            self.valid[slot] = True
+            self.entries[slot] = {"question": entry["question"], "value": entry["value"], "crc": entry["crc"]}
+            used.add(slot)
+        self._free = [slot for slot in range(self.capacity - 1, -1, -1) if slot not in used]
+        self._high_water = max(used) + 1 if used else 0
+
+    def metadata(self) -> bytes:
+        """Metadatos serializados (se llama desde el event loop)"""
+        slots = np.flatnonzero(self.valid)
+        return json_dumps({
+            "embedder": self.embedder_name,
+            "entries": {
+                str(slot): {
+                    **self.entries[slot],
+                    "namespace": int(self.namespaces[slot]),
+                    "expires_at": float(self.expires_at[slot]),
+                    "tokens": int(self.tokens[slot]),
+                    "max_tokens": int(self.max_tokens[slot]),
+                    "complete": bool(self.complete[slot]),
+                    "last_used": float(self.last_used[slot]),
+                }
+                for slot in slots
+            }
+        })
+
+    def write(self, metadata: bytes) -> None:
+        """Volcar vectores y metadatos a disco (bloqueante; en un hilo)"""
+        if self.path is None:
+            return
+        self.vectors.flush()
+        tmp = self._metadata_path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(metadata)
+        os.replace(tmp, self._metadata_path)
+
+    # ----- búsqueda y escritura -----
+
+    def search(self, vector: "np.ndarray", namespace: int, max_tokens: Optional[int]) -> Tuple[Optional[int], float]:
+        """
+        Hueco más parecido que admite la petición y su similitud
+
+        Con `max_tokens` solo valen respuestas que caben en él y que, además,
+        terminaron de forma natural o se generaron con un max_tokens al menos
+        igual (una respuesta cortada no es la respuesta completa de una
+        petición con más margen). Con None no se filtra por la respuesta.
+        """
+        n = self._high_water
+        if n == 0:
+            return None, 0.0
+        scores = self.vectors[:n] @ vector
+        usable = (
+            self.valid[:n]
+            & (self.namespaces[:n] == namespace)
+            & (self.expires_at[:n] > time.time())
+        )
+        if max_tokens is not None:
+            usable &= (self.tokens[:n] <= max_tokens) & (self.complete[:n] | (self.max_tokens[:n] >= max_tokens))
+        scores = np.where(usable, scores, -np.inf)
+        slot = int(np.argmax(scores))
+        if not usable[slot]:
+            return None, 0.0
+        return slot, float(scores[slot])
+
+    def touch(self, slot: int) -> None:
+        self.last_used[slot] = time.time()
+
+    def covers(self, slot: int, max_tokens: int, complete: bool) -> bool:
+        """La entrada de `slot` es al menos tan completa como una respuesta nueva"""
+        if self.complete[slot]:
+            return not complete
+        return not complete and self.max_tokens[slot] > max_tokens
+
+    def add(
+        self,
+        vector: "np.ndarray",
+        namespace: int,
+        tokens: int,
+        max_tokens: int,
+        complete: bool,
+        ttl: float,
+        question: str,
+        value: Dict,
+        slot: Optional[int] = None
+    ) -> None:
+        """Guardar una entrada en `slot` (sobrescribir) o en un hueco libre"""
+        if slot is None:
+            slot = self._free.pop() if self._free else self._evict()
+        self.vectors[slot] = vector
+        self.namespaces[slot] = namespace
+        self.expires_at[slot] = time.time() + ttl
+        self.tokens[slot] = tokens
+        self.max_tokens[slot] = max_tokens
+        self.complete[slot] = complete
+        self.last_used[slot] = time.time()
+        self.valid[slot] = True
+        self.entries[slot] = {"question": question, "value": value, "crc": zlib.crc32(self.vectors[slot].tobytes())}
+        self._high_water = max(self._high_water, slot + 1)
+        self.dirty = True
+
+    def _evict(self) -> int:
+        """Liberar una entrada caducada o, si no hay, la usada hace más tiempo"""
+        expired = np.flatnonzero(self.valid & (self.expires_at <= time.time()))
+        if len(expired):
+            slot = int(expired[0])
+        else:
+            slot = int(np.argmin(np.where(self.valid, self.last_used, np.inf)))
+            self.evictions += 1
+        self.valid[slot] = False
+        self.entries[slot] = None
+        return slot
+
+    def clear(self) -> None:
+        self.valid[:] = False
+        self.entries = [None] * self.capacity
+        self._free = list(range(self.capacity - 1, -1, -1))
+        self._high_water = 0
+        self.dirty = True
+
+    def __len__(self) -> int:
+        return int(self.valid.sum())
+
+
+class SemanticCache:
+    """
+    Caché de respuestas por similitud de la pregunta
+
+    Solo se usa con preguntas sin historial (la respuesta no depende de
+    turnos anteriores) y dentro del mismo espacio de nombres (modelo y system
+    prompt). Una entrada solo sirve si su respuesta cabe en el max_tokens de
+    la petición, si no se cortó antes de lo que la petición permite
+    (finish_reason y max_tokens con que se generó) y si la pregunta tiene los
+    mismos números y negaciones (guard_terms).
+    """
+
+    def __init__(
+        self,
+        embedder,
+        max_entries: int = 5000,
+        threshold: float = 0.85,
+        ttl: float = 86400,
+        path: Optional[str] = None,
+        save_interval: float = 60.0
+    ):
+        self.embedder = embedder
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl = ttl
+        self.path = path
+        self.save_interval = save_interval
+        self.index: Optional[VectorIndex] = None
+        self.hits = 0
+        self.misses = 0
+        self.lookup_latency = Histogram(LOOKUP_BUCKETS)
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def namespace(model: str, system_prompt: str) -> int:
+        return _namespace_id(f"{model}\x00{system_prompt}")
+
+    async def start(self) -> None:
+        """Cargar el modelo (si lo hay) y abrir el índice guardado"""
+        if self.index is not None:
+            return
+        await asyncio.to_thread(self.embedder.load)
+        self.index = await asyncio.to_thread(
+            VectorIndex, self.embedder.dim, self.max_entries, self.path, self.embedder.name
+        )
+        if self.path is not None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.save()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.save_interval)
+            await self.save()
+
+    async def save(self) -> None:
+        """Guardar el índice si ha cambiado desde la última vez"""
+        if self.index is None or self.path is None or not self.index.dirty:
+            return
+        self.index.dirty = False
+        try:
+            await asyncio.to_thread(self.index.write, self.index.metadata())
+        except OSError as e:
+            self.index.dirty = True
+            logger.warning(f"⚠️  No se pudo guardar la caché semántica: {e}")
+
+    async def _embed(self, text: str) -> "np.ndarray":
+        if self.embedder.blocking:
+            return (await asyncio.to_thread(self.embedder.embed, [text]))[0]
+        return self.embedder.embed([text])[0]
+
+    async def get(self, question: str, namespace: int, max_tokens: int) -> Optional[Tuple[Dict, float]]:
+        """
+        Respuesta guardada más parecida y su similitud, o None
+
+        Mientras el índice se carga (start) no se busca: la petición sigue
+        hacia vLLM en lugar de esperar.
+        """
+        if self.index is None:
+            return None
+        start = time.perf_counter()
+        vector = await self._embed(question)
+        slot, similarity = self.index.search(vector, namespace, max_tokens)
+        self.lookup_latency.observe(time.perf_counter() - start)
+
+        if not self._matches(question, slot, similarity):
+            self.misses += 1
+            return None
+        self.index.touch(slot)
+        self.hits += 1
+        return self.index.entries[slot]["value"], similarity
+
+    async def set(
+        self,
+        question: str,
+        namespace: int,
+        value: Dict,
+        max_tokens: int,
+        finish_reason: Optional[str]
+    ) -> None:
+        """
+        Guardar una respuesta generada con `max_tokens`
+
+        Sustituye a la de una pregunta casi igual, salvo que la guardada sea
+        más completa: una respuesta cortada no reemplaza a una que terminó
+        (finish_reason "stop") ni a una cortada con más max_tokens.
+        """
+        if self.index is None:
+            return
+        vector = await self._embed(question)
+        tokens = value.get("usage", {}).get("completion_tokens", 0)
+        complete = finish_reason == "stop"
+        slot, similarity = self.index.search(vector, namespace, max_tokens=None)
+        if not self._matches(question, slot, similarity):
+            slot = None
+        elif self.index.covers(slot, max_tokens, complete):
+            return
+        self.index.add(vector, namespace, tokens, max_tokens, complete, self.ttl, question, value, slot=slot)
+
+    def _matches(self, question: str, slot: Optional[int], similarity: float) -> bool:
+        """La entrada `slot` es la misma pregunta: similitud y mismos números y negaciones"""
+        return (
+            slot is not None
+            and similarity >= self.threshold
+            and guard_terms(question) == guard_terms(self.index.entries[slot]["question"])
+        )
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "embedder": self.embedder.name,
+            "threshold": self.threshold,
+            "entries": len(self.index) if self.index is not None else 0,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.index.evictions if self.index is not None else 0,
+            "lookup_seconds": self.lookup_latency.summary(6),
+            "persistent": self.path is not None,
+        }
+
+    def prometheus(self) -> List[str]:
+        return [
+            "# TYPE chatbot_semantic_cache_lookups_total counter",
+            f'chatbot_semantic_cache_lookups_total{{result="hit"}} {self.hits}',
+            f'chatbot_semantic_cache_lookups_total{{result="miss"}} {self.misses}',
+            "# TYPE chatbot_semantic_cache_entries gauge",
+            f"chatbot_semantic_cache_entries {len(self.index) if self.index is not None else 0}",
+            "# TYPE chatbot_semantic_cache_evictions_total counter",
+            f"chatbot_semantic_cache_evictions_total {self.index.evictions if self.index is not None else 0}",
+            "# TYPE chatbot_semantic_cache_lookup_seconds histogram",
+            *self.lookup_latency.prometheus("chatbot_semantic_cache_lookup_seconds"),
+        ]
+
+
+def create_semantic_cache() -> Optional[SemanticCache]:
+    """Caché semántica según la configuración, o None si está desactivada"""
+    if not settings.SEMANTIC_CACHE_ENABLED:
+        return None
+    if np is None:
+        logger.warning("⚠️  SEMANTIC_CACHE_ENABLED activo pero falta el paquete 'numpy'; caché semántica desactivada")
+        return None
+
+    if settings.SEMANTIC_CACHE_EMBEDDER == "hashing":
+        embedder = HashingEmbedder(settings.SEMANTIC_CACHE_DIM)
+    else:
+        embedder = SentenceTransformerEmbedder(settings.SEMANTIC_CACHE_EMBEDDER)
+
+    # Varios workers no pueden escribir el mismo memmap: cada uno usa su
+    # índice en memoria
+    path = settings.SEMANTIC_CACHE_PATH
+    if path is not None and settings.WORKERS > 1:
+        logger.warning("⚠️  SEMANTIC_CACHE_PATH se ignora con WORKERS > 1; la caché semántica queda en memoria")
+        path = None
+
+    return SemanticCache(
+        embedder,
+        max_entries=settings.SEMANTIC_CACHE_MAX_ENTRIES,
+        threshold=settings.SEMANTIC_CACHE_THRESHOLD,
+        ttl=settings.SEMANTIC_CACHE_TTL,
+        path=path,
+        save_interval=settings.SEMANTIC_CACHE_SAVE_INTERVAL
+    )
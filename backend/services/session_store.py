@@ -0,0 +1,335 @@
+"""
+Almacén de sesiones de conversación en el servidor
+"""
+import asyncio
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from config import settings
+from fast_json import dumps as json_dumps, loads as json_loads
+from models import ChatMessage
+from services.state_backend import MEMORY, REDIS, create_redis, resolve_backend
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+
+class SessionStore(ABC):
+    """
+    Historial de conversación por id de sesión
+
+    El cliente envía solo el mensaje nuevo y el id; el historial se guarda
+    aquí ya validado, así que no se vuelve a parsear en cada petición. Las
+    sesiones caducan tras `ttl` segundos sin actividad y cada una guarda como
+    mucho `max_messages` mensajes (los más recientes).
+    """
+
+    def __init__(self, ttl: float = 3600, max_messages: int = 50):
+        self.ttl = ttl
+        self.max_messages = max_messages
+
+    @abstractmethod
+    async def get(self, session_id: str) -> List[ChatMessage]:
+        """Historial de la sesión (vacío si no existe o ha caducado)"""
+
+    @abstractmethod
+    async def append(self, session_id: str, messages: List[ChatMessage]) -> None:
+        """Añadir mensajes al final del historial de la sesión"""
+
+    @abstractmethod
+    async def delete(self, session_id: str) -> None:
+        pass
+
+    async def stats(self) -> Dict:
+        return {}
+
+    async def close(self) -> None:
+        pass
+
+
+class InMemorySessionStore(SessionStore):
+    """
+    Sesiones en memoria del proceso con expulsión LRU
+
+    Además del TTL se limita el número de sesiones y el tamaño total del
+    contenido guardado; al superar cualquiera se expulsa la sesión usada hace
+    más tiempo.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 3600,
+        max_messages: int = 50,
+        max_sessions: int = 10000,
+        max_bytes: int = 64 * 1024 * 1024
+    ):
+        super().__init__(ttl, max_messages)
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        # session_id -> [last_access, bytes, mensajes]
+        self._sessions: "OrderedDict[str, list]" = OrderedDict()
+        self._bytes = 0
+        self.evictions = 0
+        self.expired = 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    async def get(self, session_id: str) -> List[ChatMessage]:
+        now = time.monotonic()
+        self._expire(now)
+        session = self._sessions.get(session_id)
+        if session is None:
+            return []
+        if now - session[0] > self.ttl:
+            self._remove(session_id)
+            self.expired += 1
+            return []
+        session[0] = now
+        self._sessions.move_to_end(session_id)
+        return list(session[2])
+
+    async def append(self, session_id: str, messages: List[ChatMessage]) -> None:
+        now = time.monotonic()
+        session = self._sessions.get(session_id)
+        if session is None or now - session[0] > self.ttl:
+            if session is not None:
+                self._remove(session_id)
+            session = self._sessions[session_id] = [now, 0, []]
+        else:
+            self._sessions.move_to_end(session_id)
+        session[0] = now
+
+        history = session[2]
+        for message in messages:
+            history.append(message)
+            size = len(message.content.encode("utf-8"))
+            session[1] += size
+            self._bytes += size
+        while len(history) > self.max_messages:
+            size = len(history.pop(0).content.encode("utf-8"))
+            session[1] -= size
+            self._bytes -= size
+
+        while len(self._sessions) > self.max_sessions or (self._bytes > self.max_bytes and len(self._sessions) > 1):
+            self._remove(next(iter(self._sessions)))
+            self.evictions += 1
+
+    async def delete(self, session_id: str) -> None:
+        if session_id in self._sessions:
+            self._remove(session_id)
+
+    def _expire(self, now: float) -> None:
+        """Descartar como mucho dos sesiones caducadas del inicio del LRU"""
+        for _ in range(2):
+            if not self._sessions:
+                return
+            session_id, (last_access, _, _) = next(iter(self._sessions.items()))
+            if now - last_access <= self.ttl:
+                return
+            self._remove(session_id)
+            self.expired += 1
+
+    def _remove(self, session_id: str) -> None:
+        _, size, _ = self._sessions.pop(session_id)
+        self._bytes -= size
+
+    async def stats(self) -> Dict:
+        return {
+            "backend": MEMORY,
+            "sessions": len(self._sessions),
+            "bytes": self._bytes,
+            "evictions": self.evictions,
+            "expired": self.expired,
+        }
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Sesiones persistentes en SQLite (sobreviven a reinicios del backend)
+
+    Todas las consultas (también las de stats y el cierre) se ejecutan en un
+    hilo para no bloquear el event loop. Las sesiones caducadas se borran
+    periódicamente al escribir.
+    """
+
+    PURGE_EVERY = 100  # Escrituras entre purgas de sesiones caducadas
+
+    def __init__(self, path: str, ttl: float = 3600, max_messages: int = 50):
+        super().__init__(ttl, max_messages)
+        self.path = path
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS session_messages (
+                session_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                PRIMARY KEY (session_id, seq)
+            );
+            CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions(updated_at);
+        """)
+
+    async def get(self, session_id: str) -> List[ChatMessage]:
+        return await asyncio.to_thread(self._get, session_id)
+
+    async def append(self, session_id: str, messages: List[ChatMessage]) -> None:
+        await asyncio.to_thread(self._append, session_id, messages)
+
+    async def delete(self, session_id: str) -> None:
+        await asyncio.to_thread(self._delete, session_id)
+
+    def _get(self, session_id: str) -> List[ChatMessage]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT updated_at FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None or now - row[0] > self.ttl:
+                return []
+            self._conn.execute(
+                "UPDATE sessions SET updated_at = ? WHERE session_id = ?", (now, session_id)
+            )
+            self._conn.commit()
+            rows = self._conn.execute(
+                "SELECT role, content FROM session_messages WHERE session_id = ? ORDER BY seq",
+                (session_id,)
+            ).fetchall()
+        return [ChatMessage.model_construct(role=role, content=content) for role, content in rows]
+
+    def _append(self, session_id: str, messages: List[ChatMessage]) -> None:
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT updated_at FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is not None and now - row[0] > self.ttl:
+                self._conn.execute("DELETE FROM session_messages WHERE session_id = ?", (session_id,))
+            self._conn.execute(
+                "INSERT INTO sessions (session_id, updated_at) VALUES (?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET updated_at = excluded.updated_at",
+                (session_id, now)
+            )
+            last = self._conn.execute(
+                "SELECT COALESCE(MAX(seq), -1) FROM session_messages WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+            self._conn.executemany(
+                "INSERT INTO session_messages (session_id, seq, role, content) VALUES (?, ?, ?, ?)",
+                [(session_id, last + 1 + i, m.role, m.content) for i, m in enumerate(messages)]
+            )
+            self._conn.execute(
+                "DELETE FROM session_messages WHERE session_id = ? AND seq <= ?",
+                (session_id, last + len(messages) - self.max_messages)
+            )
+
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                self._purge(now)
+
+    def _delete(self, session_id: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM session_messages WHERE session_id = ?", (session_id,))
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def _purge(self, now: float) -> None:
+        cutoff = now - self.ttl
+        self._conn.execute(
+            "DELETE FROM session_messages WHERE session_id IN "
+            "(SELECT session_id FROM sessions WHERE updated_at < ?)", (cutoff,)
+        )
+        self._conn.execute("DELETE FROM sessions WHERE updated_at < ?", (cutoff,))
+
+    async def stats(self) -> Dict:
+        return {"backend": "sqlite", "path": self.path, "sessions": await asyncio.to_thread(self._count)}
+
+    async def close(self) -> None:
+        await asyncio.to_thread(self._close)
+
+    def _count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def _close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Sesiones compartidas en Redis entre todos los workers
+
+    Cada sesión es una lista de mensajes JSON que se recorta a `max_messages`
+    y expira tras `ttl` segundos sin actividad. El límite de memoria total es
+    el de Redis (maxmemory).
+    """
+
+    def __init__(self, url: Optional[str] = None, ttl: float = 3600, max_messages: int = 50, prefix: str = "session:"):
+        super().__init__(ttl, max_messages)
+        self.prefix = prefix
+        self._redis = create_redis(url, setting="SESSION_BACKEND")
+
+    async def get(self, session_id: str) -> List[ChatMessage]:
+        key = self.prefix + session_id
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.lrange(key, 0, -1)
+            pipe.expire(key, int(self.ttl))
+            rows, _ = await pipe.execute()
+        return [ChatMessage.model_construct(**json_loads(row)) for row in rows]
+
+    async def append(self, session_id: str, messages: List[ChatMessage]) -> None:
+        key = self.prefix + session_id
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.rpush(key, *(json_dumps({"role": m.role, "content": m.content}) for m in messages))
+            pipe.ltrim(key, -self.max_messages, -1)
+            pipe.expire(key, int(self.ttl))
+            await pipe.execute()
+
+    async def delete(self, session_id: str) -> None:
+        await self._redis.delete(self.prefix + session_id)
+
+    async def stats(self) -> Dict:
+        return {"backend": REDIS}
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+
+def create_session_store() -> SessionStore:
+    """Crear el almacén configurado en SESSION_BACKEND (o STATE_BACKEND)"""
+    backend = resolve_backend(settings.SESSION_BACKEND)
+    if backend == MEMORY:
+        return InMemorySessionStore(
+            ttl=settings.SESSION_TTL,
+            max_messages=settings.SESSION_MAX_MESSAGES,
+            max_sessions=settings.SESSION_MAX_SESSIONS,
+            max_bytes=settings.SESSION_MAX_BYTES
+        )
+    if backend == "sqlite":
+        return SQLiteSessionStore(
+            settings.SESSION_SQLITE_PATH,
+            ttl=settings.SESSION_TTL,
+            max_messages=settings.SESSION_MAX_MESSAGES
+        )
+    if backend == REDIS:
+        return RedisSessionStore(
+            ttl=settings.SESSION_TTL,
+            max_messages=settings.SESSION_MAX_MESSAGES
+        )
+    raise ValueError(f"SESSION_BACKEND desconocido: {backend}")
+
+
+# Instancia global del almacén de sesiones
+session_store = create_session_store()
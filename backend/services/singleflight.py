@@ -0,0 +1,117 @@
+"""
+Coalescencia de peticiones idénticas en vuelo (single-flight)
+"""
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+
+class StreamBroadcast:
+    """
+    Reparte los eventos de un único stream a varios suscriptores
+
+    Los eventos se guardan según llegan, así que un suscriptor que se une tarde
+    recibe primero lo ya emitido y después sigue en vivo.
+    """
+
+    def __init__(self, source: AsyncIterator[Dict]):
+        self.events: List[Dict] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Event()
+        self.task = asyncio.ensure_future(self._pump(source))
+
+    async def _pump(self, source: AsyncIterator[Dict]) -> None:
+        try:
+            async for event in source:
+                self.events.append(event)
+                self._notify()
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(self) -> AsyncIterator[Dict]:
+        index = 0
+        while True:
+            if index < len(self.events):
+                yield self.events[index]
+                index += 1
+            elif self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            else:
+                await self._changed.wait()
+
+
+class SingleFlight:
+    """
+    Comparte una sola llamada upstream entre peticiones concurrentes con la misma clave
+
+    La llamada se ejecuta en su propia tarea: si el cliente que la inició se
+    desconecta, el resto de peticiones que esperan el resultado no se cancelan.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+        self._streams: Dict[str, StreamBroadcast] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def has_call(self, key: str) -> bool:
+        return key in self._calls
+
+    def has_stream(self, key: str) -> bool:
+        return key in self._streams
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Ejecutar `fn` o esperar el resultado de la llamada en vuelo con la misma clave"""
+        task = self._calls.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._finish_call(key, t))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def stream(self, key: str, factory: Callable[[], AsyncIterator[Dict]]) -> AsyncIterator[Dict]:
+        """Suscribirse al stream en vuelo con la misma clave o iniciar uno nuevo"""
+        broadcast = self._streams.get(key)
+        if broadcast is None:
+            self.leaders += 1
+            broadcast = StreamBroadcast(factory())
+            self._streams[key] = broadcast
+            broadcast.task.add_done_callback(lambda _: self._streams.pop(key, None))
+        else:
+            self.coalesced += 1
+        return broadcast.subscribe()
+
+    async def wait(self, key: str) -> Any:
+        """Esperar el resultado de la llamada en vuelo (debe existir, ver has_call)"""
+        self.coalesced += 1
+        return await asyncio.shield(self._calls[key])
+
+    def subscribe(self, key: str) -> AsyncIterator[Dict]:
+        """Unirse al stream en vuelo (debe existir, ver has_stream)"""
+        self.coalesced += 1
+        return self._streams[key].subscribe()
+
+    def _finish_call(self, key: str, task: asyncio.Task) -> None:
+        self._calls.pop(key, None)
+        # Marcar la excepción como recuperada aunque ya no quede nadie esperando
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict:
+        return {
+            "in_flight": len(self._calls) + len(self._streams),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced
+        }
@@ -0,0 +1,55 @@
+"""
+Backend del estado compartido entre workers (en proceso o Redis)
+
+Cada componente con estado (rate limiting, caché de respuestas, sesiones y
+métricas) tiene una implementación en memoria del proceso y otra compartida.
+Por defecto todos usan STATE_BACKEND; cada uno puede sobrescribirlo con su
+propio ajuste (RATE_LIMIT_BACKEND, RESPONSE_CACHE_BACKEND, ...).
+"""
+from typing import Dict, List, Optional
+
+from config import settings
+
+MEMORY = "memory"
+REDIS = "redis"
+
+
+def resolve_backend(override: Optional[str]) -> str:
+    """Backend de un componente: su ajuste propio o STATE_BACKEND"""
+    return override or settings.STATE_BACKEND
+
+
+def create_redis(url: Optional[str] = None, setting: str = "STATE_BACKEND"):
+    """
+    Cliente asíncrono de Redis (el paquete se importa solo si se usa)
+
+    Los clientes conectan de forma perezosa, así que se pueden crear al
+    importar el módulo, antes de que exista el event loop del worker.
+    """
+    try:
+        import redis.asyncio as redis
+    except ImportError as e:
+        raise RuntimeError(
+            f"{setting}=redis requiere el paquete 'redis' (pip install redis)"
+        ) from e
+    return redis.from_url(url or settings.REDIS_URL)
+
+
+def state_backends() -> Dict[str, str]:
+    """Backend efectivo de cada componente con estado"""
+    return {
+        "rate_limit": resolve_backend(settings.RATE_LIMIT_BACKEND),
+        "response_cache": resolve_backend(settings.RESPONSE_CACHE_BACKEND),
+        "sessions": resolve_backend(settings.SESSION_BACKEND),
+        "metrics": resolve_backend(settings.METRICS_BACKEND),
+    }
+
+
+def per_process_components() -> List[str]:
+    """
+    Componentes cuyo estado no se comparte entre workers
+
+    SQLite es compartido entre procesos del mismo host, así que solo cuenta
+    la memoria del proceso.
+    """
+    return [name for name, backend in state_backends().items() if backend == MEMORY]
@@ -0,0 +1,127 @@
+"""
+Conteo de tokens con el tokenizer del modelo
+"""
+import asyncio
+import logging
+import math
+import os
+import threading
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TokenCounter:
+    """
+    Cuenta tokens con el tokenizer del modelo servido por vLLM
+
+    El tokenizer se carga una sola vez: en segundo plano con load_async (el
+    servidor) o la primera vez que hace falta (scripts). Primero se intenta con
+    `tokenizers` (tokenizer.json, carga rápida) y después con `transformers`.
+    Si ninguno está disponible se estima con una cota conservadora de
+    caracteres por token; mientras load_async no termina también se estima,
+    sin memorizar, para no bloquear el event loop esperando la carga. El
+    conteo de cada mensaje se memoriza, así que el historial de una
+    conversación solo se tokeniza una vez.
+    """
+
+    def __init__(
+        self,
+        tokenizer_path: str,
+        chars_per_token: float = 3.0,
+        message_overhead: int = 4,
+        cache_size: int = 10000
+    ):
+        self.tokenizer_path = tokenizer_path
+        self.chars_per_token = chars_per_token
+        self.message_overhead = message_overhead
+        self._encode = None
+        self._backend: Optional[str] = None
+        self._lock = threading.Lock()
+        self._loading = False
+        self._count_cached = lru_cache(maxsize=cache_size)(self._count_text)
+
+    @property
+    def backend(self) -> str:
+        if self._is_loading():
+            return f"estimate ({self.chars_per_token} chars/token, loading)"
+        self.load()
+        return self._backend
+
+    async def load_async(self) -> None:
+        """Cargar el tokenizer en un hilo sin bloquear los conteos del event loop"""
+        if self._backend is not None:
+            return
+        self._loading = True
+        try:
+            await asyncio.to_thread(self.load)
+        finally:
+            self._loading = False
+
+    def _is_loading(self) -> bool:
+        return self._loading and self._backend is None
+
+    def load(self) -> None:
+        """Cargar el tokenizer (idempotente y seguro entre hilos)"""
+        if self._backend is not None:
+            return
+        with self._lock:
+            if self._backend is None:
+                self._encode, self._backend = self._load_tokenizer()
+                logger.info(f"🔤 Tokenizer: {self._backend}")
+
+    def _load_tokenizer(self):
+        tokenizer_file = os.path.join(self.tokenizer_path, "tokenizer.json")
+        try:
+            from tokenizers import Tokenizer
+
+            if os.path.exists(tokenizer_file):
+                tokenizer = Tokenizer.from_file(tokenizer_file)
+                return (lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids)), "tokenizers"
+        except ImportError:
+            pass
+
+        try:
+            from transformers import AutoTokenizer
+
+            tokenizer = AutoTokenizer.from_pretrained(self.tokenizer_path)
+            return (lambda text: len(tokenizer.encode(text, add_special_tokens=False))), "transformers"
+        except Exception as e:
+            logger.warning(f"⚠️  No se pudo cargar el tokenizer de {self.tokenizer_path}: {e}")
+
+        return None, self._estimate_name()
+
+    def _estimate_name(self) -> str:
+        return f"estimate ({self.chars_per_token} chars/token)"
+
+    def _estimate(self, text: str) -> int:
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def count_text(self, text: str) -> int:
+        """Tokens de un texto"""
+        if self._is_loading():
+            return self._estimate(text)
+        return self._count_cached(text)
+
+    def _count_text(self, text: str) -> int:
+        self.load()
+        if self._encode is None:
+            return self._estimate(text)
+        return self._encode(text)
+
+    def count_message(self, message: Dict[str, str]) -> int:
+        """Tokens de un mensaje de chat, incluidos los marcadores de rol"""
+        return self.count_text(message["content"]) + self.message_overhead
+
+    def count_messages(self, messages: List[Dict[str, str]]) -> int:
+        return sum(self.count_message(m) for m in messages)
+
+    def stats(self) -> Dict:
+        info = self._count_cached.cache_info()
+        return {
+            "backend": self._backend,
+            "cache_hits": info.hits,
+            "cache_misses": info.misses,
+            "cache_size": info.currsize,
+        }
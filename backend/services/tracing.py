@@ -0,0 +1,323 @@
+"""
+Trazas por petición: spans con reloj monotónico, cabecera Server-Timing y
+exportación compatible con OpenTelemetry (OTLP/JSON)
+
+Cada petición HTTP tiene una traza con un span raíz; las etapas (validación,
+cola de admisión, llamada a vLLM, prefill/decode, serialización...) añaden
+spans hijos. Los tiempos se miden con `time.perf_counter_ns()` y solo al
+exportar se convierten a tiempo Unix. Sin traza activa (p. ej. desde
+batch_runner) `span()` no hace nada.
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional
+
+import httpx
+
+from config import settings
+from fast_json import dumps as json_dumps
+
+logger = logging.getLogger(__name__)
+
+# Tipos de span de OTLP
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+
+def _span_id() -> str:
+    return os.urandom(8).hex()
+
+
+class Span:
+    """Intervalo con nombre dentro de una traza"""
+
+    __slots__ = ("name", "span_id", "parent_id", "start_ns", "end_ns", "kind", "attributes")
+
+    def __init__(self, name: str, parent_id: Optional[str], kind: int = SPAN_KIND_INTERNAL, start_ns: Optional[int] = None):
+        self.name = name
+        self.span_id = _span_id()
+        self.parent_id = parent_id
+        self.start_ns = start_ns if start_ns is not None else time.perf_counter_ns()
+        self.end_ns: Optional[int] = None
+        self.kind = kind
+        self.attributes: Dict = {}
+
+    def end(self, end_ns: Optional[int] = None) -> None:
+        self.end_ns = end_ns if end_ns is not None else time.perf_counter_ns()
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.perf_counter_ns()) - self.start_ns) / 1e6
+
+
+class Trace:
+    """Spans de una petición"""
+
+    def __init__(self, request_id: str, name: str):
+        self.trace_id = uuid.uuid4().hex
+        self.request_id = request_id
+        # Referencia para pasar de perf_counter a tiempo Unix al exportar
+        self._epoch_offset_ns = time.time_ns() - time.perf_counter_ns()
+        self.root = Span(name, None, kind=SPAN_KIND_SERVER)
+        self.spans: List[Span] = [self.root]
+        self.sampled = random.random() < settings.TRACING_SAMPLE_RATE
+
+    def start_span(self, name: str, parent: Optional[Span] = None, kind: int = SPAN_KIND_INTERNAL, **attributes) -> Span:
+        span = Span(name, (parent or self.root).span_id, kind)
+        span.attributes.update(attributes)
+        self.spans.append(span)
+        return span
+
+    def record(self, name: str, start_ns: int, end_ns: int, parent: Optional[Span] = None, **attributes) -> Span:
+        """Añadir un span ya terminado (para etapas medidas a mano)"""
+        span = Span(name, (parent or self.root).span_id, start_ns=start_ns)
+        span.end(end_ns)
+        span.attributes.update(attributes)
+        self.spans.append(span)
+        return span
+
+    def traceparent(self, span: Optional[Span] = None) -> str:
+        """Cabecera W3C traceparent para propagar la traza"""
+        return f"00-{self.trace_id}-{(span or self.root).span_id}-{'01' if self.sampled else '00'}"
+
+    def server_timing(self) -> str:
+        """
+        Cabecera Server-Timing con las etapas terminadas (ms)
+
+        Las etapas repetidas (p. ej. reintentos) se suman.
+        """
+        totals: Dict[str, float] = {}
+        for span in self.spans[1:]:
+            if span.end_ns is not None:
+                totals[span.name] = totals.get(span.name, 0.0) + span.duration_ms
+        totals["total"] = self.root.duration_ms
+        return ", ".join(f"{name};dur={ms:.1f}" for name, ms in totals.items())
+
+    def to_otlp(self) -> List[Dict]:
+        """Spans en formato OTLP/JSON"""
+        offset = self._epoch_offset_ns
+        return [
+            {
+                "traceId": self.trace_id,
+                "spanId": span.span_id,
+                **({"parentSpanId": span.parent_id} if span.parent_id else {}),
+                "name": span.name,
+                "kind": span.kind,
+                "startTimeUnixNano": str(span.start_ns + offset),
+                "endTimeUnixNano": str((span.end_ns or span.start_ns) + offset),
+                "attributes": [
+                    {"key": "request.id", "value": {"stringValue": self.request_id}},
+                    *(_otlp_attribute(key, value) for key, value in span.attributes.items()),
+                ],
+            }
+            for span in self.spans
+        ]
+
+
+def _otlp_attribute(key: str, value) -> Dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+# Traza y span activos en la tarea actual
+current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def get_trace() -> Optional[Trace]:
+    return current_trace.get()
+
+
+@contextmanager
+def span(name: str, kind: int = SPAN_KIND_INTERNAL, **attributes) -> Iterator[Optional[Span]]:
+    """
+    Medir un bloque como span hijo del span activo
+
+    No usar alrededor de un `yield` de un generador asíncrono: el contexto
+    puede cambiar entre iteraciones. Para eso está `Trace.record`.
+    """
+    trace = current_trace.get()
+    if trace is None:
+        yield None
+        return
+    current = trace.start_span(name, current_span.get(), kind, **attributes)
+    token = current_span.set(current)
+    try:
+        yield current
+    finally:
+        current.end()
+        current_span.reset(token)
+
+
+def record_since_start(name: str, **attributes) -> None:
+    """Registrar un span desde el inicio de la petición hasta ahora"""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.record(name, trace.root.start_ns, time.perf_counter_ns(), **attributes)
+
+
+def propagation_headers() -> Dict[str, str]:
+    """Cabeceras para enviar a vLLM (id de petición y traceparent del span activo)"""
+    trace = current_trace.get()
+    if trace is None:
+        return {}
+    return {"X-Request-ID": trace.request_id, "traceparent": trace.traceparent(current_span.get())}
+
+
+# Eventos de httpcore que se convierten en spans de la llamada a vLLM
+_HTTPCORE_STAGES = {
+    "connection.connect_tcp": "upstream.connect",
+    "connection.start_tls": "upstream.tls",
+    "http11.receive_response_headers": "upstream.wait",
+    "http2.receive_response_headers": "upstream.wait",
+    "http11.receive_response_body": "upstream.body",
+    "http2.receive_response_body": "upstream.body",
+}
+
+
+def upstream_trace_extension(parent: Optional[Span]) -> Dict:
+    """
+    Extensión `trace` de httpx que registra las etapas de la conexión
+
+    upstream.connect/tls solo aparecen si no había conexión libre en el pool;
+    upstream.wait es el tiempo hasta las cabeceras de vLLM (en peticiones sin
+    streaming incluye prefill y decode).
+    """
+    trace = current_trace.get()
+    if trace is None or parent is None:
+        return {}
+    started: Dict[str, int] = {}
+
+    async def hook(event_name: str, info: Dict) -> None:
+        stage, _, phase = event_name.rpartition(".")
+        if phase == "started":
+            started[stage] = time.perf_counter_ns()
+        elif phase in ("complete", "failed") and stage in _HTTPCORE_STAGES and stage in started:
+            trace.record(_HTTPCORE_STAGES[stage], started.pop(stage), time.perf_counter_ns(), parent=parent)
+
+    return {"trace": hook}
+
+
+class TraceExporter:
+    """
+    Exportar las trazas muestreadas en lotes, fuera del camino de la petición
+
+    `file` añade una línea OTLP/JSON por lote a TRACING_FILE; `otlp` las envía
+    a un collector de OpenTelemetry por OTLP/HTTP (JSON).
+    """
+
+    def __init__(self, kind: str, path: str, endpoint: str, service_name: str,
+                 batch_size: int = 256, interval: float = 2.0, max_pending: int = 10000):
+        self.kind = kind
+        self.path = path
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_pending = max_pending
+        self._pending: List[Dict] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self.exported = 0
+        self.dropped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.kind != "none"
+
+    def submit(self, trace: Trace) -> None:
+        if not self.enabled or not trace.sampled:
+            return
+        spans = trace.to_otlp()
+        if len(self._pending) + len(spans) > self.max_pending:
+            self.dropped += len(spans)
+            return
+        self._pending.extend(spans)
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    async def start(self) -> None:
+        if self.enabled and self._task is None:
+            if self.kind == "otlp":
+                self._client = httpx.AsyncClient(timeout=5.0)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+        spans, self._pending = self._pending, []
+        body = json_dumps({
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+                "scopeSpans": [{"scope": {"name": "chatbot-backend"}, "spans": spans}],
+            }]
+        })
+        try:
+            if self.kind == "file":
+                await asyncio.to_thread(self._append, body)
+            elif self._client is not None:
+                response = await self._client.post(
+                    self.endpoint, content=body, headers={"Content-Type": "application/json"}
+                )
+                response.raise_for_status()
+            self.exported += len(spans)
+        except Exception as e:
+            self.dropped += len(spans)
+            logger.warning(f"⚠️  No se pudieron exportar {len(spans)} spans: {e}")
+
+    def _append(self, body: bytes) -> None:
+        with open(self.path, "ab") as f:
+            f.write(body + b"\n")
+
+    def stats(self) -> Dict:
+        return {
+            "exporter": self.kind,
+            "sample_rate": settings.TRACING_SAMPLE_RATE,
+            "pending_spans": len(self._pending),
+            "exported_spans": self.exported,
+            "dropped_spans": self.dropped,
+        }
+
+
+# Instancia global del exportador de trazas
+trace_exporter = TraceExporter(
+    settings.TRACING_EXPORTER,
+    path=settings.TRACING_FILE,
+    endpoint=settings.TRACING_OTLP_ENDPOINT,
+    service_name=settings.TRACING_SERVICE_NAME
+)
@@ -0,0 +1,197 @@
+"""
+Enrutado entre varias réplicas de vLLM con afinidad por prefijo
+"""
+import hashlib
+import math
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional
+
+import httpx
+
+from services.circuit_breaker import CircuitBreaker, CircuitOpenError
+from services.metrics import LATENCY_BUCKETS, Histogram
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class Replica:
+    """Una réplica de vLLM: su cliente HTTP, circuit breaker, salud y carga"""
+
+    def __init__(self, url: str, breaker: CircuitBreaker):
+        self.url = url
+        self.breaker = breaker
+        self.client: Optional[httpx.AsyncClient] = None
+        self.healthy: Optional[bool] = None  # None: todavía sin sondear
+        self.health_failures = 0
+        self.outstanding = 0
+        self.requests = 0
+        self.errors = 0
+        self.latency = Histogram(LATENCY_BUCKETS)
+
+    def stats(self) -> Dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "circuit_breaker": self.breaker.state,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "latency_seconds": self.latency.summary(),
+        }
+
+
+class UpstreamRouter:
+    """
+    Elige la réplica de vLLM para cada petición
+
+    Con clave de afinidad (conversación o prefijo del prompt) se usa hashing
+    consistente con carga acotada: la petición va a la réplica dueña de la
+    clave en el anillo, así el prefix cache de vLLM sigue sirviendo el system
+    prompt y los turnos anteriores; si esa réplica está caída, con el circuito
+    abierto o con más de `load_factor` veces la carga media (y al menos
+    `min_load` peticiones en curso, ya que vLLM agrupa muchas secuencias por
+    lote), se pasa a la siguiente del anillo. Sin clave se elige la réplica con menos peticiones
+    en curso.
+    """
+
+    def __init__(
+        self,
+        urls: Iterable[str],
+        breaker_factory: Callable[[], CircuitBreaker],
+        load_factor: float = 1.5,
+        min_load: int = 16,
+        virtual_nodes: int = 100,
+        health_failure_threshold: int = 2
+    ):
+        self.replicas = [Replica(url.rstrip("/"), breaker_factory()) for url in urls]
+        if not self.replicas:
+            raise ValueError("Hace falta al menos una URL de vLLM")
+        self.load_factor = load_factor
+        self.min_load = min_load
+        self.health_failure_threshold = health_failure_threshold
+        self.affinity_hits = 0
+        self.affinity_misses = 0
+
+        ring = sorted((
+            (_hash(f"{replica.url}#{i}"), replica)
+            for replica in self.replicas
+            for i in range(virtual_nodes)
+        ), key=lambda item: item[0])
+        self._ring_hashes = [h for h, _ in ring]
+        self._ring_replicas = [replica for _, replica in ring]
+
+    def _ring_order(self, key: str) -> List[Replica]:
+        """Réplicas en orden de preferencia para `key` (recorriendo el anillo)"""
+        order: List[Replica] = []
+        start = bisect_left(self._ring_hashes, _hash(key))
+        n = len(self._ring_replicas)
+        for i in range(n):
+            replica = self._ring_replicas[(start + i) % n]
+            if replica not in order:
+                order.append(replica)
+                if len(order) == len(self.replicas):
+                    break
+        return order
+
+    def candidates(self, affinity_key: Optional[str] = None) -> List[Replica]:
+        """Réplicas en orden de preferencia (las caídas o con el circuito abierto al final)"""
+        up, down = [], []
+        for r in self.replicas:
+            (down if r.healthy is False or r.breaker.is_open() else up).append(r)
+        if affinity_key is None or len(up) < 2:
+            return sorted(up, key=lambda r: r.outstanding) + down
+
+        # Carga acotada: ninguna réplica por encima de load_factor × la media
+        total = sum(r.outstanding for r in up) + 1
+        limit = max(self.min_load, math.ceil(self.load_factor * total / len(up)))
+        preferred = [r for r in self._ring_order(affinity_key) if r in up]
+        within = [r for r in preferred if r.outstanding < limit]
+        over = sorted((r for r in preferred if r.outstanding >= limit), key=lambda r: r.outstanding)
+        return within + over + down
+
+    def acquire(self, affinity_key: Optional[str] = None, exclude: Iterable[Replica] = ()) -> Replica:
+        """
+        Elegir réplica y contarla como ocupada
+
+        Las réplicas de `exclude` (ya fallaron en esta petición) solo se usan si
+        no queda otra. Lanza CircuitOpenError si todas tienen el circuito abierto.
+        """
+        exclude = set(exclude)
+        order = self.candidates(affinity_key)
+        order = [r for r in order if r not in exclude] + [r for r in order if r in exclude]
+
+        retry_after = None
+        for replica in order:
+            try:
+                replica.breaker.before_call()
+            except CircuitOpenError as e:
+                retry_after = e.retry_after if retry_after is None else min(retry_after, e.retry_after)
+                continue
+            if affinity_key is not None and len(self.replicas) > 1:
+                if replica is self._ring_order(affinity_key)[0]:
+                    self.affinity_hits += 1
+                else:
+                    self.affinity_misses += 1
+            replica.outstanding += 1
+            replica.requests += 1
+            return replica
+        raise CircuitOpenError(retry_after)
+
+    def release(self, replica: Replica, elapsed: Optional[float], ok: bool = True) -> None:
+        """
+        Fin de una petición a `replica`; con `elapsed=None` (petición
+        cancelada) no cuenta ni como latencia ni como error
+        """
+        replica.outstanding -= 1
+        if elapsed is None:
+            return
+        if ok:
+            replica.latency.observe(elapsed)
+        else:
+            replica.errors += 1
+
+    def record_health(self, replica: Replica, ok: bool) -> None:
+        """Resultado de un sondeo de salud de `replica`"""
+        if ok:
+            replica.health_failures = 0
+            healthy = True
+        else:
+            replica.health_failures += 1
+            healthy = False if (
+                replica.healthy is None or replica.health_failures >= self.health_failure_threshold
+            ) else replica.healthy
+        if healthy != replica.healthy:
+            replica.breaker.record_health(healthy)
+        replica.healthy = healthy
+
+    @property
+    def breaker_state(self) -> str:
+        """Estado agregado: closed si alguna réplica acepta tráfico normal"""
+        states = {r.breaker.state for r in self.replicas}
+        for state in (CircuitBreaker.CLOSED, CircuitBreaker.HALF_OPEN):
+            if state in states:
+                return state
+        return CircuitBreaker.OPEN
+
+    def stats(self) -> Dict:
+        lookups = self.affinity_hits + self.affinity_misses
+        return {
+            "replicas": [r.stats() for r in self.replicas],
+            "affinity_hits": self.affinity_hits,
+            "affinity_misses": self.affinity_misses,
+            "affinity_hit_rate": round(self.affinity_hits / lookups, 4) if lookups else None,
+        }
+
+    def prometheus(self) -> List[str]:
+        lines = ["# TYPE chatbot_upstream_outstanding gauge"]
+        lines += [f'chatbot_upstream_outstanding{{replica="{r.url}"}} {r.outstanding}' for r in self.replicas]
+        lines.append("# TYPE chatbot_upstream_healthy gauge")
+        lines += [f'chatbot_upstream_healthy{{replica="{r.url}"}} {int(bool(r.healthy))}' for r in self.replicas]
+        lines.append("# TYPE chatbot_upstream_replica_errors_total counter")
+        lines += [f'chatbot_upstream_replica_errors_total{{replica="{r.url}"}} {r.errors}' for r in self.replicas]
+        lines.append("# TYPE chatbot_upstream_replica_latency_seconds histogram")
+        for r in self.replicas:
+            lines += r.latency.prometheus("chatbot_upstream_replica_latency_seconds", f'replica="{r.url}"')
+        return lines
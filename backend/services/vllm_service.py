@@ -2,64 +2,282 @@
 Servicio para comunicación con vLLM
 """
 import httpx
+import logging
+import math
 import time
-from typing import List, Dict, Optional
+import asyncio
+from typing import TYPE_CHECKING, AsyncIterator, List, Dict, Optional, Tuple
 from config import settings
+from fast_json import dumps as json_dumps, loads as json_loads
 from models import ChatMessage
+from services.admission import AdmissionController
+from services.circuit_breaker import CircuitBreaker
+from services.retry import BREAKER_FAILURES, CONNECT_ERROR, RetryBudget, RetryPolicy, classify_error
+from services.health_monitor import HealthMonitor
+from services.metrics import metrics
+from services.preflight import Preflight, PromptPlan
+from services.response_cache import ResponseCache, create_response_cache
+from services.singleflight import SingleFlight
+from services.tokenizer import TokenCounter
+from services.tracing import SPAN_KIND_CLIENT, get_trace, propagation_headers, span, upstream_trace_extension
+from services.upstream_router import Replica, UpstreamRouter
+
+if TYPE_CHECKING:
+    from services.semantic_cache import SemanticCache
+
+logger = logging.getLogger(__name__)
 
 class VLLMService:
     """Servicio para interactuar con el servidor vLLM"""
     
-    def __init__(self):
-        self.api_url = settings.VLLM_API_URL
+    def __init__(self, api_urls: Optional[List[str]] = None):
+        api_urls = api_urls or settings.VLLM_API_URLS or [settings.VLLM_API_URL]
+        self.api_url = api_urls[0]
         self.model_name = settings.VLLM_MODEL_NAME
         self.timeout = settings.VLLM_TIMEOUT
+        self.token_counter = TokenCounter(
+            settings.TOKENIZER_PATH or self.model_name,
+            chars_per_token=settings.TOKENIZER_CHARS_PER_TOKEN,
+            cache_size=settings.TOKEN_COUNT_CACHE_SIZE
+        )
+        self.preflight = Preflight(
+            self.token_counter,
+            settings.SYSTEM_PROMPT,
+            settings.MAX_MODEL_LEN,
+            template_overhead=settings.PROMPT_TEMPLATE_OVERHEAD,
+            min_completion_tokens=settings.PREFLIGHT_MIN_COMPLETION_TOKENS,
+            history_max_messages=settings.HISTORY_MAX_MESSAGES,
+            enabled=settings.PREFLIGHT_ENABLED
+        )
+        self.cache: Optional[ResponseCache] = create_response_cache()
+        # La caché semántica importa numpy: solo se carga el módulo si se usa
+        self.semantic_cache: Optional["SemanticCache"] = None
+        if settings.SEMANTIC_CACHE_ENABLED:
+            from services.semantic_cache import create_semantic_cache
+            self.semantic_cache = create_semantic_cache()
+        self.singleflight: Optional[SingleFlight] = (
+            SingleFlight() if settings.SINGLEFLIGHT_ENABLED else None
+        )
+        # Los límites de admisión son para todo el servidor: cada worker
+        # aplica su parte para que vLLM no reciba WORKERS veces más carga
+        workers = max(1, settings.WORKERS)
+        self.admission = AdmissionController(
+            max_concurrency=math.ceil(settings.ADMISSION_MAX_CONCURRENCY / workers),
+            max_queue=math.ceil(settings.ADMISSION_MAX_QUEUE / workers),
+            max_queue_time=settings.ADMISSION_MAX_QUEUE_TIME,
+            adaptive=settings.ADMISSION_ADAPTIVE,
+            min_concurrency=settings.ADMISSION_MIN_CONCURRENCY,
+            target_latency=settings.ADMISSION_TARGET_LATENCY,
+            weights=settings.PRIORITY_WEIGHTS,
+            default_priority=settings.PRIORITY_DEFAULT
+        )
+        # Un circuit breaker por réplica
+        self.router = UpstreamRouter(
+            api_urls,
+            breaker_factory=lambda: CircuitBreaker(
+                failure_threshold=settings.BREAKER_FAILURE_THRESHOLD,
+                reset_timeout=settings.BREAKER_RESET_TIMEOUT,
+                probe_interval=settings.BREAKER_PROBE_INTERVAL
+            ),
+            load_factor=settings.UPSTREAM_AFFINITY_LOAD_FACTOR,
+            min_load=settings.UPSTREAM_AFFINITY_MIN_LOAD,
+            health_failure_threshold=settings.HEALTH_FAILURE_THRESHOLD
+        )
+        self.retry_policy = RetryPolicy(
+            max_retries=settings.UPSTREAM_MAX_RETRIES,
+            base_delay=settings.UPSTREAM_RETRY_BASE_DELAY,
+            max_delay=settings.UPSTREAM_RETRY_MAX_DELAY,
+            budget=RetryBudget(
+                ratio=settings.UPSTREAM_RETRY_BUDGET_RATIO,
+                min_per_second=settings.UPSTREAM_RETRY_BUDGET_MIN_PER_SECOND
+            )
+        )
+        self.health_monitor = HealthMonitor(
+            self.check_health,
+            interval=settings.HEALTH_CHECK_INTERVAL,
+            jitter=settings.HEALTH_CHECK_JITTER,
+            failure_threshold=settings.HEALTH_FAILURE_THRESHOLD
+        )
+    
+    def _create_client(self, base_url: str) -> httpx.AsyncClient:
+        """Crear el cliente HTTP compartido con pool de conexiones"""
+        limits = httpx.Limits(
+            max_connections=settings.VLLM_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.VLLM_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=settings.VLLM_KEEPALIVE_EXPIRY
+        )
+        http2 = settings.VLLM_HTTP2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("⚠️  VLLM_HTTP2 activo pero falta el paquete 'h2'; usando HTTP/1.1")
+                http2 = False
+        
+        return httpx.AsyncClient(
+            base_url=base_url,
+            timeout=self.timeout,
+            limits=limits,
+            http2=http2
+        )
+    
+    def _client_for(self, replica: Replica) -> httpx.AsyncClient:
+        """Cliente de la réplica (se crea bajo demanda si no se llamó a start)"""
+        if replica.client is None or replica.client.is_closed:
+            replica.client = self._create_client(replica.url)
+        return replica.client
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Cliente de la réplica preferida ahora mismo"""
+        return self._client_for(self.router.candidates()[0])
+    
+    async def start(self) -> None:
+        """Abrir los clientes HTTP compartidos (llamado desde lifespan)"""
+        for replica in self.router.replicas:
+            self._client_for(replica)
+    
+    async def load(self) -> None:
+        """
+        Cargar los componentes lentos (tokenizer, caché semántica) fuera del
+        event loop; se llama en segundo plano mientras el servidor ya acepta
+        conexiones
+        """
+        await self.token_counter.load_async()
+        if self.semantic_cache is not None:
+            await self.semantic_cache.start()
+    
+    async def close(self) -> None:
+        """Cerrar los clientes HTTP compartidos y liberar sus conexiones"""
+        for replica in self.router.replicas:
+            if replica.client is not None:
+                await replica.client.aclose()
+                replica.client = None
+        if self.cache is not None:
+            await self.cache.close()
+        if self.semantic_cache is not None:
+            await self.semantic_cache.close()
     
     async def check_health(self) -> bool:
-        """Verificar si el servidor vLLM está disponible"""
+        """Sondear todas las réplicas; True si alguna está disponible"""
+        results = await asyncio.gather(*(
+            self._check_replica(replica) for replica in self.router.replicas
+        ))
+        return any(results)
+    
+    async def _check_replica(self, replica: Replica) -> bool:
         try:
-            async with httpx.AsyncClient(timeout=5.0) as client:
-                response = await client.get(f"{self.api_url}/health")
-                return response.status_code == 200
+            response = await self._client_for(replica).get("/health", timeout=settings.HEALTH_CHECK_TIMEOUT)
+            ok = response.status_code == 200
         except Exception:
-            return False
+            ok = False
+        self.router.record_health(replica, ok)
+        return ok
     
     async def get_models(self) -> Dict:
         """Obtener lista de modelos disponibles"""
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(f"{self.api_url}/v1/models")
-            response.raise_for_status()
-            return response.json()
+        response = await self.client.get("/v1/models", timeout=10.0)
+        response.raise_for_status()
+        return json_loads(response.content)
     
     def _build_messages(
         self, 
         user_message: str, 
-        conversation_history: Optional[List[ChatMessage]] = None
+        conversation_history: Optional[List[ChatMessage]] = None,
+        max_tokens: int = settings.DEFAULT_MAX_TOKENS
     ) -> List[Dict[str, str]]:
-        """Construir array de mensajes para vLLM"""
-        messages = []
-        
-        # Agregar system prompt
-        messages.append({
-            "role": "system",
-            "content": settings.SYSTEM_PROMPT
-        })
+        """
+        Construir array de mensajes para vLLM
         
-        # Agregar historial de conversación si existe
-        if conversation_history:
-            for msg in conversation_history[-6:]:  # Últimos 6 mensajes (3 turnos)
-                messages.append({
-                    "role": msg.role,
-                    "content": msg.content
-                })
+        El historial se recorta por presupuesto de tokens: se reservan
+        `max_tokens` para la respuesta dentro de MAX_MODEL_LEN y se añaden los
+        turnos más recientes mientras quepan. No cuenta en las estadísticas de
+        la comprobación previa (lo usa el calentamiento).
+        """
+        return self.preflight.plan(user_message, conversation_history, max_tokens, record=False).messages
+    
+    def _plan_prompt(
+        self,
+        user_message: str,
+        conversation_history: Optional[List[ChatMessage]],
+        max_tokens: int
+    ) -> PromptPlan:
+        """
+        Comprobación previa de la petición (ver services.preflight): lanza
+        PromptTooLong antes de tocar caché, cola o red si no cabe
+        """
+        with span("prompt") as prompt_span:
+            plan = self.preflight.plan(user_message, conversation_history, max_tokens)
+            if prompt_span is not None:
+                prompt_span.attributes["prompt.tokens"] = plan.prompt_tokens
+                prompt_span.attributes["prompt.max_tokens"] = plan.max_tokens
+                prompt_span.attributes["prompt.dropped_messages"] = plan.dropped_messages
+        return plan
+    
+    def _request_key(self, payload: Dict) -> Optional[str]:
+        """
+        Clave de la petición para caché y coalescencia, o None si no aplica
         
-        # Agregar mensaje actual del usuario
-        messages.append({
-            "role": "user",
-            "content": user_message
+        Solo se comparten generaciones deterministas (temperature=0) salvo que
+        RESPONSE_CACHE_ALLOW_NONDETERMINISTIC lo permita explícitamente.
+        """
+        if payload["temperature"] != 0 and not settings.RESPONSE_CACHE_ALLOW_NONDETERMINISTIC:
+            return None
+        return ResponseCache.make_key({
+            "model": payload["model"],
+            "messages": payload["messages"],
+            "max_tokens": payload["max_tokens"],
+            "temperature": payload["temperature"]
         })
+    
+    def _semantic_namespace(self, messages: List[Dict[str, str]], temperature: float) -> Optional[int]:
+        """
+        Espacio de nombres de la caché semántica, o None si no aplica
         
-        return messages
+        Solo se comparten respuestas a preguntas sin historial (con turnos
+        anteriores la misma pregunta puede necesitar otra respuesta) y, como en
+        la caché exacta, generaciones deterministas salvo que
+        RESPONSE_CACHE_ALLOW_NONDETERMINISTIC lo permita.
+        """
+        if self.semantic_cache is None or len(messages) != 2:
+            return None
+        if temperature != 0 and not settings.RESPONSE_CACHE_ALLOW_NONDETERMINISTIC:
+            return None
+        return self.semantic_cache.namespace(self.model_name, messages[0]["content"])
+    
+    async def _semantic_lookup(self, message: str, namespace: Optional[int], max_tokens: int) -> Optional[Dict]:
+        """Respuesta de una pregunta parecida ya respondida, o None"""
+        if namespace is None:
+            return None
+        with span("semantic_cache") as cache_span:
+            match = await self.semantic_cache.get(message, namespace, max_tokens)
+            if cache_span is not None:
+                cache_span.attributes["cache.hit"] = match is not None
+                if match is not None:
+                    cache_span.attributes["cache.similarity"] = round(match[1], 4)
+        return match[0] if match is not None else None
+    
+    async def _semantic_store(self, message: str, namespace: Optional[int], max_tokens: int, completion: Dict) -> None:
+        if namespace is not None and completion["response"]:
+            await self.semantic_cache.set(
+                message, namespace,
+                {"response": completion["response"], "model": completion["model"], "usage": completion["usage"]},
+                max_tokens=max_tokens,
+                finish_reason=completion.get("finish_reason")
+            )
+    
+    @staticmethod
+    def _affinity_key(messages: List[Dict[str, str]], session_id: Optional[str] = None) -> Optional[str]:
+        """
+        Clave de afinidad de réplica: la sesión o, sin ella, el prefijo estable
+        del prompt (system prompt + primer mensaje de la conversación), que es
+        lo que el prefix cache de vLLM puede reutilizar entre turnos
+        """
+        if not settings.UPSTREAM_AFFINITY_ENABLED:
+            return None
+        if session_id:
+            return session_id
+        return "\x00".join(m["content"] for m in messages[:2])
     
     async def chat_completion(
         self,
@@ -67,42 +285,414 @@ class VLLMService:
         conversation_history: Optional[List[ChatMessage]] = None,
         max_tokens: int = 500,
         temperature: float = 0.7,
-        stream: bool = False
+        stream: bool = False,
+        session_id: Optional[str] = None,
+        priority: Optional[str] = None,
+        tenant: str = "default"
     ) -> Dict:
         """
         Generar respuesta usando Chat Completions API
         
+        `priority` y `tenant` deciden el orden en la cola de admisión si vLLM
+        está saturado.
+        
         Returns:
             Dict con response, usage stats y timing
         """
-        messages = self._build_messages(message, conversation_history)
+        if stream:
+            return await self._collect_stream(
+                message, conversation_history, max_tokens, temperature, session_id, priority, tenant
+            )
+        
+        start_time = time.perf_counter()
+        
+        plan = self._plan_prompt(message, conversation_history, max_tokens)
+        messages, max_tokens = plan.messages, plan.max_tokens
         
         payload = {
             "model": self.model_name,
             "messages": messages,
             "max_tokens": max_tokens,
             "temperature": temperature,
-            "stream": stream
+            "stream": False
         }
+        affinity = self._affinity_key(messages, session_id)
         
-        start_time = time.time()
+        key = self._request_key(payload)
+        if key is not None and self.cache is not None:
+            with span("cache") as cache_span:
+                cached = await self.cache.get(key)
+                if cache_span is not None:
+                    cache_span.attributes["cache.hit"] = cached is not None
+            if cached is not None:
+                return {
+                    **cached,
+                    "latency_seconds": round(time.perf_counter() - start_time, 6),
+                    "cached": True
+                }
         
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            response = await client.post(
-                f"{self.api_url}/v1/chat/completions",
-                json=payload
-            )
-            response.raise_for_status()
-            result = response.json()
+        namespace = self._semantic_namespace(messages, temperature)
+        similar = await self._semantic_lookup(message, namespace, max_tokens)
+        if similar is not None:
+            return {
+                **similar,
+                "latency_seconds": round(time.perf_counter() - start_time, 6),
+                "cached": True
+            }
         
-        elapsed_time = time.time() - start_time
+        if key is not None and self.singleflight is not None:
+            if self.singleflight.has_stream(key):
+                # Unirse a un stream idéntico que ya está en curso
+                completion = await self._collect_events(self.singleflight.subscribe(key))
+            else:
+                completion = await self.singleflight.do(
+                    key, lambda: self._request_completion(payload, key, affinity, priority, tenant)
+                )
+        else:
+            completion = await self._request_completion(payload, key, affinity, priority, tenant)
+        await self._semantic_store(message, namespace, max_tokens, completion)
+        
+        elapsed_time = time.perf_counter() - start_time
         
-        # Extraer información relevante
         return {
-            "response": result["choices"][0]["message"]["content"].strip(),
+            **completion,
+            "latency_seconds": round(elapsed_time, 2),
+            "cached": False
+        }
+    
+    async def _request_completion(
+        self,
+        payload: Dict,
+        key: Optional[str],
+        affinity: Optional[str] = None,
+        priority: Optional[str] = None,
+        tenant: str = "default"
+    ) -> Dict:
+        """Llamar a /v1/chat/completions y guardar el resultado en la caché"""
+        async with self.admission.slot(priority, tenant):
+            start_time = time.perf_counter()
+            response, _ = await self._send("/v1/chat/completions", payload, affinity_key=affinity)
+            result = json_loads(response.content)
+        
+        # Extraer información relevante
+        choice = result["choices"][0]
+        completion = {
+            "response": choice["message"]["content"].strip(),
             "model": result["model"],
             "usage": result.get("usage", {}),
-            "latency_seconds": round(elapsed_time, 2)
+            "finish_reason": choice.get("finish_reason")
+        }
+        metrics.record_upstream(time.perf_counter() - start_time, completion["usage"])
+        if key is not None and self.cache is not None:
+            await self.cache.set(key, completion)
+        return completion
+    
+    async def chat_completion_stream(
+        self,
+        message: str,
+        conversation_history: Optional[List[ChatMessage]] = None,
+        max_tokens: int = 500,
+        temperature: float = 0.7,
+        session_id: Optional[str] = None,
+        priority: Optional[str] = None,
+        tenant: str = "default"
+    ) -> AsyncIterator[Dict]:
+        """
+        Generar respuesta en streaming usando Chat Completions API
+        
+        Yields:
+            {"type": "delta", "content": ...} por cada fragmento de texto y un
+            evento final {"type": "done", ...} con usage, latencia y TTFT
+        """
+        start_time = time.perf_counter()
+        
+        plan = self._plan_prompt(message, conversation_history, max_tokens)
+        messages, max_tokens = plan.messages, plan.max_tokens
+        
+        payload = {
+            "model": self.model_name,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "stream": True,
+            "stream_options": {"include_usage": True}
+        }
+        affinity = self._affinity_key(messages, session_id)
+        
+        key = self._request_key(payload)
+        cached = None
+        if key is not None and self.cache is not None:
+            with span("cache") as cache_span:
+                cached = await self.cache.get(key)
+                if cache_span is not None:
+                    cache_span.attributes["cache.hit"] = cached is not None
+        namespace = self._semantic_namespace(messages, temperature)
+        if cached is None:
+            cached = await self._semantic_lookup(message, namespace, max_tokens)
+        if cached is not None:
+            elapsed_time = round(time.perf_counter() - start_time, 6)
+            yield {"type": "delta", "content": cached["response"]}
+            yield {
+                "type": "done",
+                "model": cached["model"],
+                "usage": cached["usage"],
+                "latency_seconds": elapsed_time,
+                "ttft_seconds": elapsed_time,
+                "cached": True
+            }
+            return
+        
+        if key is not None and self.singleflight is not None:
+            if self.singleflight.has_call(key):
+                # Unirse a una llamada idéntica sin streaming que ya está en curso
+                completion = await self.singleflight.wait(key)
+                events = self._completion_events(completion)
+            else:
+                events = self.singleflight.stream(
+                    key, lambda: self._stream_upstream(payload, key, affinity, priority, tenant)
+                )
+        else:
+            events = self._stream_upstream(payload, key, affinity, priority, tenant)
+        
+        ttft = None
+        parts = []
+        async for event in events:
+            if event["type"] == "delta":
+                if ttft is None:
+                    ttft = time.perf_counter() - start_time
+                parts.append(event["content"])
+                yield event
+            else:
+                await self._semantic_store(message, namespace, max_tokens, {
+                    "response": "".join(parts).strip(),
+                    "model": event["model"],
+                    "usage": event["usage"],
+                    "finish_reason": event.get("finish_reason")
+                })
+                elapsed_time = time.perf_counter() - start_time
+                yield {
+                    **event,
+                    "latency_seconds": round(elapsed_time, 2),
+                    "ttft_seconds": round(ttft, 3) if ttft is not None else None,
+                    "cached": False
+                }
+    
+    async def _stream_upstream(
+        self,
+        payload: Dict,
+        key: Optional[str],
+        affinity: Optional[str] = None,
+        priority: Optional[str] = None,
+        tenant: str = "default"
+    ) -> AsyncIterator[Dict]:
+        """Relevar el stream de vLLM como eventos delta/done y guardar el resultado en la caché"""
+        model = self.model_name
+        usage: Dict = {}
+        finish_reason = None
+        parts = []
+        ttft = None
+        # Prefill y decode se registran a mano: el contexto puede cambiar entre
+        # iteraciones del generador
+        trace = get_trace()
+        first_token_ns = None
+        
+        async with self.admission.slot(priority, tenant):
+            start_time = time.perf_counter()
+            start_ns = time.perf_counter_ns()
+            # Solo se reintenta hasta recibir la cabecera de la respuesta;
+            # una vez empieza el stream un fallo ya no se puede repetir
+            response, replica = await self._send(
+                "/v1/chat/completions", payload, stream=True, affinity_key=affinity
+            )
+            failed = False
+            try:
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    
+                    chunk = json_loads(data)
+                    model = chunk.get("model", model)
+                    if chunk.get("usage"):
+                        usage = chunk["usage"]
+                    
+                    for choice in chunk.get("choices", []):
+                        finish_reason = choice.get("finish_reason") or finish_reason
+                        content = choice.get("delta", {}).get("content")
+                        if content:
+                            if ttft is None:
+                                ttft = time.perf_counter() - start_time
+                                first_token_ns = time.perf_counter_ns()
+                                if trace is not None:
+                                    trace.record("prefill", start_ns, first_token_ns)
+                            parts.append(content)
+                            yield {"type": "delta", "content": content}
+            except httpx.HTTPError as e:
+                failed = True
+                self._record_failure(e, replica)
+                raise
+            finally:
+                await response.aclose()
+                self.router.release(replica, time.perf_counter() - start_time, ok=not failed)
+                if trace is not None and first_token_ns is not None:
+                    trace.record(
+                        "decode", first_token_ns, time.perf_counter_ns(),
+                        chunks=len(parts), completion_tokens=usage.get("completion_tokens", 0)
+                    )
+            
+            metrics.record_upstream(time.perf_counter() - start_time, usage, ttft)
+        
+        completion = {
+            "response": "".join(parts).strip(),
+            "model": model,
+            "usage": usage,
+            "finish_reason": finish_reason
+        }
+        if key is not None and self.cache is not None:
+            await self.cache.set(key, completion)
+        
+        yield {"type": "done", "model": model, "usage": usage, "finish_reason": finish_reason}
+    
+    async def _send(
+        self,
+        path: str,
+        payload: Dict,
+        stream: bool = False,
+        affinity_key: Optional[str] = None
+    ) -> Tuple[httpx.Response, Replica]:
+        """
+        POST a una réplica de vLLM a través de su circuit breaker y con
+        reintentos acotados (cada reintento prefiere otra réplica)
+        
+        Con stream=True el cuerpo no se lee y quien llama debe cerrar la
+        respuesta y liberar la réplica con router.release.
+        """
+        failed: List[Replica] = []
+        body = json_dumps(payload)
+        
+        async def attempt() -> Tuple[httpx.Response, Replica]:
+            while True:
+                replica = self.router.acquire(affinity_key, exclude=failed)
+                client = self._client_for(replica)
+                start_time = time.perf_counter()
+                response = None
+                try:
+                    with span("upstream", SPAN_KIND_CLIENT, replica=replica.url, path=path) as upstream_span:
+                        request = client.build_request(
+                            "POST", path, content=body,
+                            headers={"Content-Type": "application/json", **propagation_headers()},
+                            extensions=upstream_trace_extension(upstream_span)
+                        )
+                        response = await client.send(request, stream=stream)
+                        if upstream_span is not None:
+                            upstream_span.attributes["http.status_code"] = response.status_code
+                        if response.is_error:
+                            await response.aread()
+                            response.raise_for_status()
+                except httpx.HTTPError as e:
+                    self.router.release(replica, time.perf_counter() - start_time, ok=False)
+                    self._record_failure(e, replica)
+                    failed.append(replica)
+                    if classify_error(e) == CONNECT_ERROR and len(failed) < len(self.router.replicas):
+                        # La petición no llegó a enviarse: pasar a otra réplica
+                        # al momento, sin gastar presupuesto de reintentos
+                        continue
+                    # Cualquier otro error (p. ej. la conexión se cortó con la
+                    # petición ya enviada y vLLM generando) pasa por RetryPolicy:
+                    # backoff y presupuesto, para no duplicar carga en la GPU
+                    raise
+                except BaseException:
+                    # Cancelada (p. ej. el cliente de /chat/batch se desconectó):
+                    # la réplica se libera igualmente, sin contarlo como error
+                    self.router.release(replica, None)
+                    if stream and response is not None:
+                        await response.aclose()
+                    raise
+                replica.breaker.record_success()
+                if not stream:
+                    self.router.release(replica, time.perf_counter() - start_time)
+                return response, replica
+        
+        return await self.retry_policy.run(attempt)
+    
+    def _record_failure(self, exc: httpx.HTTPError, replica: Replica) -> None:
+        """Registrar un error upstream en métricas y en el circuit breaker de la réplica"""
+        metrics.record_upstream_error(self._error_kind(exc))
+        if classify_error(exc) in BREAKER_FAILURES:
+            replica.breaker.record_failure()
+        else:
+            # vLLM respondió (p. ej. 4xx): está vivo
+            replica.breaker.record_success()
+    
+    @staticmethod
+    def _error_kind(exc: httpx.HTTPError) -> str:
+        """Etiqueta del error upstream para las métricas"""
+        if isinstance(exc, httpx.HTTPStatusError):
+            return str(exc.response.status_code)
+        if isinstance(exc, httpx.TimeoutException):
+            return "timeout"
+        if isinstance(exc, httpx.TransportError):
+            return "connection"
+        return type(exc).__name__
+    
+    @staticmethod
+    async def _completion_events(completion: Dict) -> AsyncIterator[Dict]:
+        """Presentar una respuesta completa como eventos de stream"""
+        yield {"type": "delta", "content": completion["response"]}
+        yield {
+            "type": "done",
+            "model": completion["model"],
+            "usage": completion["usage"],
+            "finish_reason": completion.get("finish_reason")
+        }
+    
+    @staticmethod
+    async def _collect_events(events: AsyncIterator[Dict]) -> Dict:
+        """Agregar eventos de stream en una respuesta completa"""
+        parts = []
+        done: Dict = {}
+        async for event in events:
+            if event["type"] == "delta":
+                parts.append(event["content"])
+            else:
+                done = event
+        
+        return {
+            "response": "".join(parts).strip(),
+            "model": done["model"],
+            "usage": done["usage"],
+            "finish_reason": done.get("finish_reason")
+        }
+    
+    async def _collect_stream(
+        self,
+        message: str,
+        conversation_history: Optional[List[ChatMessage]],
+        max_tokens: int,
+        temperature: float,
+        session_id: Optional[str] = None,
+        priority: Optional[str] = None,
+        tenant: str = "default"
+    ) -> Dict:
+        """Consumir el stream completo y devolverlo con el formato de chat_completion"""
+        parts = []
+        async for event in self.chat_completion_stream(
+            message, conversation_history, max_tokens, temperature, session_id, priority, tenant
+        ):
+            if event["type"] == "delta":
+                parts.append(event["content"])
+            else:
+                done = event
+        
+        return {
+            "response": "".join(parts).strip(),
+            "model": done["model"],
+            "usage": done["usage"],
+            "latency_seconds": done["latency_seconds"],
+            "ttft_seconds": done["ttft_seconds"],
+            "cached": done["cached"]
         }
     
     async def text_completion(
@@ -110,7 +700,9 @@ class VLLMService:
         prompt: str,
         max_tokens: int = 500,
         temperature: float = 0.7,
-        stop: Optional[List[str]] = None
+        stop: Optional[List[str]] = None,
+        priority: Optional[str] = None,
+        tenant: str = "default"
     ) -> Dict:
         """
         Generar respuesta usando Text Completions API (alternativa)
@@ -127,17 +719,13 @@ class VLLMService:
             "stream": False
         }
         
-        start_time = time.time()
+        start_time = time.perf_counter()
         
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            response = await client.post(
-                f"{self.api_url}/v1/completions",
-                json=payload
-            )
-            response.raise_for_status()
-            result = response.json()
+        async with self.admission.slot(priority, tenant):
+            response, _ = await self._send("/v1/completions", payload)
+            result = json_loads(response.content)
         
-        elapsed_time = time.time() - start_time
+        elapsed_time = time.perf_counter() - start_time
         
         return {
             "response": result["choices"][0]["text"].strip(),
@@ -0,0 +1,229 @@
+"""
+Calentamiento del backend y de vLLM antes de recibir tráfico
+
+Al arrancar, las primeras peticiones pagan los caminos fríos: cargar el
+tokenizer, abrir conexiones, la primera compilación/captura de grafos de
+vLLM y llenar su prefix cache con SYSTEM_PROMPT. El calentamiento hace ese
+trabajo en segundo plano, con el servidor ya escuchando: primero carga los
+componentes lentos del backend y después (WARMUP_ENABLED) lanza peticiones
+sintéticas (el system prompt más mensajes de longitudes típicas) con
+concurrencia acotada. Hasta que termina /health responde 503 para que el
+balanceador no mande usuarios a este worker.
+
+Las peticiones van directamente a cada réplica, sin caché, admisión ni
+métricas del servidor, para no mezclar tráfico sintético con el real.
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional
+
+from config import settings
+from fast_json import dumps as json_dumps
+from services.metrics import LATENCY_BUCKETS, Histogram
+from services.upstream_router import Replica
+from services.vllm_service import VLLMService, vllm_service
+
+logger = logging.getLogger(__name__)
+
+# Estados del calentamiento
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+TIMED_OUT = "timed_out"
+
+# Vocabulario de los mensajes sintéticos
+_WORDS = (
+    "aprendizaje personalizado evaluación formativa inteligencia artificial "
+    "docente estudiante contenidos datos curso retroalimentación tutor "
+    "competencias actividades ejemplos objetivos progreso"
+).split()
+
+
+def synthetic_message(words: int) -> str:
+    """Pregunta de unas `words` palabras (determinista)"""
+    return " ".join(_WORDS[i % len(_WORDS)] for i in range(max(1, words))) + "?"
+
+
+class Warmup:
+    """
+    Fase de calentamiento del backend y de las réplicas de vLLM
+
+    Carga el tokenizer y la caché semántica (VLLMService.load). Con `enabled`,
+    además espera a que el monitor de salud vea vLLM disponible, abre
+    `connections` conexiones por réplica y lanza `requests` peticiones por
+    réplica recorriendo `prompt_lengths` (palabras), con `concurrency` en
+    vuelo a la vez. Si no
+    termina en `timeout` segundos se da por listo igualmente, para que un
+    vLLM lento no deje el backend fuera de servicio indefinidamente.
+    """
+
+    def __init__(
+        self,
+        service: VLLMService,
+        enabled: bool = True,
+        requests: int = 8,
+        concurrency: int = 4,
+        connections: int = 8,
+        prompt_lengths: Optional[List[int]] = None,
+        max_tokens: int = 16,
+        timeout: float = 300.0
+    ):
+        self.service = service
+        self.enabled = enabled
+        self.requests = requests
+        self.concurrency = concurrency
+        self.connections = connections
+        self.prompt_lengths = prompt_lengths or [16]
+        self.max_tokens = max_tokens
+        self.timeout = timeout
+
+        self.state = PENDING
+        self.load_seconds: Optional[float] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.sent = 0
+        self.failed = 0
+        self.opened_connections = 0
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.first_latency: Optional[float] = None
+        self.last_latency: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        """El worker puede recibir tráfico (calentamiento terminado)"""
+        return self.state not in (PENDING, RUNNING)
+
+    def start(self) -> None:
+        """Lanzar el calentamiento en segundo plano (llamado desde lifespan)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run(self) -> None:
+        self.state = RUNNING
+        self.started_at = time.perf_counter()
+        if self.enabled:
+            logger.info("🔥 Calentando vLLM antes de aceptar tráfico...")
+        try:
+            await asyncio.wait_for(self._warm(), timeout=self.timeout)
+            self.state = DONE if not self.enabled or self.sent > self.failed else FAILED
+        except asyncio.TimeoutError:
+            self.state = TIMED_OUT
+        except Exception as e:
+            logger.error(f"❌ Error en el calentamiento: {e}")
+            self.state = FAILED
+        self.finished_at = time.perf_counter()
+
+        summary = self.stats()
+        if self.state == DONE:
+            logger.info(
+                f"✅ Calentamiento completo en {summary['seconds']:.1f} s: {self.sent} peticiones, "
+                f"{self.opened_connections} conexiones; latencia primera {summary['first_latency_seconds']} s, "
+                f"última {summary['last_latency_seconds']} s"
+            )
+        else:
+            logger.warning(
+                f"⚠️  Calentamiento sin completar ({self.state}) tras {summary['seconds']:.1f} s; "
+                f"se aceptará tráfico igualmente"
+            )
+
+    async def _warm(self) -> None:
+        load_start = time.perf_counter()
+        await self.service.load()
+        self.load_seconds = time.perf_counter() - load_start
+        if not self.enabled:
+            return
+
+        # Esperar a que vLLM responda (puede estar cargando el modelo). Se usa
+        # el resultado del monitor de salud, que ya sondea cada réplica en
+        # segundo plano, en lugar de sondear otra vez desde aquí
+        await self.service.health_monitor.wait_healthy()
+
+        replicas = [replica for replica in self.service.router.replicas if replica.healthy is not False]
+        await asyncio.gather(*(self._open_connections(replica) for replica in replicas))
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(*(
+            self._request(replica, self.prompt_lengths[i % len(self.prompt_lengths)], semaphore)
+            for i in range(self.requests)
+            for replica in replicas
+        ))
+
+    async def _open_connections(self, replica: Replica) -> None:
+        """Abrir conexiones del pool con peticiones concurrentes a /health"""
+        client = self.service._client_for(replica)
+        results = await asyncio.gather(
+            *(client.get("/health", timeout=settings.HEALTH_CHECK_TIMEOUT) for _ in range(self.connections)),
+            return_exceptions=True
+        )
+        self.opened_connections += sum(1 for result in results if not isinstance(result, BaseException))
+
+    async def _request(self, replica: Replica, words: int, semaphore: asyncio.Semaphore) -> None:
+        # Mismo system prompt y misma construcción que el tráfico real, para
+        # que vLLM guarde ese prefijo en su prefix cache
+        payload = {
+            "model": self.service.model_name,
+            "messages": self.service._build_messages(synthetic_message(words), None, self.max_tokens),
+            "max_tokens": self.max_tokens,
+            "temperature": 0.0,
+            "stream": False
+        }
+        async with semaphore:
+            start = time.perf_counter()
+            self.sent += 1
+            try:
+                response = await self.service._client_for(replica).post(
+                    "/v1/chat/completions",
+                    content=json_dumps(payload),
+                    headers={"Content-Type": "application/json", "X-Request-ID": "warmup"}
+                )
+                response.raise_for_status()
+            except Exception as e:
+                self.failed += 1
+                logger.debug(f"Petición de calentamiento fallida en {replica.url}: {e}")
+                return
+            elapsed = time.perf_counter() - start
+        self.latency.observe(elapsed)
+        if self.first_latency is None:
+            self.first_latency = elapsed
+        self.last_latency = elapsed
+
+    def stats(self) -> Dict:
+        end = self.finished_at or time.perf_counter()
+        return {
+            "state": self.state,
+            "ready": self.ready,
+            "vllm_warmup": self.enabled,
+            "seconds": round(end - self.started_at, 3) if self.started_at is not None else None,
+            "load_seconds": round(self.load_seconds, 3) if self.load_seconds is not None else None,
+            "requests": self.sent,
+            "failed": self.failed,
+            "connections": self.opened_connections,
+            "first_latency_seconds": round(self.first_latency, 4) if self.first_latency is not None else None,
+            "last_latency_seconds": round(self.last_latency, 4) if self.last_latency is not None else None,
+            "latency_seconds": self.latency.summary(),
+        }
+
+
+# Instancia global del calentamiento
+warmup = Warmup(
+    vllm_service,
+    enabled=settings.WARMUP_ENABLED,
+    requests=settings.WARMUP_REQUESTS,
+    concurrency=settings.WARMUP_CONCURRENCY,
+    connections=min(settings.WARMUP_CONNECTIONS, settings.VLLM_POOL_MAX_KEEPALIVE),
+    prompt_lengths=settings.WARMUP_PROMPT_LENGTHS,
+    max_tokens=settings.WARMUP_MAX_TOKENS,
+    timeout=settings.WARMUP_TIMEOUT
+)
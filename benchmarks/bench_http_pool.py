@@ -0,0 +1,107 @@
+"""
+Benchmark: cliente httpx por llamada vs. cliente compartido con pool
+
+Mide el overhead por petición de VLLMService.chat_completion contra el
+servidor vLLM falso local (sin GPU).
+
+Uso:
+    python benchmarks/bench_http_pool.py --requests 500 --concurrency 1
+    python benchmarks/bench_http_pool.py --requests 2000 --concurrency 32
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import httpx  # noqa: E402
+
+from fake_vllm import FakeVLLMServer, create_app  # noqa: E402
+from config import settings  # noqa: E402
+from services.vllm_service import VLLMService  # noqa: E402
+
+
+class PerCallClientService(VLLMService):
+    """Comportamiento anterior: un AsyncClient nuevo en cada llamada"""
+
+    async def chat_completion(self, message, conversation_history=None,
+                              max_tokens=500, temperature=0.7, stream=False):
+        payload = {
+            "model": self.model_name,
+            "messages": self._build_messages(message, conversation_history, max_tokens),
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "stream": stream
+        }
+        async with httpx.AsyncClient(timeout=self.timeout) as client:
+            response = await client.post(f"{self.api_url}/v1/chat/completions", json=payload)
+            response.raise_for_status()
+            return response.json()
+
+
+async def run(service: VLLMService, total: int, concurrency: int) -> list:
+    """Lanzar `total` peticiones con `concurrency` en vuelo y devolver latencias"""
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await service.chat_completion("¿Qué es la IA?", max_tokens=8, temperature=0.0)
+            latencies.append(time.perf_counter() - start)
+
+    # Calentamiento
+    for _ in range(min(20, total)):
+        await one()
+    latencies.clear()
+
+    await asyncio.gather(*(one() for _ in range(total)))
+    return latencies
+
+
+def report(name: str, latencies: list, wall: float) -> None:
+    latencies.sort()
+    p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+    print(f"{name:<12} mean={statistics.mean(latencies) * 1000:7.3f}ms "
+          f"p50={p(0.50):7.3f}ms p99={p(0.99):7.3f}ms "
+          f"throughput={len(latencies) / wall:8.1f} req/s")
+
+
+async def main_async(args) -> None:
+    per_call = PerCallClientService(api_urls=[args.url])
+    pooled = VLLMService(api_urls=[args.url])
+    # Medir el transporte, no la caché de respuestas ni la coalescencia
+    pooled.cache = None
+    pooled.singleflight = None
+
+    await pooled.start()
+    try:
+        for name, service in (("per-call", per_call), ("pooled", pooled)):
+            start = time.perf_counter()
+            latencies = await run(service, args.requests, args.concurrency)
+            report(name, latencies, time.perf_counter() - start)
+    finally:
+        await pooled.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    print(f"Pool: max_connections={settings.VLLM_POOL_MAX_CONNECTIONS} "
+          f"keepalive={settings.VLLM_POOL_MAX_KEEPALIVE} http2={settings.VLLM_HTTP2}")
+    with FakeVLLMServer(create_app(), port=args.port) as server:
+        args.url = server.url
+        asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Benchmark: CPU por petición de la serialización JSON en el camino de /chat
+
+Compara json de la biblioteca estándar con fast_json (orjson) en tres puntos:
+  1. Parseo del cuerpo de respuesta de vLLM
+  2. Construcción de la respuesta: ChatResponse validado + JSONResponse
+     frente a dict + FastJSONResponse
+  3. /chat completo en proceso (ASGITransport) con la respuesta en caché, de
+     modo que solo se mide el trabajo del backend
+
+Uso:
+    python benchmarks/bench_serialization.py --iterations 20000
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+import httpx  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+import fast_json  # noqa: E402
+from models import ChatResponse  # noqa: E402
+
+UPSTREAM_BODY = json.dumps({
+    "id": "chatcmpl-0123456789abcdef",
+    "object": "chat.completion",
+    "created": 1760000000,
+    "model": "/models",
+    "choices": [{
+        "index": 0,
+        "message": {"role": "assistant", "content": "El aprendizaje personalizado adapta los contenidos. " * 12},
+        "logprobs": None,
+        "finish_reason": "stop",
+        "stop_reason": None
+    }],
+    "usage": {"prompt_tokens": 412, "completion_tokens": 96, "total_tokens": 508},
+    "prompt_logprobs": None
+}).encode("utf-8")
+
+
+def per_call_us(fn, iterations: int) -> float:
+    """Microsegundos de CPU por llamada"""
+    for _ in range(min(1000, iterations)):
+        fn()
+    start = time.process_time()
+    for _ in range(iterations):
+        fn()
+    return (time.process_time() - start) / iterations * 1e6
+
+
+def report(name: str, baseline: float, fast: float) -> None:
+    print(f"{name:<28} json={baseline:8.2f} µs  {fast_json.BACKEND}={fast:8.2f} µs  ×{baseline / fast:.2f}")
+
+
+def bench_parse(iterations: int) -> None:
+    report(
+        "1) parseo de vLLM",
+        per_call_us(lambda: json.loads(UPSTREAM_BODY), iterations),
+        per_call_us(lambda: fast_json.loads(UPSTREAM_BODY), iterations)
+    )
+
+
+def bench_response(iterations: int) -> None:
+    upstream = json.loads(UPSTREAM_BODY)
+    fields = {
+        "response": upstream["choices"][0]["message"]["content"],
+        "model": upstream["model"],
+        "tokens_used": upstream["usage"]["total_tokens"],
+        "prompt_tokens": upstream["usage"]["prompt_tokens"],
+        "completion_tokens": upstream["usage"]["completion_tokens"],
+        "latency_seconds": 0.42,
+        "ttft_seconds": None,
+        "cached": False,
+        "session_id": "3f2b8c0e9d1a4b7c8e6f5a4b3c2d1e0f"
+    }
+
+    def validated():
+        response = ChatResponse(**fields)
+        return JSONResponse(response.model_dump(mode="json")).body
+
+    def plain():
+        return fast_json.FastJSONResponse({**fields, "timestamp": datetime.now()}).body
+
+    report("2) construir respuesta", per_call_us(validated, iterations), per_call_us(plain, iterations))
+
+
+async def bench_endpoint(requests: int) -> None:
+    from app import app
+    from services.vllm_service import vllm_service
+
+    logging.disable(logging.INFO)
+
+    # Rellenar la caché para que /chat no salga del proceso
+    body = {"message": "¿Qué es el aprendizaje personalizado?", "max_tokens": 64, "temperature": 0.0}
+    payload = {
+        "model": vllm_service.model_name,
+        "messages": vllm_service._build_messages(body["message"], None, body["max_tokens"]),
+        "max_tokens": body["max_tokens"],
+        "temperature": body["temperature"],
+        "stream": False
+    }
+    await vllm_service.cache.set(vllm_service._request_key(payload), {
+        "response": "respuesta en caché", "model": "/models",
+        "usage": {"prompt_tokens": 10, "completion_tokens": 3, "total_tokens": 13},
+        "latency_seconds": 0.0
+    })
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for _ in range(100):
+            response = await client.post("/chat", json=body)
+            response.raise_for_status()
+        assert response.json().get("cached"), "la petición no salió de la caché"
+        start = time.process_time()
+        for _ in range(requests):
+            await client.post("/chat", json=body)
+        elapsed = time.process_time() - start
+    print(f"3) /chat en caché ({fast_json.BACKEND})  {elapsed / requests * 1e6:8.1f} µs de CPU por petición")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--requests", type=int, default=2000, help="Peticiones del paso 3")
+    args = parser.parse_args()
+
+    print(f"Backend JSON: {fast_json.BACKEND}")
+    bench_parse(args.iterations)
+    bench_response(args.iterations)
+    asyncio.run(bench_endpoint(args.requests))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""
+Benchmark: arranque en frío del backend
+
+Mide en procesos nuevos:
+  1. Importación de `app` con `python -X importtime`: tiempo total y los
+     módulos más caros (propios y de terceros)
+  2. Arranque de uvicorn contra el servidor vLLM falso: tiempo hasta que el
+     puerto responde (GET /), hasta que /health está listo (tras el
+     calentamiento) y hasta la primera respuesta de /chat
+
+Cada medida es la mediana de --runs ejecuciones. Con --compare falla
+(código 1) si alguna empeora más de --threshold respecto a una ejecución
+guardada con --output, de modo que el arranque es un número vigilado.
+
+Uso:
+    python benchmarks/bench_startup.py --runs 5 --output startup.json
+    python benchmarks/bench_startup.py --compare startup.json --threshold 0.2
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+BACKEND_DIR = os.path.join(ROOT, "backend")
+
+# Módulos del propio backend (el resto son de terceros)
+FIRST_PARTY = {
+    os.path.splitext(name)[0]
+    for name in os.listdir(BACKEND_DIR)
+    if name.endswith(".py") or os.path.isdir(os.path.join(BACKEND_DIR, name, ""))
+}
+
+
+def backend_env(vllm_url: str) -> Dict[str, str]:
+    return {
+        **os.environ,
+        "VLLM_API_URL": vllm_url,
+        "RATE_LIMIT_ENABLED": "false",
+        "DEBUG": "false",
+    }
+
+
+def parse_importtime(stderr: str) -> Dict[str, Dict[str, int]]:
+    """Líneas 'import time: self | cumulative | módulo' → µs por módulo"""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = {
+            "self_us": int(self_us),
+            "cumulative_us": int(cumulative_us),
+            "depth": (len(name) - len(name.lstrip())) // 2,
+        }
+    return modules
+
+
+def profile_imports(runs: int, env: Dict[str, str], top: int) -> Dict:
+    """Importar `app` en `runs` procesos nuevos"""
+    samples: Dict[str, List[Dict]] = defaultdict(list)
+    totals = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import app"],
+            cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+        )
+        modules = parse_importtime(result.stderr)
+        totals.append(modules["app"]["cumulative_us"])
+        for name, timing in modules.items():
+            samples[name].append(timing)
+
+    median = {
+        name: {
+            "self_ms": round(statistics.median(t["self_us"] for t in timings) / 1000, 2),
+            "cumulative_ms": round(statistics.median(t["cumulative_us"] for t in timings) / 1000, 2),
+            "depth": timings[0]["depth"],
+        }
+        for name, timings in samples.items()
+    }
+    first_party = {
+        name: timing for name, timing in median.items()
+        if name.split(".")[0] in FIRST_PARTY
+    }
+    # Paquetes de terceros importados directamente por el backend
+    third_party = {
+        name: timing for name, timing in median.items()
+        if "." not in name and name not in FIRST_PARTY and name not in sys.stdlib_module_names
+    }
+
+    def ranked(modules: Dict) -> List[Dict]:
+        order = sorted(modules.items(), key=lambda item: item[1]["cumulative_ms"], reverse=True)
+        return [{"module": name, **timing} for name, timing in order[:top]]
+
+    return {
+        "import_seconds": round(statistics.median(totals) / 1e6, 4),
+        "first_party": ranked(first_party),
+        "third_party": ranked(third_party),
+        "slowest_self": [
+            {"module": name, **timing}
+            for name, timing in sorted(median.items(), key=lambda item: item[1]["self_ms"], reverse=True)[:top]
+        ],
+    }
+
+
+def wait_until(check, timeout: float) -> float:
+    """Segundos hasta que `check()` devuelve True"""
+    start = time.perf_counter()
+    deadline = start + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if check():
+                return time.perf_counter() - start
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.005)
+    raise RuntimeError(f"sin respuesta en {timeout}s")
+
+
+def measure_startup(runs: int, port: int, env: Dict[str, str], timeout: float) -> Dict:
+    """Arrancar uvicorn `runs` veces y medir hasta escuchar, estar listo y responder /chat"""
+    url = f"http://127.0.0.1:{port}"
+    listen, ready, first_chat = [], [], []
+    with httpx.Client(base_url=url, timeout=timeout) as client:
+        for _ in range(runs):
+            start = time.perf_counter()
+            proc = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port),
+                 "--log-level", "warning", "--no-access-log"],
+                cwd=BACKEND_DIR, env=env
+            )
+            try:
+                wait_until(lambda: client.get("/").status_code == 200, timeout)
+                listen.append(time.perf_counter() - start)
+                wait_until(lambda: client.get("/health").status_code == 200, timeout)
+                ready.append(time.perf_counter() - start)
+                response = client.post("/chat", json={"message": "¿Qué es el aprendizaje personalizado?", "max_tokens": 16})
+                response.raise_for_status()
+                first_chat.append(time.perf_counter() - start)
+            finally:
+                proc.terminate()
+                proc.wait(timeout=10)
+
+    return {
+        "listen_seconds": round(statistics.median(listen), 4),
+        "ready_seconds": round(statistics.median(ready), 4),
+        "first_chat_seconds": round(statistics.median(first_chat), 4),
+        "runs": {"listen": listen, "ready": ready, "first_chat": first_chat},
+    }
+
+
+def compare(result: Dict, baseline: Dict, threshold: float, min_delta: float) -> bool:
+    """
+    Comparar con una ejecución anterior; False si alguna métrica empeora más
+    de `threshold` (y más de `min_delta` segundos, para no saltar por ruido)
+    """
+    ok = True
+    print("\nComparación con la línea base:")
+    for name in ("import_seconds", "listen_seconds", "ready_seconds", "first_chat_seconds"):
+        current, previous = result.get(name), baseline.get(name)
+        if not current or not previous:
+            continue
+        change = (current - previous) / previous
+        worse = change > threshold and current - previous > min_delta
+        ok &= not worse
+        print(f"  {'❌' if worse else '✅'} {name:<20} {previous:>8} → {current:<8} ({change:+.1%})")
+    return ok
+
+
+def report(result: Dict) -> None:
+    print(f"Importar app: {result['import_seconds'] * 1000:.0f} ms")
+    for title, key in (("Módulos propios", "first_party"), ("Terceros", "third_party"), ("Más lentos (self)", "slowest_self")):
+        print(f"  {title}:")
+        for timing in result[key]:
+            print(f"    {timing['module']:<32} {timing['cumulative_ms']:>8.1f} ms acumulado  {timing['self_ms']:>7.1f} ms propio")
+    if "listen_seconds" in result:
+        print(
+            f"Arranque: escucha {result['listen_seconds'] * 1000:.0f} ms, "
+            f"/health listo {result['ready_seconds'] * 1000:.0f} ms, "
+            f"primer /chat {result['first_chat_seconds'] * 1000:.0f} ms"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="Módulos que se listan en cada tabla")
+    parser.add_argument("--port", type=int, default=8810, help="Puerto del backend (vLLM falso en +1)")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--imports-only", action="store_true", help="No arrancar el servidor")
+    parser.add_argument("--output", default=None, help="Guardar resultados en JSON")
+    parser.add_argument("--compare", default=None, help="JSON de una ejecución anterior")
+    parser.add_argument("--threshold", type=float, default=0.20, help="Empeoramiento tolerado al comparar")
+    parser.add_argument("--min-delta", type=float, default=0.02, help="Segundos de empeoramiento que se ignoran")
+    args = parser.parse_args()
+
+    fake_port = args.port + 1
+    env = backend_env(f"http://127.0.0.1:{fake_port}")
+    result = profile_imports(args.runs, env, args.top)
+
+    if not args.imports_only:
+        fake = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, "fake_vllm.py"), "--port", str(fake_port)])
+        try:
+            wait_until(lambda: httpx.get(f"http://127.0.0.1:{fake_port}/health").status_code == 200, args.timeout)
+            result.update(measure_startup(args.runs, args.port, env, args.timeout))
+        finally:
+            fake.terminate()
+            fake.wait(timeout=10)
+
+    report(result)
+    document = {
+        "timestamp": datetime.now().isoformat(),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        **result,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(document, f, indent=2, ensure_ascii=False)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if not compare(result, baseline, args.threshold, args.min_delta):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+"""
+Servidor falso compatible con la API OpenAI de vLLM para pruebas sin GPU
+
+Implementa /health, /v1/models, /v1/chat/completions y /v1/completions (con y
+sin streaming) con un modelo de latencia configurable:
+
+    TTFT    = espera en cola + ttft + prefill_latency × tokens del prompt
+    total   = TTFT + token_latency × tokens generados
+
+Un "token" es una palabra. El texto generado es determinista: depende solo de
+`seed` y del prompt, y tiene min(max_tokens, output_tokens) tokens. Además se
+puede limitar la concurrencia (como --max-num-seqs de vLLM) con una cola
+acotada e inyectar fallos (códigos HTTP o cortes a mitad de stream) con una
+secuencia aleatoria reproducible.
+
+Uso:
+    python benchmarks/fake_vllm.py --port 8080 --ttft 0.05 --token-latency 0.01
+    python benchmarks/fake_vllm.py --max-concurrency 16 --max-queue 64 --failure-rate 0.05
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+MODEL_NAME = "/models"
+
+VOCABULARY = (
+    "el aprendizaje personalizado adapta los contenidos al ritmo de cada "
+    "estudiante y la inteligencia artificial ayuda a evaluar su progreso con "
+    "datos para que el docente pueda intervenir a tiempo"
+).split()
+
+
+class FakeVLLM:
+    """Estado y comportamiento del servidor falso (modificable en caliente desde tests)"""
+
+    def __init__(
+        self,
+        ttft: float = 0.0,
+        token_latency: float = 0.0,
+        prefill_latency: float = 0.0,
+        output_tokens: int = 16,
+        max_concurrency: Optional[int] = None,
+        max_queue: Optional[int] = None,
+        failure_rate: float = 0.0,
+        failure_status: int = 503,
+        stream_failure_rate: float = 0.0,
+        seed: int = 0
+    ):
+        self.ttft = ttft
+        self.token_latency = token_latency
+        self.prefill_latency = prefill_latency
+        self.output_tokens = output_tokens
+        self.max_queue = max_queue
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.stream_failure_rate = stream_failure_rate
+        self.seed = seed
+        self.healthy = True
+
+        self._rng = random.Random(seed)
+        self._slots = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+        self.active = 0
+        self.queued = 0
+        self.counters: Counter = Counter()
+        # Primer mensaje tras el system prompt: identifica la conversación
+        self.conversations: Counter = Counter()
+
+    def generate(self, prompt: str, max_tokens: int) -> List[str]:
+        """Tokens de la respuesta (deterministas para un mismo prompt)"""
+        digest = hashlib.sha256(f"{self.seed}:{prompt}".encode("utf-8")).digest()
+        rng = random.Random(digest)
+        n = max(1, min(max_tokens, self.output_tokens))
+        words = [rng.choice(VOCABULARY) for _ in range(n)]
+        return [w if i == 0 else " " + w for i, w in enumerate(words)]
+
+    def _inject_failure(self) -> Optional[JSONResponse]:
+        if self.failure_rate and self._rng.random() < self.failure_rate:
+            self.counters["injected_failures"] += 1
+            return JSONResponse({"error": "fallo inyectado"}, status_code=self.failure_status)
+        return None
+
+    def _queue_full(self) -> bool:
+        if (
+            self._slots is not None and self._slots.locked()
+            and self.max_queue is not None and self.queued >= self.max_queue
+        ):
+            self.counters["rejected"] += 1
+            return True
+        return False
+
+    async def _acquire(self) -> None:
+        """Ocupar un hueco de concurrencia esperando en cola"""
+        if self._slots is None:
+            return
+        self.queued += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+
+    def _release(self) -> None:
+        if self._slots is not None:
+            self._slots.release()
+
+    async def handle(self, request: Request, chat: bool):
+        payload = await request.json()
+        model = payload.get("model", MODEL_NAME)
+        self.counters["requests"] += 1
+
+        if chat:
+            messages = payload.get("messages", [])
+            if len(messages) > 1:
+                self.conversations[messages[1]["content"]] += 1
+            prompt = "\n".join(m.get("content", "") for m in messages)
+        else:
+            prompt = payload.get("prompt", "")
+        prompt_tokens = len(prompt.split())
+        tokens = self.generate(prompt, payload.get("max_tokens", 16))
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens)
+        }
+
+        failure = self._inject_failure()
+        if failure is not None:
+            return failure
+        if self._queue_full():
+            return JSONResponse({"error": "cola llena"}, status_code=503)
+
+        prefill = self.ttft + self.prefill_latency * prompt_tokens
+        if payload.get("stream"):
+            include_usage = payload.get("stream_options", {}).get("include_usage", False)
+            return StreamingResponse(
+                self._stream(model, chat, tokens, usage if include_usage else None, prefill),
+                media_type="text/event-stream"
+            )
+
+        await self._acquire()
+        self.active += 1
+        try:
+            await asyncio.sleep(prefill + self.token_latency * len(tokens))
+        finally:
+            self.active -= 1
+            self._release()
+
+        text = "".join(tokens)
+        choice = (
+            {"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "length"}
+            if chat else
+            {"index": 0, "text": text, "finish_reason": "length"}
+        )
+        return JSONResponse({
+            "id": "cmpl-fake",
+            "object": "chat.completion" if chat else "text_completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [choice],
+            "usage": usage
+        })
+
+    async def _stream(self, model: str, chat: bool, tokens: List[str], usage: Optional[Dict], prefill: float):
+        def chunk(content: Optional[str], finish_reason=None, role: bool = False) -> str:
+            if chat:
+                delta = {"role": "assistant"} if role else ({"content": content} if content else {})
+                choice = {"index": 0, "delta": delta, "finish_reason": finish_reason}
+            else:
+                choice = {"index": 0, "text": content or "", "finish_reason": finish_reason}
+            body = {
+                "id": "cmpl-fake",
+                "object": "chat.completion.chunk" if chat else "text_completion",
+                "model": model,
+                "choices": [choice]
+            }
+            return f"data: {json.dumps(body)}\n\n"
+
+        # Cortar el stream a mitad (la conexión se cierra sin [DONE])
+        cut_at = None
+        if self.stream_failure_rate and self._rng.random() < self.stream_failure_rate:
+            cut_at = len(tokens) // 2
+            self.counters["injected_stream_failures"] += 1
+
+        # Como vLLM, las cabeceras salen enseguida y la espera en cola se nota en el TTFT
+        if chat:
+            yield chunk(None, role=True)
+        await self._acquire()
+        self.active += 1
+        try:
+            await asyncio.sleep(prefill)
+            for i, token in enumerate(tokens):
+                if i == cut_at:
+                    raise ConnectionResetError("fallo inyectado a mitad de stream")
+                if i and self.token_latency:
+                    await asyncio.sleep(self.token_latency)
+                yield chunk(token)
+            yield chunk(None, finish_reason="length")
+            if usage is not None:
+                yield f"data: {json.dumps({'id': 'cmpl-fake', 'model': model, 'choices': [], 'usage': usage})}\n\n"
+            yield "data: [DONE]\n\n"
+        finally:
+            self.active -= 1
+            self._release()
+
+    def stats(self) -> Dict:
+        return {"active": self.active, "queued": self.queued, **self.counters}
+
+
+def create_app(delay: float = 0.0, **options) -> Starlette:
+    """
+    Crear la app falsa
+
+    `delay` se mantiene por compatibilidad: es el TTFT si no se indica `ttft`.
+    El resto de opciones son las de FakeVLLM; el estado queda en
+    `app.state.fake` (y `app.state.conversations`).
+    """
+    options.setdefault("ttft", delay)
+    fake = FakeVLLM(**options)
+
+    async def health(request: Request):
+        return JSONResponse({}, status_code=200 if fake.healthy else 503)
+
+    async def models(request: Request):
+        return JSONResponse({
+            "object": "list",
+            "data": [{"id": MODEL_NAME, "object": "model", "owned_by": "vllm"}]
+        })
+
+    async def chat_completions(request: Request):
+        return await fake.handle(request, chat=True)
+
+    async def completions(request: Request):
+        return await fake.handle(request, chat=False)
+
+    async def stats(request: Request):
+        return JSONResponse(fake.stats())
+
+    app = Starlette(routes=[
+        Route("/health", health),
+        Route("/v1/models", models),
+        Route("/v1/chat/completions", chat_completions, methods=["POST"]),
+        Route("/v1/completions", completions, methods=["POST"]),
+        Route("/fake/stats", stats),
+    ])
+    app.state.fake = fake
+    app.state.conversations = fake.conversations
+    return app
+
+
+class FakeVLLMServer:
+    """Ejecutar el servidor falso en un hilo (para benchmarks en proceso)"""
+
+    def __init__(self, app: Starlette, host: str = "127.0.0.1", port: int = 8765):
+        import uvicorn
+
+        self.host = host
+        self.port = port
+        self.url = f"http://{host}:{port}"
+        config = uvicorn.Config(app, host=host, port=port, log_level="warning", access_log=False)
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self._server.should_exit = True
+        self._thread.join(timeout=5)
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--delay", type=float, default=0.0, help="Alias de --ttft (compatibilidad)")
+    parser.add_argument("--ttft", type=float, default=None, help="Segundos hasta el primer token")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Segundos por token generado")
+    parser.add_argument("--prefill-latency", type=float, default=0.0, help="Segundos por token del prompt")
+    parser.add_argument("--output-tokens", type=int, default=16, help="Tokens generados (tope: max_tokens)")
+    parser.add_argument("--max-concurrency", type=int, default=None, help="Peticiones procesándose a la vez")
+    parser.add_argument("--max-queue", type=int, default=None, help="Peticiones esperando; más → 503")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Probabilidad de responder con error")
+    parser.add_argument("--failure-status", type=int, default=503)
+    parser.add_argument("--stream-failure-rate", type=float, default=0.0, help="Probabilidad de cortar un stream")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    app = create_app(
+        delay=args.delay,
+        ttft=args.ttft if args.ttft is not None else args.delay,
+        token_latency=args.token_latency,
+        prefill_latency=args.prefill_latency,
+        output_tokens=args.output_tokens,
+        max_concurrency=args.max_concurrency,
+        max_queue=args.max_queue,
+        failure_rate=args.failure_rate,
+        failure_status=args.failure_status,
+        stream_failure_rate=args.stream_failure_rate,
+        seed=args.seed
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
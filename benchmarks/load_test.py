@@ -0,0 +1,355 @@
+"""
+Prueba de carga del backend: latencia, TTFT, throughput y errores
+
+Por defecto levanta el servidor vLLM falso y el backend como subprocesos (sin
+GPU) y les lanza carga; con --url se mide un backend ya desplegado.
+
+Modos de carga:
+  - Bucle cerrado (--concurrency N): N clientes, cada uno lanza la siguiente
+    petición al terminar la anterior.
+  - Bucle abierto (--rate R): llegadas de Poisson a R peticiones/s, sin
+    esperar a las respuestas (hasta --max-in-flight en vuelo), que es como
+    llega el tráfico real y lo que destapa las colas.
+
+Las longitudes de prompt (en palabras) y de salida (max_tokens) se sacan de
+distribuciones: "200" (fija), "uniform:10:400", "normal:150:50" o
+"lognormal:150:0.6" (mediana y sigma). Con --stream se usa /chat/stream y se
+mide el TTFT.
+
+Uso:
+    python benchmarks/load_test.py --concurrency 16 --requests 500
+    python benchmarks/load_test.py --rate 20 --duration 30 --stream --fake-delay 0.2 \
+        --fake-args "--token-latency 0.01 --max-concurrency 32"
+    python benchmarks/load_test.py --concurrency 8 --output run.json --compare baseline.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import shlex
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+WORDS = (
+    "la inteligencia artificial aplicada a la educación permite personalizar el "
+    "aprendizaje evaluar el progreso de cada estudiante y adaptar los contenidos"
+).split()
+
+
+def parse_distribution(spec: str) -> Callable[[random.Random], int]:
+    """Convertir "uniform:a:b", "normal:m:s", "lognormal:m:s" o "n" en un muestreador"""
+    kind, *params = spec.split(":")
+    if not params:
+        value = int(kind)
+        return lambda rng: value
+    a, b = (float(p) for p in params)
+    if kind == "uniform":
+        return lambda rng: int(rng.uniform(a, b))
+    if kind == "normal":
+        return lambda rng: max(1, int(rng.gauss(a, b)))
+    if kind == "lognormal":
+        return lambda rng: max(1, int(rng.lognormvariate(math.log(a), b)))
+    raise ValueError(f"Distribución desconocida: {spec}")
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+    return round(ordered[index], 4)
+
+
+def latency_summary(values: List[float]) -> Dict:
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 4) if values else None,
+        "p50": percentile(values, 0.50),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": round(max(values), 4) if values else None,
+    }
+
+
+class LoadTest:
+    """Genera la carga y acumula las medidas de cada petición"""
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.prompt_words = parse_distribution(args.prompt_words)
+        self.output_tokens = parse_distribution(args.max_tokens)
+        self.latencies: List[float] = []
+        self.ttfts: List[float] = []
+        self.completion_tokens = 0
+        self.statuses: Counter = Counter()
+        self.recording = False
+        self._counter = 0
+
+    def _payload(self) -> Dict:
+        self._counter += 1
+        words = [self.rng.choice(WORDS) for _ in range(self.prompt_words(self.rng))]
+        return {
+            # El número evita aciertos de caché entre peticiones
+            "message": f"{self._counter}: {' '.join(words)}"[:2000],
+            "max_tokens": min(2000, self.output_tokens(self.rng)),
+            "temperature": self.args.temperature,
+        }
+
+    async def one(self, client: httpx.AsyncClient) -> None:
+        payload = self._payload()
+        start = time.perf_counter()
+        ttft = None
+        tokens = 0
+        try:
+            if self.args.stream:
+                async with client.stream("POST", "/chat/stream", json=payload) as response:
+                    status = str(response.status_code)
+                    event = None
+                    async for line in response.aiter_lines():
+                        if line.startswith("event:"):
+                            event = line[6:].strip()
+                        elif line.startswith("data:"):
+                            if event == "delta" and ttft is None:
+                                ttft = time.perf_counter() - start
+                            elif event == "done":
+                                tokens = json.loads(line[5:])["completion_tokens"]
+                            elif event == "error":
+                                status = "stream_error"
+            else:
+                response = await client.post("/chat", json=payload)
+                status = str(response.status_code)
+                if response.status_code == 200:
+                    tokens = response.json()["completion_tokens"]
+        except httpx.TimeoutException:
+            status = "timeout"
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+
+        if not self.recording:
+            return
+        elapsed = time.perf_counter() - start
+        self.statuses[status] += 1
+        if status == "200":
+            self.latencies.append(elapsed)
+            self.completion_tokens += tokens
+            if ttft is not None:
+                self.ttfts.append(ttft)
+
+    async def closed_loop(self, client: httpx.AsyncClient, total: Optional[int], deadline: Optional[float]) -> None:
+        remaining = [total]
+
+        def more() -> bool:
+            if deadline is not None and time.perf_counter() >= deadline:
+                return False
+            if remaining[0] is not None:
+                if remaining[0] <= 0:
+                    return False
+                remaining[0] -= 1
+            return True
+
+        async def worker():
+            while more():
+                await self.one(client)
+
+        await asyncio.gather(*(worker() for _ in range(self.args.concurrency)))
+
+    async def open_loop(self, client: httpx.AsyncClient, total: Optional[int], deadline: Optional[float]) -> None:
+        in_flight = asyncio.Semaphore(self.args.max_in_flight)
+        tasks = set()
+        sent = 0
+        next_arrival = time.perf_counter()
+        while (total is None or sent < total) and (deadline is None or next_arrival < deadline):
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if in_flight.locked():
+                # Cliente saturado: se cuenta como descartada, no se retrasa el reloj
+                if self.recording:
+                    self.statuses["client_dropped"] += 1
+            else:
+                await in_flight.acquire()
+                task = asyncio.create_task(self.one(client))
+                task.add_done_callback(lambda _: in_flight.release())
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            sent += 1
+            next_arrival += self.rng.expovariate(self.args.rate)
+        await asyncio.gather(*tasks)
+
+    async def run(self, url: str) -> Dict:
+        args = self.args
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        async with httpx.AsyncClient(base_url=url, timeout=args.timeout, limits=limits) as client:
+            load = self.open_loop if args.rate else self.closed_loop
+
+            if args.warmup:
+                await load(client, args.warmup, None)
+
+            self.recording = True
+            start = time.perf_counter()
+            deadline = start + args.duration if args.duration else None
+            await load(client, None if args.duration else args.requests, deadline)
+            wall = time.perf_counter() - start
+
+        total = sum(self.statuses.values())
+        errors = total - self.statuses.get("200", 0)
+        return {
+            "requests": total,
+            "wall_seconds": round(wall, 3),
+            "throughput_rps": round(self.statuses.get("200", 0) / wall, 2),
+            "tokens_per_second": round(self.completion_tokens / wall, 1),
+            "error_rate": round(errors / total, 4) if total else 0.0,
+            "statuses": dict(self.statuses),
+            "latency_seconds": latency_summary(self.latencies),
+            "ttft_seconds": latency_summary(self.ttfts) if args.stream else None,
+        }
+
+
+class Stack:
+    """Servidor vLLM falso + backend como subprocesos"""
+
+    def __init__(self, args):
+        self.args = args
+        self.procs: List[subprocess.Popen] = []
+        self.url = f"http://127.0.0.1:{args.port}"
+
+    def __enter__(self):
+        args = self.args
+        fake_port = args.port + 1
+        self.procs.append(subprocess.Popen(
+            [sys.executable, os.path.join(BENCH_DIR, "fake_vllm.py"),
+             "--port", str(fake_port), "--delay", str(args.fake_delay), *shlex.split(args.fake_args)],
+        ))
+        env = {
+            **os.environ,
+            "VLLM_API_URL": f"http://127.0.0.1:{fake_port}",
+            "RATE_LIMIT_ENABLED": "false",
+            "DEBUG": "false",
+            "WORKERS": str(args.workers),
+        }
+        self.procs.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app:app", "--port", str(args.port),
+             "--workers", str(args.workers), "--log-level", "warning", "--no-access-log"],
+            cwd=os.path.join(ROOT, "backend"), env=env
+        ))
+        self._wait(f"http://127.0.0.1:{fake_port}/health")
+        self._wait(f"{self.url}/health")
+        return self
+
+    def _wait(self, url: str, timeout: float = 30.0) -> None:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                if httpx.get(url, timeout=1.0).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.1)
+        raise RuntimeError(f"{url} no respondió en {timeout}s")
+
+    def __exit__(self, *exc):
+        for proc in reversed(self.procs):
+            proc.terminate()
+        for proc in self.procs:
+            proc.wait(timeout=10)
+
+
+def compare(result: Dict, baseline: Dict, threshold: float) -> bool:
+    """Comparar con una ejecución anterior; False si alguna métrica empeora más de `threshold`"""
+    checks = [
+        ("latency p50", result["latency_seconds"]["p50"], baseline["latency_seconds"]["p50"], True),
+        ("latency p99", result["latency_seconds"]["p99"], baseline["latency_seconds"]["p99"], True),
+        ("throughput", result["throughput_rps"], baseline["throughput_rps"], False),
+    ]
+    if result.get("ttft_seconds") and baseline.get("ttft_seconds"):
+        checks.append(("ttft p99", result["ttft_seconds"]["p99"], baseline["ttft_seconds"]["p99"], True))
+
+    ok = True
+    print("\nComparación con la línea base:")
+    for name, current, previous, lower_is_better in checks:
+        if not current or not previous:
+            continue
+        change = (current - previous) / previous
+        worse = change > threshold if lower_is_better else change < -threshold
+        ok &= not worse
+        print(f"  {'❌' if worse else '✅'} {name:<12} {previous:>10} → {current:<10} ({change:+.1%})")
+    if result["error_rate"] > baseline["error_rate"] + 0.01:
+        print(f"  ❌ error rate   {baseline['error_rate']} → {result['error_rate']}")
+        ok = False
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    load = parser.add_argument_group("carga")
+    load.add_argument("--concurrency", type=int, default=8, help="Clientes en bucle cerrado")
+    load.add_argument("--rate", type=float, default=None, help="Peticiones/s en bucle abierto (Poisson)")
+    load.add_argument("--max-in-flight", type=int, default=1000, help="Tope de peticiones en vuelo en bucle abierto")
+    load.add_argument("--requests", type=int, default=200)
+    load.add_argument("--duration", type=float, default=None, help="Segundos (en lugar de --requests)")
+    load.add_argument("--warmup", type=int, default=20, help="Peticiones de calentamiento no medidas")
+    load.add_argument("--prompt-words", default="uniform:10:200", help="Distribución de palabras del prompt")
+    load.add_argument("--max-tokens", default="uniform:32:256", help="Distribución de max_tokens")
+    load.add_argument("--temperature", type=float, default=0.7)
+    load.add_argument("--stream", action="store_true", help="Usar /chat/stream y medir TTFT")
+    load.add_argument("--timeout", type=float, default=120.0)
+    load.add_argument("--seed", type=int, default=1234)
+
+    target = parser.add_argument_group("destino")
+    target.add_argument("--url", default=None, help="Backend ya desplegado (si no, se levanta uno local)")
+    target.add_argument("--port", type=int, default=8800, help="Puerto del backend local (vLLM falso en +1)")
+    target.add_argument("--workers", type=int, default=1, help="Workers del backend local")
+    target.add_argument("--fake-delay", type=float, default=0.05, help="TTFT del vLLM falso")
+    target.add_argument("--fake-args", default="", help='Opciones extra del vLLM falso, p. ej. "--token-latency 0.01 --max-concurrency 32"')
+
+    report = parser.add_argument_group("resultados")
+    report.add_argument("--output", default=None, help="Guardar resultados en JSON")
+    report.add_argument("--compare", default=None, help="JSON de una ejecución anterior")
+    report.add_argument("--threshold", type=float, default=0.10, help="Empeoramiento tolerado al comparar")
+    args = parser.parse_args()
+
+    async def run(url: str) -> Dict:
+        return await LoadTest(args).run(url)
+
+    if args.url:
+        result = asyncio.run(run(args.url))
+    else:
+        with Stack(args) as stack:
+            result = asyncio.run(run(stack.url))
+
+    config = {k: v for k, v in vars(args).items() if k not in ("output", "compare")}
+    document = {
+        "timestamp": datetime.now().isoformat(),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "config": config,
+        **result,
+    }
+    print(json.dumps(document, indent=2, ensure_ascii=False))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(document, f, indent=2, ensure_ascii=False)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if not compare(result, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
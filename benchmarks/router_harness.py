@@ -0,0 +1,128 @@
+"""
+Harness del router multi-réplica contra varios servidores vLLM falsos
+
+Comprueba dos cosas:
+  1. Afinidad: cada conversación (mismo prefijo de prompt) cae siempre en la
+     misma réplica mientras todas están sanas.
+  2. Failover: al caer una réplica, su tráfico pasa a las demás sin errores
+     hacia el cliente.
+
+Uso:
+    python benchmarks/router_harness.py --replicas 3 --conversations 60 --turns 4
+"""
+import argparse
+import asyncio
+import os
+import sys
+from contextlib import ExitStack
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_vllm import FakeVLLMServer, create_app  # noqa: E402
+from models import ChatMessage  # noqa: E402
+from services.vllm_service import VLLMService  # noqa: E402
+
+
+async def run_conversations(service: VLLMService, conversations: int, turns: int, tag: str) -> int:
+    """Simular conversaciones multi-turno concurrentes; devuelve los errores"""
+    errors = 0
+
+    async def conversation(i: int) -> None:
+        nonlocal errors
+        history = []
+        for turn in range(turns):
+            message = f"[{tag}] conversación {i}, turno {turn}"
+            try:
+                result = await service.chat_completion(message, history, max_tokens=8, temperature=0.7)
+            except Exception as e:
+                errors += 1
+                print(f"  ❌ {message}: {type(e).__name__}: {e}")
+                return
+            history += [
+                ChatMessage(role="user", content=message),
+                ChatMessage(role="assistant", content=result["response"])
+            ]
+
+    await asyncio.gather(*(conversation(i) for i in range(conversations)))
+    return errors
+
+
+def affinity_report(apps, tag: str, min_ratio: float) -> bool:
+    """
+    Fracción de conversaciones servidas desde una única réplica
+
+    Con carga acotada algunas pueden desbordarse a otra réplica en picos, así
+    que se exige un mínimo en lugar del 100%.
+    """
+    owners = {}
+    for index, app in enumerate(apps):
+        for conversation in app.state.conversations:
+            if conversation.startswith(f"[{tag}]"):
+                owners.setdefault(conversation, set()).add(index)
+    split = [c for c, replicas in owners.items() if len(replicas) > 1]
+    per_replica = [
+        sum(n for c, n in app.state.conversations.items() if c.startswith(f"[{tag}]"))
+        for app in apps
+    ]
+    print(f"  peticiones por réplica: {per_replica}")
+    ratio = 1 - len(split) / len(owners)
+    print(f"  conversaciones en una sola réplica: {len(owners) - len(split)}/{len(owners)} ({ratio:.0%})")
+    return ratio >= min_ratio
+
+
+async def main_async(args, servers, apps) -> bool:
+    service = VLLMService(api_urls=[server.url for server in servers])
+    await service.start()
+    try:
+        await service.health_monitor.check_now()
+
+        print("1) Afinidad con todas las réplicas sanas")
+        errors = await run_conversations(service, args.conversations, args.turns, "a")
+        affinity_ok = affinity_report(apps, "a", args.min_affinity) and errors == 0
+
+        print(f"2) Failover: se detiene la réplica {servers[0].url}")
+        servers[0].__exit__(None, None, None)
+        errors = await run_conversations(service, args.conversations, args.turns, "b")
+        for _ in range(service.router.health_failure_threshold):
+            await service.health_monitor.check_now()
+        errors += await run_conversations(service, args.conversations, args.turns, "c")
+        for replica in service.router.replicas:
+            print(f"  {replica.url}: healthy={replica.healthy} breaker={replica.breaker.state} "
+                  f"requests={replica.requests} errors={replica.errors}")
+        print(f"  errores hacia el cliente: {errors}")
+        failover_ok = errors == 0 and affinity_report(apps[1:], "c", args.min_affinity)
+
+        stats = service.router.stats()
+        print(f"  afinidad: hits={stats['affinity_hits']} misses={stats['affinity_misses']}")
+        return affinity_ok and failover_ok
+    finally:
+        await service.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--replicas", type=int, default=3)
+    parser.add_argument("--conversations", type=int, default=60)
+    parser.add_argument("--turns", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8770, help="Puerto de la primera réplica")
+    parser.add_argument("--delay", type=float, default=0.01)
+    parser.add_argument("--min-affinity", type=float, default=0.9,
+                        help="Fracción mínima de conversaciones que no cambian de réplica")
+    args = parser.parse_args()
+
+    apps = [create_app(delay=args.delay) for _ in range(args.replicas)]
+    with ExitStack() as stack:
+        servers = [
+            stack.enter_context(FakeVLLMServer(app, port=args.port + i))
+            for i, app in enumerate(apps)
+        ]
+        ok = asyncio.run(main_async(args, servers, apps))
+
+    print("✅ OK" if ok else "❌ FALLO")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
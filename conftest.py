@@ -0,0 +1,19 @@
+"""
+Configuración de pytest para las pruebas unitarias del backend
+
+Los módulos del backend se importan como en producción (`from config import
+settings`), así que backend/ va en sys.path. Los scripts test_vllm*.py y
+test_backend.py necesitan los servidores en marcha y se ejecutan a mano.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+collect_ignore = [
+    "test_backend.py",
+    "test_vllm.py",
+    "test_vllm_chat.py",
+    "test_vllm_complete.py",
+    "test_vllm_fixed.py",
+]
@@ -1,18 +1,399 @@
+"""
+Conversión de checkpoints PyTorch (pytorch_model.bin) a safetensors por shards
+
+El checkpoint se abre con torch.load(mmap=True): los tensores se leen del
+disco bajo demanda y cada shard se escribe tensor a tensor, así que la
+memoria anónima usada es del orden del tensor más grande (dos veces si se
+cambia el dtype), no del modelo entero. Los shards se escriben en paralelo
+en varios procesos, cada uno con su propio mapeo del checkpoint. Los
+checkpoints en el formato antiguo (sin zip) no se pueden mapear: se cargan
+una sola vez y los shards se escriben en el proceso principal.
+
+Salida en el mismo directorio, con los nombres que esperan transformers y vLLM:
+  - model.safetensors si todo cabe en un shard, o
+    model-00001-of-0000N.safetensors + model.safetensors.index.json
+  - model.safetensors.sha256 con el sha256 de cada shard
+    (se puede comprobar con `sha256sum -c model.safetensors.sha256`)
+
+Acepta pytorch_model.bin o un checkpoint ya partido
+(pytorch_model-0000i-of-0000N.bin + pytorch_model.bin.index.json).
+
+Uso:
+    python convert_to_safetensors.py
+    python convert_to_safetensors.py models/samples_0 models/samples_1 --max-shard-size 2GB
+    python convert_to_safetensors.py models/samples_0 --dtype bfloat16 --workers 4
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import resource
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
 import torch
-from safetensors.torch import save_file
 
-print("🔄 Convirtiendo pytorch_model.bin a safetensors...")
+DEFAULT_MODEL_DIR = "/home/honores/.local/share/instructlab/checkpoints/hf_format/samples_0"
+
+PYTORCH_WEIGHTS = "pytorch_model.bin"
+PYTORCH_INDEX = "pytorch_model.bin.index.json"
+SAFETENSORS_WEIGHTS = "model.safetensors"
+SAFETENSORS_INDEX = "model.safetensors.index.json"
+CHECKSUMS = "model.safetensors.sha256"
+
+HASH_CHUNK = 16 * 1024 * 1024
+
+# dtype de torch -> nombre en la cabecera de safetensors
+SAFETENSORS_DTYPES = {
+    torch.float64: "F64",
+    torch.float32: "F32",
+    torch.float16: "F16",
+    torch.bfloat16: "BF16",
+    torch.int64: "I64",
+    torch.int32: "I32",
+    torch.int16: "I16",
+    torch.int8: "I8",
+    torch.uint8: "U8",
+    torch.bool: "BOOL",
+}
+for _name, _code in (("float8_e4m3fn", "F8_E4M3"), ("float8_e5m2", "F8_E5M2")):
+    if hasattr(torch, _name):
+        SAFETENSORS_DTYPES[getattr(torch, _name)] = _code
+
+CAST_DTYPES = {"float32": torch.float32, "float16": torch.float16, "bfloat16": torch.bfloat16}
+
+
+class TensorInfo(NamedTuple):
+    name: str
+    source: str
+    nbytes: int
+
+
+def parse_size(text: str) -> int:
+    """'5GB', '500MB', '2GiB' o un número de bytes"""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)(i?)B?\s*", text, re.IGNORECASE)
+    if not match:
+        raise argparse.ArgumentTypeError(f"Tamaño no válido: {text}")
+    number, unit, binary = match.groups()
+    base = 1024 if binary else 1000
+    return int(float(number) * base ** ("KMGT".find(unit.upper()) + 1) if unit else float(number))
+
+
+def target_dtype(dtype: torch.dtype, cast: Optional[torch.dtype]) -> torch.dtype:
+    """Solo se convierten los tensores de coma flotante"""
+    return cast if cast is not None and dtype.is_floating_point else dtype
+
+
+def load_state_dict(path: str) -> Tuple[Dict[str, torch.Tensor], bool]:
+    """
+    Abrir un .bin con mmap; los checkpoints en formato antiguo se cargan
+    enteros. Devuelve el state dict y si está mapeado
+    """
+    try:
+        return torch.load(path, map_location="cpu", mmap=True, weights_only=True), True
+    except RuntimeError as e:
+        if "mmap" not in str(e):
+            raise
+        print(f"⚠️  {os.path.basename(path)} no admite mmap (formato antiguo); se carga entero en memoria")
+        return torch.load(path, map_location="cpu", weights_only=True), False
+
+
+def find_sources(model_dir: str) -> List[str]:
+    """Ficheros .bin del checkpoint"""
+    index_path = os.path.join(model_dir, PYTORCH_INDEX)
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            weight_map = json.load(f)["weight_map"]
+        return [os.path.join(model_dir, name) for name in dict.fromkeys(weight_map.values())]
+    bin_path = os.path.join(model_dir, PYTORCH_WEIGHTS)
+    if os.path.exists(bin_path):
+        return [bin_path]
+    raise FileNotFoundError(f"No hay {PYTORCH_WEIGHTS} ni {PYTORCH_INDEX} en {model_dir}")
+
+
+def plan_tensors(sources: List[str], cast: Optional[torch.dtype]) -> Tuple[List[TensorInfo], Dict[str, Dict[str, torch.Tensor]]]:
+    """
+    Nombre, origen y tamaño final de cada tensor (sin leer sus datos)
+
+    También devuelve los state dicts de los ficheros sin mmap, ya cargados en
+    memoria, para no volver a cargarlos al escribir.
+    """
+    tensors: Dict[str, TensorInfo] = {}
+    loaded: Dict[str, Dict[str, torch.Tensor]] = {}
+    for source in sources:
+        state_dict, mapped = load_state_dict(source)
+        for name, tensor in state_dict.items():
+            dtype = target_dtype(tensor.dtype, cast)
+            nbytes = tensor.numel() * torch.empty((), dtype=dtype).element_size()
+            tensors[name] = TensorInfo(name, source, nbytes)
+        if not mapped:
+            loaded[source] = state_dict
+    return list(tensors.values()), loaded
+
+
+def plan_shards(tensors: List[TensorInfo], max_shard_size: int) -> List[List[TensorInfo]]:
+    """Repartir los tensores en orden en shards de hasta max_shard_size bytes"""
+    shards: List[List[TensorInfo]] = [[]]
+    size = 0
+    for tensor in tensors:
+        if shards[-1] and size + tensor.nbytes > max_shard_size:
+            shards.append([])
+            size = 0
+        shards[-1].append(tensor)
+        size += tensor.nbytes
+    return shards
+
+
+def shard_filenames(count: int) -> List[str]:
+    if count == 1:
+        return [SAFETENSORS_WEIGHTS]
+    return [f"model-{i:05d}-of-{count:05d}.safetensors" for i in range(1, count + 1)]
+
+
+def build_header(layout: List[tuple]) -> bytes:
+    """
+    Cabecera de safetensors: longitud (u64 little-endian) + JSON alineado a 8 bytes
+
+    `layout` son tuplas (nombre, dtype, shape) en el orden en que se escriben.
+    """
+    header = {"__metadata__": {"format": "pt"}}
+    offset = 0
+    for name, dtype, shape in layout:
+        nbytes = shape.numel() * torch.empty((), dtype=dtype).element_size()
+        header[name] = {
+            "dtype": SAFETENSORS_DTYPES[dtype],
+            "shape": list(shape),
+            "data_offsets": [offset, offset + nbytes],
+        }
+        offset += nbytes
+    encoded = json.dumps(header, separators=(",", ":")).encode()
+    encoded += b" " * (-len(encoded) % 8)
+    return struct.pack("<Q", len(encoded)) + encoded
+
+
+def file_sha256(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def write_shard(
+    path: str,
+    entries: List[tuple],
+    cast_name: Optional[str],
+    verify: bool,
+    loaded: Optional[Dict[str, Dict[str, torch.Tensor]]] = None
+) -> Dict:
+    """
+    Escribir un shard tensor a tensor (normalmente en un proceso del pool)
+
+    `entries` son pares (nombre, fichero de origen); los orígenes que no están
+    en `loaded` (state dicts ya en memoria) se abren con mmap. Se calcula el
+    sha256 al escribir y, con `verify`, se vuelve a leer el fichero para
+    comprobarlo y se abre con safetensors para validar la cabecera.
+    """
+    start = time.perf_counter()
+    cast = CAST_DTYPES.get(cast_name)
+    state_dicts: Dict[str, Dict[str, torch.Tensor]] = dict(loaded or {})
+    layout = []
+    for name, source in entries:
+        if source not in state_dicts:
+            state_dicts[source] = load_state_dict(source)[0]
+        tensor = state_dicts[source][name]
+        # Solo metadatos: la cabecera se calcula sin leer los datos
+        layout.append((name, target_dtype(tensor.dtype, cast), tensor.shape))
+
+    sha = hashlib.sha256()
+    written = 0
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        header = build_header(layout)
+        f.write(header)
+        sha.update(header)
+        for name, source in entries:
+            tensor = state_dicts[source][name]
+            tensor = tensor.to(target_dtype(tensor.dtype, cast)).contiguous()
+            data = tensor.reshape(-1).view(torch.uint8).numpy()
+            f.write(data)
+            sha.update(data)
+            written += data.nbytes
+            del tensor, data
+    os.replace(tmp_path, path)
+    checksum = sha.hexdigest()
+
+    if verify:
+        from safetensors import safe_open
+
+        if file_sha256(path) != checksum:
+            raise RuntimeError(f"sha256 de {path} no coincide tras escribirlo")
+        with safe_open(path, framework="pt") as f:
+            if sorted(f.keys()) != sorted(name for name, _ in entries):
+                raise RuntimeError(f"{path}: los tensores guardados no coinciden")
+
+    return {
+        "file": os.path.basename(path),
+        "tensors": len(entries),
+        "bytes": written,
+        "sha256": checksum,
+        "seconds": time.perf_counter() - start,
+        "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+
+
+def write_shards_inline(
+    jobs: List[tuple],
+    cast_name: Optional[str],
+    verify: bool,
+    loaded: Dict[str, Dict[str, torch.Tensor]]
+) -> Iterator[Dict]:
+    """
+    Escribir los shards en orden en este proceso, compartiendo los state dicts
+    ya cargados; cada uno se libera tras el último shard que lo usa
+    """
+    last_use = {source: i for i, (_, entries) in enumerate(jobs) for _, source in entries}
+    for i, (path, entries) in enumerate(jobs):
+        result = write_shard(path, entries, cast_name, verify, loaded)
+        for source in [source for source in loaded if last_use.get(source, -1) <= i]:
+            del loaded[source]
+        yield result
+
+
+def report_shard(result: Dict) -> Dict:
+    print(
+        f"💾 {result['file']}: {result['tensors']} tensores, {result['bytes'] / 1e6:.0f} MB en "
+        f"{result['seconds']:.1f} s ({result['bytes'] / 1e6 / result['seconds']:.0f} MB/s)"
+    )
+    return result
+
+
+def write_json(path: str, data: Dict) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+        f.write("\n")
+    os.replace(tmp_path, path)
+
+
+def convert(model_dir: str, executor: ProcessPoolExecutor, max_shard_size: int, cast_name: Optional[str], verify: bool) -> Dict:
+    """Convertir un directorio de checkpoint; devuelve el resumen"""
+    start = time.perf_counter()
+    print(f"🔄 Convirtiendo {model_dir} a safetensors...")
+    sources = find_sources(model_dir)
+    print(f"📦 Leyendo la lista de tensores de {len(sources)} fichero(s) .bin (mmap)...")
+    tensors, loaded = plan_tensors(sources, CAST_DTYPES.get(cast_name))
+    shards = plan_shards(tensors, max_shard_size)
+    filenames = shard_filenames(len(shards))
+    largest = max(tensor.nbytes for tensor in tensors)
+    print(
+        f"   {len(tensors)} tensores, {sum(t.nbytes for t in tensors) / 1e9:.2f} GB → {len(shards)} shard(s); "
+        f"tensor más grande {largest / 1e6:.1f} MB"
+    )
+
+    jobs = [
+        (os.path.join(model_dir, filename), [(tensor.name, tensor.source) for tensor in shard])
+        for filename, shard in zip(filenames, shards)
+    ]
+    if loaded:
+        # Cada proceso del pool tendría que cargar su propia copia entera del
+        # checkpoint (memoria = procesos × modelo): se usa la ya cargada aquí
+        print(
+            f"⚠️  {len(loaded)} fichero(s) sin mmap: los shards se escriben en este proceso, "
+            f"uno a uno, con el checkpoint cargado una sola vez (se ignora --workers)"
+        )
+        results = [report_shard(result) for result in write_shards_inline(jobs, cast_name, verify, loaded)]
+    else:
+        print(f"⚙️  Escribiendo {len(jobs)} shard(s) en paralelo con mmap")
+        futures = [executor.submit(write_shard, path, entries, cast_name, verify) for path, entries in jobs]
+        results = [report_shard(future.result()) for future in as_completed(futures)]
+    results.sort(key=lambda r: r["file"])
+
+    weight_map = {tensor.name: filename for filename, shard in zip(filenames, shards) for tensor in shard}
+    total_size = sum(r["bytes"] for r in results)
+    if len(shards) > 1:
+        write_json(os.path.join(model_dir, SAFETENSORS_INDEX), {
+            "metadata": {"total_size": total_size},
+            "weight_map": weight_map
+        })
+    with open(os.path.join(model_dir, CHECKSUMS), "w") as f:
+        f.writelines(f"{r['sha256']}  {r['file']}\n" for r in results)
+
+    # Quitar shards de una conversión anterior con otro reparto: vLLM
+    # cargaría todos los .safetensors del directorio
+    stale = [
+        name for name in os.listdir(model_dir)
+        if re.fullmatch(r"model(-\d{5}-of-\d{5})?\.safetensors", name) and name not in filenames
+    ]
+    if len(shards) == 1:
+        stale += [SAFETENSORS_INDEX] if os.path.exists(os.path.join(model_dir, SAFETENSORS_INDEX)) else []
+    for name in stale:
+        print(f"🗑️  Eliminando {name} (conversión anterior)")
+        os.remove(os.path.join(model_dir, name))
+
+    # El dtype declarado en config.json debe coincidir con los pesos
+    config_path = os.path.join(model_dir, "config.json")
+    if cast_name is not None and os.path.exists(config_path):
+        with open(config_path) as f:
+            config = json.load(f)
+        if config.get("torch_dtype") != cast_name:
+            config["torch_dtype"] = cast_name
+            write_json(config_path, config)
+            print(f"📝 config.json: torch_dtype = {cast_name}")
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        "model_dir": model_dir,
+        "shards": len(shards),
+        "bytes": total_size,
+        "seconds": round(elapsed, 2),
+        "throughput_mb_s": round(total_size / 1e6 / elapsed, 1),
+        "largest_tensor_bytes": largest,
+        "max_worker_rss_bytes": max(r["max_rss_bytes"] for r in results),
+    }
+    print(
+        f"✅ Conversión completa: {len(shards)} shard(s), {total_size / 1e9:.2f} GB en {elapsed:.1f} s "
+        f"({summary['throughput_mb_s']:.0f} MB/s); RSS máx. por proceso {summary['max_worker_rss_bytes'] / 1e6:.0f} MB "
+        f"(incluye páginas mapeadas del checkpoint)"
+    )
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("model_dirs", nargs="*", default=[DEFAULT_MODEL_DIR],
+                        help="Directorios de checkpoint (samples_N)")
+    parser.add_argument("--max-shard-size", type=parse_size, default=parse_size("5GB"),
+                        help="Tamaño máximo de cada shard (por defecto 5GB)")
+    parser.add_argument("--dtype", choices=sorted(CAST_DTYPES), default=None,
+                        help="Convertir los tensores de coma flotante a este dtype")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Shards que se escriben en paralelo")
+    parser.add_argument("--no-verify", action="store_true",
+                        help="No releer los shards para comprobar el sha256")
+    parser.add_argument("--summary", help="Guardar el resumen en este fichero JSON")
+    args = parser.parse_args()
 
-model_dir = "/home/honores/.local/share/instructlab/checkpoints/hf_format/samples_0"
-bin_file = f"{model_dir}/pytorch_model.bin"
-safetensors_file = f"{model_dir}/model.safetensors"
+    # spawn: torch no es seguro con fork si ya arrancó sus hilos
+    context = multiprocessing.get_context("spawn")
+    summaries = []
+    with ProcessPoolExecutor(max_workers=max(1, args.workers), mp_context=context) as executor:
+        for model_dir in args.model_dirs:
+            try:
+                summaries.append(convert(model_dir, executor, args.max_shard_size, args.dtype, not args.no_verify))
+            except FileNotFoundError as e:
+                print(f"❌ {e}")
+                return 1
 
-# Cargar el modelo PyTorch
-print("📦 Cargando pytorch_model.bin...")
-state_dict = torch.load(bin_file, map_location="cpu")
+    if args.summary:
+        write_json(args.summary, {"runs": summaries})
+    return 0
 
-# Guardar en formato safetensors
-print("💾 Guardando como model.safetensors...")
-save_file(state_dict, safetensors_file)
 
-print(f"✅ Conversión completa: {safetensors_file}")
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""
+Pruebas del control de admisión: cola llena, espera máxima, expulsión de
+clases menos prioritarias, cancelación y reparto entre clases y tenants
+"""
+import asyncio
+
+import httpx
+import pytest
+
+from services.admission import AdmissionController, AdmissionRejected
+
+WEIGHTS = {"interactive": 8, "batch": 2, "background": 1}
+
+
+def controller(**kwargs) -> AdmissionController:
+    options = {"max_concurrency": 1, "max_queue": 1, "max_queue_time": 5.0, "weights": WEIGHTS}
+    return AdmissionController(**{**options, **kwargs})
+
+
+async def settle():
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+
+def test_full_queue_rejects_immediately():
+    async def scenario():
+        admission = controller()
+        await admission.acquire()
+        queued = asyncio.ensure_future(admission.acquire())
+        await settle()
+        with pytest.raises(AdmissionRejected) as rejected:
+            await admission.acquire()
+        queued.cancel()
+        return rejected.value, admission.stats()
+
+    rejected, stats = asyncio.run(scenario())
+    assert rejected.reason == "queue_full"
+    assert rejected.retry_after == 5.0
+    assert stats["rejected"]["queue_full"] == 1
+    assert stats["classes"]["interactive"]["rejected"]["queue_full"] == 1
+
+
+def test_waiting_longer_than_max_queue_time_is_rejected():
+    async def scenario():
+        admission = controller(max_queue_time=0.01)
+        await admission.acquire()
+        with pytest.raises(AdmissionRejected) as rejected:
+            await admission.acquire()
+        return rejected.value, admission.stats()
+
+    rejected, stats = asyncio.run(scenario())
+    assert rejected.reason == "queue_timeout"
+    assert stats["rejected"]["queue_timeout"] == 1
+    assert stats["queue_depth"] == 0 and stats["active"] == 1
+
+
+def test_higher_priority_preempts_newest_lower_priority_waiter():
+    async def scenario():
+        admission = controller(max_queue=2)
+        await admission.acquire()
+        old = asyncio.ensure_future(admission.acquire("background", "a"))
+        new = asyncio.ensure_future(admission.acquire("background", "a"))
+        await settle()
+        interactive = asyncio.ensure_future(admission.acquire("interactive"))
+        await settle()
+        admission.release(0.1)
+        await settle()
+        return old.done(), new, interactive, admission.stats()
+
+    old_done, new, interactive, stats = asyncio.run(scenario())
+    assert isinstance(new.exception(), AdmissionRejected)
+    assert new.exception().reason == "preempted"
+    # El hueco liberado es para la clase interactiva
+    assert interactive.done() and interactive.exception() is None
+    assert not old_done
+    assert stats["classes"]["background"]["rejected"]["preempted"] == 1
+
+
+@pytest.mark.parametrize("queued,incoming", [("interactive", "interactive"), ("interactive", "batch")])
+def test_same_or_lower_priority_cannot_preempt(queued, incoming):
+    async def scenario():
+        admission = controller()
+        await admission.acquire()
+        waiter = asyncio.ensure_future(admission.acquire(queued))
+        await settle()
+        with pytest.raises(AdmissionRejected) as rejected:
+            await admission.acquire(incoming)
+        waiter.cancel()
+        return rejected.value
+
+    assert asyncio.run(scenario()).reason == "queue_full"
+
+
+def test_unknown_priority_is_an_error():
+    with pytest.raises(ValueError):
+        asyncio.run(controller().acquire("urgent"))
+
+
+def test_cancelled_waiter_leaves_the_queue_and_frees_the_slot():
+    async def scenario():
+        admission = controller(max_queue=2)
+        await admission.acquire()
+        cancelled = asyncio.ensure_future(admission.acquire())
+        other = asyncio.ensure_future(admission.acquire())
+        await settle()
+        cancelled.cancel()
+        await settle()
+        admission.release(0.1)
+        await settle()
+        await other
+        admission.release(0.1)
+        return admission.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["active"] == 0 and stats["queue_depth"] == 0
+
+
+def test_slot_is_released_when_the_call_fails():
+    async def scenario():
+        admission = controller(adaptive=True, min_concurrency=1, max_concurrency=4, target_latency=10.0)
+        request = httpx.Request("POST", "http://vllm")
+        with pytest.raises(httpx.HTTPStatusError):
+            async with admission.slot():
+                raise httpx.HTTPStatusError("503", request=request, response=httpx.Response(503, request=request))
+        return admission.active, admission.limit
+
+    active, limit = asyncio.run(scenario())
+    assert active == 0
+    # Un 5xx cuenta como sobrecarga en modo adaptativo
+    assert limit < 4
+
+
+def test_queue_shares_slots_by_weight_and_rotates_tenants():
+    async def scenario():
+        admission = controller(max_queue=100)
+        await admission.acquire()
+        order = []
+
+        async def request(priority, tenant):
+            await admission.acquire(priority, tenant)
+            order.append((priority, tenant))
+
+        tasks = [asyncio.ensure_future(request("batch", "b")) for _ in range(4)]
+        tasks += [asyncio.ensure_future(request("interactive", tenant)) for tenant in ["x"] * 8 + ["y"] * 2]
+        await settle()
+        for _ in tasks:
+            admission.release(0.1)
+            await settle()
+        return order
+
+    order = asyncio.run(scenario())
+    first = order[:10]
+    # 8:2 entre interactive y batch
+    assert sum(priority == "interactive" for priority, _ in first) == 8
+    # El tenant "y" no espera detrás de las 8 peticiones de "x"
+    assert [tenant for priority, tenant in order if priority == "interactive"][:4] == ["x", "y", "x", "y"]
@@ -0,0 +1,104 @@
+"""
+Pruebas de batch_runner: reanudar tras una interrupción con la marca de agua
+del checkpoint y sin duplicar ni perder líneas
+"""
+import asyncio
+import json
+from contextlib import suppress
+
+import pytest
+
+from batch_runner import BatchRunner, Checkpoint
+
+LINES = 20
+SLOW_LINE = 2  # Las siguientes la adelantan: quedan en `done` por encima de la marca
+
+
+class StubService:
+    """Sustituye a VLLMService: responde con el propio mensaje tras un retardo"""
+
+    def __init__(self, delays=None):
+        self.delays = delays or {}
+        self.calls = []
+        self.completed = 0
+
+    async def chat_completion(self, message, max_tokens, temperature):
+        self.calls.append(message)
+        await asyncio.sleep(self.delays.get(message, 0.001))
+        self.completed += 1
+        return {"response": message, "usage": {"completion_tokens": 1}, "latency_seconds": 0.0}
+
+
+@pytest.fixture
+def paths(tmp_path):
+    source = tmp_path / "prompts.jsonl"
+    with open(source, "w", encoding="utf-8") as f:
+        for i in range(LINES):
+            f.write(json.dumps({"message": f"m{i}"}) + "\n")
+    return str(source), str(tmp_path / "results.jsonl")
+
+
+def read_results(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+async def interrupt(runner: BatchRunner, service: StubService, after: int) -> None:
+    """Cancelar la ejecución cuando hayan terminado `after` peticiones"""
+    task = asyncio.create_task(runner.run())
+    while service.completed < after and not task.done():
+        await asyncio.sleep(0.001)
+    task.cancel()
+    with suppress(asyncio.CancelledError):
+        await task
+
+
+@pytest.mark.parametrize("concurrency", [1, 4])
+def test_resume_after_interruption_writes_each_line_once(paths, concurrency):
+    source, output = paths
+    first = StubService({f"m{SLOW_LINE}": 0.2})
+    runner = BatchRunner(first, source, output, concurrency=concurrency, checkpoint_every=0)
+    asyncio.run(interrupt(runner, first, after=8))
+
+    ckpt = Checkpoint(output + ".ckpt")
+    assert ckpt.load()
+    assert 0 < ckpt.line < LINES
+    if concurrency > 1:
+        # Líneas terminadas por delante de la lenta, pendientes de la marca
+        assert ckpt.line == SLOW_LINE and ckpt.done
+
+    # Una escritura a medias tras el último checkpoint (p. ej. un kill -9)
+    with open(output, "ab") as f:
+        f.write(b'{"line": 19, "status": "o')
+
+    second = StubService()
+    asyncio.run(BatchRunner(second, source, output, concurrency=concurrency, checkpoint_every=0).run())
+
+    lines = [result["line"] for result in read_results(output)]
+    assert sorted(lines) == list(range(LINES))
+    if concurrency == 1:
+        assert lines == list(range(LINES))
+    # La reanudación empieza en la marca y no repite lo ya escrito
+    assert set(second.calls).isdisjoint(first.calls[:ckpt.line])
+    assert not {f"m{line}" for line in ckpt.done} & set(second.calls)
+    assert all(result["response"] == f"m{result['line']}" for result in read_results(output))
+
+    final = Checkpoint(output + ".ckpt")
+    final.load()
+    assert (final.line, final.done, final.ok, final.errors) == (LINES, set(), LINES, 0)
+
+
+def test_blank_and_invalid_lines(paths, tmp_path):
+    source = str(tmp_path / "mixed.jsonl")
+    with open(source, "w", encoding="utf-8") as f:
+        f.write('{"message": "m0"}\n\nno es json\n{"otro": 1}\n{"message": "m4"}\n')
+    output = paths[1]
+
+    asyncio.run(BatchRunner(StubService(), source, output, concurrency=2).run())
+
+    results = {result["line"]: result for result in read_results(output)}
+    assert sorted(results) == [0, 2, 3, 4]
+    assert [results[line]["status"] for line in (0, 2, 3, 4)] == ["ok", "error", "error", "ok"]
+    ckpt = Checkpoint(output + ".ckpt")
+    ckpt.load()
+    assert (ckpt.line, ckpt.ok, ckpt.errors) == (5, 2, 2)
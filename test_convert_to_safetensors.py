@@ -0,0 +1,63 @@
+"""
+Pruebas de convert_to_safetensors con checkpoints pequeños
+"""
+import json
+import os
+
+import pytest
+
+torch = pytest.importorskip("torch")
+safetensors_torch = pytest.importorskip("safetensors.torch")
+
+import convert_to_safetensors as convert
+
+
+def make_checkpoint(directory, legacy: bool):
+    state_dict = {f"layer{i}.weight": torch.randn(64, 64) for i in range(6)}
+    torch.save(state_dict, os.path.join(directory, convert.PYTORCH_WEIGHTS), _use_new_zipfile_serialization=not legacy)
+    return state_dict
+
+
+def read_converted(directory):
+    with open(os.path.join(directory, convert.SAFETENSORS_INDEX)) as f:
+        weight_map = json.load(f)["weight_map"]
+    tensors = {}
+    for filename in set(weight_map.values()):
+        tensors.update(safetensors_torch.load_file(os.path.join(directory, filename)))
+    return tensors
+
+
+@pytest.mark.parametrize("legacy", [False, True])
+def test_convert_round_trip(tmp_path, monkeypatch, legacy):
+    state_dict = make_checkpoint(tmp_path, legacy)
+    loads = []
+    original = convert.load_state_dict
+    monkeypatch.setattr(convert, "load_state_dict", lambda path: loads.append(path) or original(path))
+
+    class NoPool:
+        def submit(self, fn, *args):
+            raise AssertionError("un checkpoint sin mmap no debe ir al pool")
+
+    if legacy:
+        summary = convert.convert(str(tmp_path), NoPool(), 40 * 1024, None, True)
+        # Cargado una vez al planificar y reutilizado para todos los shards
+        assert len(loads) == 1
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(2) as pool:
+            summary = convert.convert(str(tmp_path), pool, 40 * 1024, None, True)
+
+    assert summary["shards"] == 3
+    converted = read_converted(tmp_path)
+    assert converted.keys() == state_dict.keys()
+    assert all(torch.equal(converted[name], tensor) for name, tensor in state_dict.items())
+
+
+def test_inline_writer_frees_each_source_after_last_use(tmp_path):
+    loaded = {"a.bin": {"x": torch.zeros(2)}, "b.bin": {"y": torch.ones(2)}}
+    jobs = [(str(tmp_path / "s1.safetensors"), [("x", "a.bin")]), (str(tmp_path / "s2.safetensors"), [("y", "b.bin")])]
+    writer = convert.write_shards_inline(jobs, None, False, loaded)
+    next(writer)
+    assert list(loaded) == ["b.bin"]
+    next(writer)
+    assert loaded == {}
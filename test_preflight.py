@@ -0,0 +1,155 @@
+"""
+Pruebas de la comprobación previa del prompt: rechazo (413), ajuste de
+max_tokens, recorte del historial y /tokenize
+"""
+import asyncio
+
+import httpx
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+import app as app_module
+from models import ChatMessage, ChatRequest, TokenizeRequest
+from services.preflight import Preflight, PromptTooLong
+from services.tokenizer import TokenCounter
+
+
+class CharCounter:
+    """Un token por carácter, sin marcadores de rol"""
+
+    backend = "chars"
+
+    def count_message(self, message):
+        return len(message["content"])
+
+    def count_text(self, text):
+        return len(text)
+
+
+def preflight(**kwargs) -> Preflight:
+    options = {"system_prompt": "s" * 10, "max_model_len": 100, "template_overhead": 0, "min_completion_tokens": 10}
+    return Preflight(CharCounter(), **{**options, **kwargs})
+
+
+def turns(*contents):
+    roles = ["user", "assistant"]
+    return [ChatMessage(role=roles[i % 2], content=content) for i, content in enumerate(contents)]
+
+
+def test_prompt_without_room_for_the_answer_is_rejected():
+    checker = preflight()
+    with pytest.raises(PromptTooLong) as rejected:
+        checker.plan("u" * 81, max_tokens=50)
+    assert (rejected.value.prompt_tokens, rejected.value.max_prompt_tokens) == (91, 90)
+    assert checker.rejected == 1
+
+    # Justo en el límite todavía cabe la respuesta mínima
+    assert checker.plan("u" * 80, max_tokens=50).max_tokens == 10
+
+
+def test_max_tokens_is_clamped_to_the_context_window():
+    checker = preflight()
+    plan = checker.plan("u" * 40, max_tokens=500)
+    assert (plan.prompt_tokens, plan.max_tokens, plan.requested_max_tokens) == (50, 50, 500)
+    assert checker.clamped == 1
+    assert checker.plan("u" * 40, max_tokens=20).max_tokens == 20
+
+
+def test_history_keeps_the_newest_turns_that_fit_and_starts_with_user():
+    checker = preflight()
+    history = turns("a" * 30, "b" * 30, "c" * 10, "d" * 10, "e" * 10)
+    plan = checker.plan("u" * 10, history, max_tokens=40)
+    # Presupuesto 100 - 40 - 20 = 40: caben c, d y e (30); b no
+    assert [m["content"][0] for m in plan.messages] == ["s", "c", "d", "e", "u"]
+    assert plan.dropped_messages == 2
+
+    history = turns("a" * 10, "b" * 10, "c" * 30)
+    plan = checker.plan("u" * 10, history, max_tokens=40)
+    # "c" es de usuario y "b" de assistant: se quita "b" aunque quepa
+    assert [m["role"] for m in plan.messages] == ["system", "user", "user"]
+    assert plan.dropped_messages == 2
+    assert (checker.trimmed, checker.dropped_messages) == (2, 4)
+
+
+def test_history_max_messages_applies_before_the_budget():
+    plan = preflight(history_max_messages=2).plan("u", turns("a", "b", "c", "d"), max_tokens=10)
+    assert [m["content"] for m in plan.messages[1:-1]] == ["c", "d"]
+    assert plan.dropped_messages == 2
+
+
+def test_disabled_preflight_never_rejects_or_clamps():
+    checker = preflight(enabled=False)
+    plan = checker.plan("u" * 200, max_tokens=500)
+    assert plan.max_tokens == 500
+    assert checker.rejected == checker.clamped == 0
+
+
+def test_record_false_does_not_count():
+    checker = preflight()
+    checker.plan("u" * 40, turns("a" * 60, "b"), max_tokens=500, record=False)
+    with pytest.raises(PromptTooLong):
+        checker.plan("u" * 200, record=False)
+    stats = checker.stats()
+    assert (stats["rejected"], stats["clamped"], stats["trimmed"]) == (0, 0, 0)
+
+
+def test_prompt_too_long_maps_to_413():
+    error = app_module._upstream_http_exception(PromptTooLong(5000, 4080))
+    assert error.status_code == 413
+    assert "5000" in error.detail
+
+
+@pytest.fixture
+def small_window(monkeypatch):
+    """Ventana de 100 tokens y una réplica que cuenta las llamadas"""
+    calls = []
+    service = app_module.vllm_service
+    monkeypatch.setattr(service, "preflight", preflight())
+    monkeypatch.setattr(service, "token_counter", CharCounter())
+    monkeypatch.setattr(service, "cache", None)
+    replica = service.router.replicas[0]
+    transport = httpx.MockTransport(lambda request: calls.append(request) or httpx.Response(500))
+    monkeypatch.setattr(replica, "client", httpx.AsyncClient(transport=transport, base_url=replica.url))
+    return calls
+
+
+def http_request() -> Request:
+    return Request({"type": "http", "method": "POST", "path": "/chat", "client": ("203.0.113.7", 1), "headers": []})
+
+
+def test_chat_rejects_long_prompt_with_413_before_calling_vllm(small_window):
+    with pytest.raises(HTTPException) as rejected:
+        asyncio.run(app_module.chat(ChatRequest(message="u" * 200), http_request()))
+    assert rejected.value.status_code == 413
+    assert small_window == []
+
+
+def test_tokenize_reports_prompts_that_do_not_fit(small_window):
+    history = turns("a", "b")
+    too_long = asyncio.run(app_module.tokenize(TokenizeRequest(message="u" * 200, conversation_history=history)))
+    assert too_long.fits is False
+    assert (too_long.prompt_tokens, too_long.max_tokens, too_long.dropped_messages) == (210, 0, 2)
+
+    fits = asyncio.run(app_module.tokenize(TokenizeRequest(message="u" * 40, conversation_history=history, max_tokens=40)))
+    assert fits.fits is True
+    assert (fits.prompt_tokens, fits.max_tokens, fits.history_messages) == (52, 40, 2)
+    assert small_window == []
+
+
+def test_preflight_uses_the_model_tokenizer_when_available(tmp_path):
+    tokenizers = pytest.importorskip("tokenizers")
+    from tokenizers.models import WordLevel
+    from tokenizers.pre_tokenizers import Whitespace
+
+    vocab = {"[UNK]": 0, "hola": 1, "mundo": 2}
+    tokenizer = tokenizers.Tokenizer(WordLevel(vocab, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = Whitespace()
+    tokenizer.save(str(tmp_path / "tokenizer.json"))
+
+    counter = TokenCounter(str(tmp_path), chars_per_token=1.0, message_overhead=0)
+    checker = Preflight(counter, "hola", max_model_len=20, template_overhead=0, min_completion_tokens=1)
+    plan = checker.plan("hola mundo hola", max_tokens=100)
+    assert counter.backend == "tokenizers"
+    # 1 + 3 tokens reales, no los 19 caracteres de la estimación
+    assert (plan.prompt_tokens, plan.max_tokens) == (4, 16)
@@ -0,0 +1,103 @@
+"""
+Pruebas del rate limiting: token bucket e identificación del cliente
+"""
+import asyncio
+
+from middleware.rate_limit import ClientIdentity, InMemoryRateLimitBackend, RateLimitMiddleware
+
+
+def make_scope(path="/chat", client="203.0.113.7", headers=None):
+    return {
+        "type": "http",
+        "method": "POST",
+        "path": path,
+        "client": (client, 50000),
+        "headers": [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()],
+    }
+
+
+async def ok_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+def statuses(middleware, scopes):
+    """Código de respuesta de cada petición, en orden"""
+    async def run():
+        result = []
+        for scope in scopes:
+            sent = []
+
+            async def send(message):
+                sent.append(message)
+
+            await middleware(scope, None, send)
+            result.append(sent[0]["status"])
+        return result
+    return asyncio.run(run())
+
+
+def limiter(identity=None, requests=2):
+    return RateLimitMiddleware(ok_app, InMemoryRateLimitBackend(), requests=requests, period=60, identity=identity)
+
+
+def test_bucket_rejects_after_capacity():
+    assert statuses(limiter(), [make_scope() for _ in range(5)]) == [200, 200, 429, 429, 429]
+
+
+def test_unlimited_paths_pass():
+    assert statuses(limiter(), [make_scope(path="/health") for _ in range(5)]) == [200] * 5
+
+
+def test_rotating_unknown_api_keys_share_ip_bucket():
+    scopes = [make_scope(headers={"X-API-Key": f"random-{i}"}) for i in range(5)]
+    assert statuses(limiter(), scopes) == [200, 200, 429, 429, 429]
+
+
+def test_known_api_key_gets_its_own_bucket():
+    identity = ClientIdentity(api_keys={"aula-1"})
+    scopes = [make_scope() for _ in range(2)] + [make_scope(headers={"X-API-Key": "aula-1"})]
+    assert statuses(limiter(identity), scopes) == [200, 200, 200]
+    assert identity(make_scope(headers={"X-API-Key": "aula-1"})) == "key:aula-1"
+
+
+def test_forwarded_headers_ignored_by_default():
+    scopes = [
+        make_scope(headers={"X-Forwarded-For": f"198.51.100.{i}", "X-Real-IP": f"198.51.100.{i}"})
+        for i in range(5)
+    ]
+    assert statuses(limiter(), scopes) == [200, 200, 429, 429, 429]
+
+
+def test_forwarded_headers_ignored_from_untrusted_peer():
+    identity = ClientIdentity(trust_proxy=True, trusted_proxies=["172.28.0.10"])
+    scopes = [make_scope(headers={"X-Forwarded-For": f"198.51.100.{i}"}) for i in range(5)]
+    assert statuses(limiter(identity), scopes) == [200, 200, 429, 429, 429]
+
+
+def test_trusted_proxy_uses_real_ip():
+    identity = ClientIdentity(trust_proxy=True, trusted_proxies=["172.28.0.0/16"])
+    scope = make_scope(client="172.28.0.10", headers={"X-Real-IP": "198.51.100.4"})
+    assert identity(scope) == "ip:198.51.100.4"
+
+
+def test_trusted_proxy_skips_client_written_forwarded_for():
+    # nginx añade la IP real al final de lo que envió el cliente
+    identity = ClientIdentity(trust_proxy=True, trusted_proxies=["172.28.0.10"])
+    scope = make_scope(client="172.28.0.10", headers={"X-Forwarded-For": "1.2.3.4, 198.51.100.4"})
+    assert identity(scope) == "ip:198.51.100.4"
+
+
+def test_bucket_refills():
+    backend = InMemoryRateLimitBackend()
+
+    async def run():
+        first = await backend.hit("k", capacity=1, refill_rate=1000.0)
+        second = await backend.hit("k", capacity=1, refill_rate=1000.0)
+        await asyncio.sleep(0.01)
+        third = await backend.hit("k", capacity=1, refill_rate=1000.0)
+        return first, second, third
+
+    first, second, third = asyncio.run(run())
+    assert first.allowed and not second.allowed and third.allowed
+    assert second.retry_after > 0
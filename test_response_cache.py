@@ -0,0 +1,131 @@
+"""
+Pruebas de la caché exacta de respuestas: clave, regla de temperatura,
+caducidad y límites de entradas y bytes
+"""
+import asyncio
+
+import httpx
+import pytest
+
+from config import settings
+from services import response_cache
+from services.response_cache import InMemoryResponseCache, ResponseCache
+from services.vllm_service import VLLMService
+
+PAYLOAD = {"model": "m", "messages": [{"role": "user", "content": "hola"}], "max_tokens": 10, "temperature": 0.0}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(response_cache.time, "monotonic", clock)
+    return clock
+
+
+def test_key_is_stable_and_covers_every_parameter():
+    assert ResponseCache.make_key(PAYLOAD) == ResponseCache.make_key(dict(reversed(PAYLOAD.items())))
+    for field, value in [("max_tokens", 11), ("temperature", 0.1), ("model", "otro"),
+                         ("messages", [{"role": "user", "content": "adiós"}])]:
+        assert ResponseCache.make_key({**PAYLOAD, field: value}) != ResponseCache.make_key(PAYLOAD)
+
+
+@pytest.mark.parametrize("temperature,allow,cached", [
+    (0.0, False, True),
+    (0.7, False, False),
+    (0.7, True, True),
+])
+def test_request_key_follows_temperature_rule(monkeypatch, temperature, allow, cached):
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_ALLOW_NONDETERMINISTIC", allow)
+    service = VLLMService(api_urls=["http://replica"])
+    key = service._request_key({**PAYLOAD, "temperature": temperature, "stream": False})
+    assert (key is not None) == cached
+
+
+def test_entries_expire_after_ttl(clock):
+    async def scenario():
+        cache = InMemoryResponseCache(ttl=10)
+        await cache.set("k", {"response": "r"})
+        clock.now += 9
+        fresh = await cache.get("k")
+        clock.now += 2
+        return fresh, await cache.get("k"), cache.stats()
+
+    fresh, expired, stats = asyncio.run(scenario())
+    assert fresh == {"response": "r"}
+    assert expired is None
+    assert stats["entries"] == 0 and stats["bytes"] == 0
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+
+def test_least_recently_used_entry_is_evicted():
+    async def scenario():
+        cache = InMemoryResponseCache(max_entries=2)
+        await cache.set("a", {"response": "a"})
+        await cache.set("b", {"response": "b"})
+        await cache.get("a")
+        await cache.set("c", {"response": "c"})
+        return [await cache.get(key) is not None for key in "abc"], cache.evictions
+
+    present, evictions = asyncio.run(scenario())
+    assert present == [True, False, True]
+    assert evictions == 1
+
+
+def test_byte_limit_evicts_and_rejects_oversized_values():
+    value = {"response": "x" * 40}
+    size = len(response_cache.json_dumps(value))
+
+    async def scenario():
+        cache = InMemoryResponseCache(max_bytes=2 * size)
+        await cache.set("big", {"response": "x" * 1000})
+        for key in "abc":
+            await cache.set(key, value)
+        return await cache.get("big"), await cache.get("a"), cache.stats()
+
+    big, first, stats = asyncio.run(scenario())
+    assert big is None and first is None
+    assert stats["entries"] == 2 and stats["bytes"] == 2 * size
+
+
+def test_overwriting_a_key_does_not_leak_bytes():
+    async def scenario():
+        cache = InMemoryResponseCache()
+        await cache.set("k", {"response": "uno"})
+        await cache.set("k", {"response": "dos"})
+        return cache.stats()["bytes"], await cache.get("k")
+
+    size, value = asyncio.run(scenario())
+    assert size == len(response_cache.json_dumps({"response": "dos"}))
+    assert value == {"response": "dos"}
+
+
+@pytest.mark.parametrize("temperature,upstream_calls", [(0.0, 1), (0.7, 2)])
+def test_service_only_serves_deterministic_requests_from_cache(monkeypatch, temperature, upstream_calls):
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_ALLOW_NONDETERMINISTIC", False)
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(200, json={"model": "m", "choices": [{"message": {"content": "ok"}}]})
+
+    async def scenario():
+        service = VLLMService(api_urls=["http://replica"])
+        service.cache = InMemoryResponseCache()
+        replica = service.router.replicas[0]
+        replica.client = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url=replica.url)
+        first = await service.chat_completion("hola", max_tokens=10, temperature=temperature)
+        second = await service.chat_completion("hola", max_tokens=10, temperature=temperature)
+        return first["cached"], second["cached"]
+
+    first, second = asyncio.run(scenario())
+    assert first is False
+    assert second is (upstream_calls == 1)
+    assert len(calls) == upstream_calls
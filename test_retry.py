@@ -0,0 +1,213 @@
+"""
+Pruebas de reintentos y circuit breaker: qué errores se reintentan,
+presupuesto de reintentos y estados closed / open / half-open
+"""
+import asyncio
+
+import httpx
+import pytest
+
+from services import circuit_breaker, retry
+from services.circuit_breaker import CircuitBreaker, CircuitOpenError
+from services.retry import RetryBudget, RetryPolicy, classify_error
+from services.vllm_service import VLLMService
+
+REQUEST = httpx.Request("POST", "http://vllm/v1/chat/completions")
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(retry.time, "monotonic", clock)
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", clock)
+    return clock
+
+
+def status_error(status: int) -> httpx.HTTPStatusError:
+    return httpx.HTTPStatusError(str(status), request=REQUEST, response=httpx.Response(status, request=REQUEST))
+
+
+def failing(*errors, result="ok"):
+    """Función que lanza `errors` en orden y después devuelve `result`"""
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+    return fn, calls
+
+
+def policy(**kwargs) -> RetryPolicy:
+    return RetryPolicy(base_delay=0, max_delay=0, **kwargs)
+
+
+@pytest.mark.parametrize("error,kind", [
+    (status_error(400), retry.CLIENT_ERROR),
+    (status_error(500), retry.SERVER_ERROR),
+    (status_error(503), retry.UNAVAILABLE),
+    (httpx.ConnectError("refused", request=REQUEST), retry.CONNECT_ERROR),
+    (httpx.ConnectTimeout("sin conexión", request=REQUEST), retry.CONNECT_ERROR),
+    # La petición ya se envió: no es un fallo de conexión
+    (httpx.ReadError("reset", request=REQUEST), retry.TRANSPORT_ERROR),
+    (httpx.RemoteProtocolError("cortada", request=REQUEST), retry.TRANSPORT_ERROR),
+    (httpx.WriteError("broken pipe", request=REQUEST), retry.TRANSPORT_ERROR),
+    (httpx.ReadTimeout("lento", request=REQUEST), retry.TIMEOUT),
+])
+def test_classify_error(error, kind):
+    assert classify_error(error) == kind
+
+
+def test_transient_errors_are_retried():
+    fn, calls = failing(status_error(503), httpx.ConnectError("refused", request=REQUEST))
+    retry_policy = policy(max_retries=2)
+    assert asyncio.run(retry_policy.run(fn)) == "ok"
+    assert len(calls) == 3 and retry_policy.retries == 2
+
+
+@pytest.mark.parametrize("error", [
+    status_error(400),
+    status_error(500),
+    # La generación pudo ejecutarse: reintentar duplicaría trabajo en la GPU
+    httpx.ReadTimeout("lento", request=REQUEST),
+])
+def test_non_transient_errors_are_not_retried(error):
+    fn, calls = failing(error)
+    with pytest.raises(type(error)):
+        asyncio.run(policy().run(fn))
+    assert len(calls) == 1
+
+
+def test_retries_stop_at_max_retries():
+    fn, calls = failing(*[status_error(503)] * 5)
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(policy(max_retries=2).run(fn))
+    assert len(calls) == 3
+
+
+def test_exhausted_budget_stops_retries_until_it_refills(clock):
+    budget = RetryBudget(ratio=0.0, min_per_second=1.0, max_balance=1.0)
+    retry_policy = policy(max_retries=5, budget=budget)
+
+    fn, calls = failing(*[status_error(503)] * 10)
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(retry_policy.run(fn))
+    # Un único token: un reintento y después se rinde
+    assert len(calls) == 2
+    assert budget.exhausted == 1
+
+    fn, calls = failing(status_error(503))
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(retry_policy.run(fn))
+    assert len(calls) == 1
+
+    clock.now += 1
+    fn, calls = failing(status_error(503))
+    assert asyncio.run(retry_policy.run(fn)) == "ok"
+    assert len(calls) == 2
+
+
+def test_budget_deposits_a_fraction_per_request(clock):
+    budget = RetryBudget(ratio=0.5, min_per_second=0.0, max_balance=10.0)
+    budget.balance = 0.0
+    budget.deposit()
+    assert not budget.try_withdraw()
+    budget.deposit()
+    assert budget.try_withdraw()
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10.0)
+    for _ in range(2):
+        breaker.record_failure()
+    breaker.record_success()
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError) as rejected:
+        breaker.before_call()
+    assert rejected.value.retry_after == 10.0
+    assert breaker.rejected == 1
+
+
+def test_half_open_lets_one_probe_through_per_interval(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10.0, probe_interval=1.0)
+    breaker.record_failure()
+    clock.now += 10
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    # La prueba falla: vuelve a abrirse con un solo fallo
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and breaker.times_opened == 2
+
+    clock.now += 10
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before_call()
+
+
+def test_health_monitor_opens_and_half_opens_the_breaker(clock):
+    breaker = CircuitBreaker(reset_timeout=60.0)
+    breaker.record_health(False)
+    assert breaker.is_open()
+    breaker.record_health(True)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.before_call()
+
+
+@pytest.mark.parametrize("status,attempts,failures", [(503, 3, 3), (400, 1, 0)])
+def test_service_retries_and_feeds_the_replica_breaker(status, attempts, failures):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(status, json={"error": "x"})
+
+    async def scenario():
+        service = VLLMService(api_urls=["http://replica"])
+        service.retry_policy = policy(max_retries=2)
+        replica = service.router.replicas[0]
+        replica.client = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url=replica.url)
+        with pytest.raises(httpx.HTTPStatusError):
+            await service._send("/v1/chat/completions", {"model": "m"})
+        return replica.breaker.consecutive_failures, replica.outstanding
+
+    consecutive_failures, outstanding = asyncio.run(scenario())
+    assert len(calls) == attempts
+    assert consecutive_failures == failures
+    assert outstanding == 0
+
+
+@pytest.mark.parametrize("error", [
+    httpx.ReadError("reset", request=REQUEST),
+    httpx.RemoteProtocolError("cortada", request=REQUEST),
+])
+def test_transport_errors_spend_the_retry_budget_and_back_off(monkeypatch, error, clock):
+    delays = []
+    budget = RetryBudget(ratio=0.0, min_per_second=0.0, max_balance=1.0)
+    retry_policy = policy(max_retries=5, budget=budget)
+    monkeypatch.setattr(retry_policy, "backoff", lambda attempt: delays.append(attempt) or 0)
+
+    fn, calls = failing(error, error, error)
+    with pytest.raises(type(error)):
+        asyncio.run(retry_policy.run(fn))
+    # Un único token de presupuesto: un reintento, tras un backoff
+    assert len(calls) == 2
+    assert len(delays) == 1
+    assert budget.exhausted == 1
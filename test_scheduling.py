@@ -0,0 +1,91 @@
+"""
+Pruebas de prioridades y tenants de la cola de admisión
+"""
+import asyncio
+
+import pytest
+from pydantic import ValidationError
+from starlette.requests import Request
+
+import app as app_module
+from config import Settings, settings
+from middleware.rate_limit import ClientIdentity
+from services.admission import AdmissionController
+
+
+@pytest.fixture
+def keys(monkeypatch):
+    """Claves configuradas: 'lote' limitada a batch y 'plataforma' con subtenants"""
+    monkeypatch.setattr(settings, "PRIORITY_API_KEYS", {"lote": "batch"})
+    monkeypatch.setattr(settings, "TENANT_HEADER_API_KEYS", ["plataforma"])
+    monkeypatch.setattr(app_module, "client_identity", ClientIdentity(api_keys={"lote", "plataforma"}))
+
+
+def request(headers=None, client="203.0.113.7") -> Request:
+    return Request({
+        "type": "http",
+        "method": "POST",
+        "path": "/chat",
+        "client": (client, 50000),
+        "headers": [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()],
+    })
+
+
+def schedule(headers=None, requested=None, default="interactive"):
+    return app_module._scheduling(request(headers), requested, default)
+
+
+def test_rotating_tenant_header_does_not_create_tenants(keys):
+    tenants = {schedule({"X-Tenant-ID": f"aula-{i}"})[1] for i in range(5)}
+    assert tenants == {"ip:203.0.113.7"}
+
+
+def test_unknown_api_key_cannot_set_tenant_or_priority(keys):
+    priority, tenant = schedule({"X-API-Key": "inventada", "X-Tenant-ID": "aula-1"}, requested="interactive")
+    assert (priority, tenant) == ("interactive", "ip:203.0.113.7")
+
+
+def test_trusted_key_splits_into_sub_tenants(keys):
+    assert schedule({"X-API-Key": "plataforma", "X-Tenant-ID": "aula-1"})[1] == "key:plataforma/aula-1"
+    assert schedule({"X-API-Key": "plataforma"})[1] == "key:plataforma"
+    # Una clave sin permiso para subtenants conserva un único tenant
+    assert schedule({"X-API-Key": "lote", "X-Tenant-ID": "aula-1"})[1] == "key:lote"
+
+
+def test_priority_ceiling_per_key(keys):
+    assert schedule({"X-API-Key": "lote"}, requested="interactive")[0] == "batch"
+    assert schedule({"X-API-Key": "lote"}, requested="background")[0] == "background"
+    assert schedule(requested="batch")[0] == "batch"
+
+
+@pytest.mark.parametrize("overrides", [
+    {"PRIORITY_API_KEYS": {"k": "vip"}},
+    {"PRIORITY_DEFAULT": "urgente"},
+    {"PRIORITY_BATCH_DEFAULT": "lotes"},
+])
+def test_unknown_configured_priority_fails_at_startup(overrides):
+    with pytest.raises(ValidationError):
+        Settings(**overrides)
+
+
+def test_tenants_take_turns_within_a_class():
+    order = []
+
+    async def run():
+        admission = AdmissionController(max_concurrency=1, max_queue=10, max_queue_time=5)
+        await admission.acquire()  # Ocupa el único hueco
+
+        async def call(tenant, name):
+            await admission.acquire(tenant=tenant)
+            order.append(name)
+            admission.release(0.01)
+
+        tasks = [asyncio.create_task(call("ruidoso", f"ruidoso-{i}")) for i in range(3)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(call("otro", "otro")))
+        await asyncio.sleep(0)
+        admission.release(0.01)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    assert order.index("otro") == 1
@@ -0,0 +1,219 @@
+"""
+Pruebas de la caché semántica: umbral por defecto, negaciones y números,
+caducidad, temperatura y respuestas cortadas por max_tokens
+"""
+import asyncio
+
+import httpx
+import pytest
+
+pytest.importorskip("numpy")
+
+from config import Settings, settings
+from services.semantic_cache import HashingEmbedder, SemanticCache
+from services.vllm_service import VLLMService
+
+THRESHOLD = Settings.model_fields["SEMANTIC_CACHE_THRESHOLD"].default
+NAMESPACE = SemanticCache.namespace("modelo", "system")
+ANSWER = {"response": "respuesta", "model": "modelo", "usage": {"completion_tokens": 10}}
+
+# Preguntas distintas que el embedding léxico ve parecidas
+DIFFERENT = [
+    ("¿Qué es el aprendizaje supervisado?", "¿Qué es el aprendizaje no supervisado?"),
+    ("¿Qué es la IA?", "¿Qué no es IA?"),
+    ("¿Qué pasó con la IA en 2010?", "¿Qué pasó con la IA en 2014?"),
+    ("Dame 3 ejemplos de evaluación formativa", "Dame 5 ejemplos de evaluación formativa"),
+]
+SAME = [
+    ("Explícame qué es la evaluación formativa", "¿Qué es la evaluación formativa?"),
+    ("¿Qué es el aprendizaje personalizado?", "que es el aprendizaje personalizado"),
+]
+
+
+def similarity(a: str, b: str) -> float:
+    vectors = HashingEmbedder(512).embed([a, b])
+    return float(vectors[0] @ vectors[1])
+
+
+def run_with_cache(coro_factory, **kwargs):
+    async def run():
+        cache = SemanticCache(HashingEmbedder(512), max_entries=16, **kwargs)
+        await cache.start()
+        try:
+            return await coro_factory(cache)
+        finally:
+            await cache.close()
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("first,second", DIFFERENT)
+def test_default_threshold_separates_different_questions(first, second):
+    assert similarity(first, second) < THRESHOLD
+
+
+@pytest.mark.parametrize("first,second", SAME)
+def test_default_threshold_matches_rephrased_questions(first, second):
+    assert similarity(first, second) >= THRESHOLD
+
+
+@pytest.mark.parametrize("first,second", DIFFERENT)
+def test_negations_and_numbers_never_match(first, second):
+    # Incluso con un umbral muy bajo la respuesta de una no sirve para la otra
+    async def scenario(cache):
+        await cache.set(first, NAMESPACE, ANSWER, max_tokens=100, finish_reason="stop")
+        return await cache.get(second, NAMESPACE, max_tokens=100), await cache.get(first, NAMESPACE, max_tokens=100)
+
+    miss, hit = run_with_cache(scenario, threshold=0.3)
+    assert miss is None
+    assert hit is not None and hit[0] == ANSWER
+
+
+def test_number_swap_does_not_overwrite_entry():
+    async def scenario(cache):
+        for year in ("2010", "2014"):
+            await cache.set(f"¿Qué pasó en {year}?", NAMESPACE, {**ANSWER, "response": year}, max_tokens=100, finish_reason="stop")
+        return len(cache.index), await cache.get("¿Qué pasó en 2010?", NAMESPACE, max_tokens=100)
+
+    entries, hit = run_with_cache(scenario, threshold=0.3)
+    assert entries == 2
+    assert hit[0]["response"] == "2010"
+
+
+def test_rephrased_question_hits():
+    async def scenario(cache):
+        await cache.set(SAME[0][0], NAMESPACE, ANSWER, max_tokens=100, finish_reason="stop")
+        return await cache.get(SAME[0][1], NAMESPACE, max_tokens=100)
+
+    hit = run_with_cache(scenario, threshold=THRESHOLD)
+    assert hit is not None and hit[1] >= THRESHOLD
+
+
+def test_entry_needs_room_in_max_tokens_and_namespace():
+    async def scenario(cache):
+        await cache.set("¿Qué es la IA?", NAMESPACE, ANSWER, max_tokens=100, finish_reason="stop")
+        return (
+            await cache.get("¿Qué es la IA?", NAMESPACE, max_tokens=5),
+            await cache.get("¿Qué es la IA?", SemanticCache.namespace("modelo", "otro"), max_tokens=100),
+        )
+
+    assert run_with_cache(scenario) == (None, None)
+
+
+def test_expired_entries_miss():
+    async def scenario(cache):
+        await cache.set("¿Qué es la IA?", NAMESPACE, ANSWER, max_tokens=100, finish_reason="stop")
+        await asyncio.sleep(0.02)
+        return await cache.get("¿Qué es la IA?", NAMESPACE, max_tokens=100)
+
+    assert run_with_cache(scenario, ttl=0.01) is None
+
+
+@pytest.mark.parametrize("temperature,allow,shared", [
+    (0.0, False, True),
+    (0.7, False, False),
+    (0.7, True, True),
+])
+def test_semantic_cache_follows_exact_cache_temperature_rule(monkeypatch, temperature, allow, shared):
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_ALLOW_NONDETERMINISTIC", allow)
+    service = VLLMService(api_urls=["http://replica"])
+    service.semantic_cache = SemanticCache(HashingEmbedder(512))
+    messages = [{"role": "system", "content": "s"}, {"role": "user", "content": "¿Qué es la IA?"}]
+    namespace = service._semantic_namespace(messages, temperature)
+    assert (namespace is not None) == shared
+    # Con historial nunca se comparte
+    assert service._semantic_namespace([messages[0], *messages], 0.0) is None
+
+
+TRUNCATED = {**ANSWER, "response": "La evaluación", "usage": {"completion_tokens": 5}}
+
+
+@pytest.mark.parametrize("finish_reason,generated_with,requested,hit", [
+    ("length", 5, 500, False),   # Cortada: no es la respuesta de una petición con más margen
+    ("length", 5, 5, True),      # Misma petición: vLLM la cortaría igual
+    ("length", 50, 20, False),   # No cabe
+    ("stop", 5, 500, True),      # Terminó de forma natural
+])
+def test_truncated_answer_is_only_served_within_its_max_tokens(finish_reason, generated_with, requested, hit):
+    async def scenario(cache):
+        tokens = generated_with if finish_reason == "length" else 5
+        value = {**TRUNCATED, "usage": {"completion_tokens": tokens}}
+        await cache.set(SAME[0][1], NAMESPACE, value, max_tokens=generated_with, finish_reason=finish_reason)
+        return await cache.get(SAME[0][0], NAMESPACE, max_tokens=requested)
+
+    assert (run_with_cache(scenario, threshold=THRESHOLD) is not None) == hit
+
+
+@pytest.mark.parametrize("second,kept", [
+    (dict(value=TRUNCATED, max_tokens=5, finish_reason="length"), "completa"),
+    (dict(value={**ANSWER, "response": "nueva"}, max_tokens=100, finish_reason="stop"), "nueva"),
+])
+def test_truncated_answer_does_not_replace_complete_one(second, kept):
+    async def scenario(cache):
+        await cache.set("¿Qué es la IA?", NAMESPACE, {**ANSWER, "response": "completa"}, max_tokens=100, finish_reason="stop")
+        await cache.set("¿Qué es la IA?", NAMESPACE, **second)
+        return len(cache.index), await cache.get("¿Qué es la IA?", NAMESPACE, max_tokens=100)
+
+    entries, hit = run_with_cache(scenario)
+    assert entries == 1
+    assert hit[0]["response"] == kept
+
+
+def test_longer_truncated_answer_replaces_shorter_one():
+    async def scenario(cache):
+        await cache.set("¿Qué es la IA?", NAMESPACE, TRUNCATED, max_tokens=5, finish_reason="length")
+        await cache.set("¿Qué es la IA?", NAMESPACE, {**ANSWER, "response": "más larga"}, max_tokens=10, finish_reason="length")
+        await cache.set("¿Qué es la IA?", NAMESPACE, TRUNCATED, max_tokens=5, finish_reason="length")
+        return await cache.get("¿Qué es la IA?", NAMESPACE, max_tokens=10)
+
+    assert run_with_cache(scenario)[0]["response"] == "más larga"
+
+
+def test_persisted_entries_keep_finish_reason_and_max_tokens(tmp_path):
+    path = str(tmp_path / "semantic")
+
+    async def scenario():
+        cache = SemanticCache(HashingEmbedder(512), max_entries=16, path=path)
+        await cache.start()
+        await cache.set("¿Qué es la IA?", NAMESPACE, TRUNCATED, max_tokens=5, finish_reason="length")
+        await cache.close()
+
+        reloaded = SemanticCache(HashingEmbedder(512), max_entries=16, path=path)
+        await reloaded.start()
+        try:
+            return (
+                await reloaded.get("¿Qué es la IA?", NAMESPACE, max_tokens=5),
+                await reloaded.get("¿Qué es la IA?", NAMESPACE, max_tokens=500),
+            )
+        finally:
+            await reloaded.close()
+
+    same, larger = asyncio.run(scenario())
+    assert same is not None and larger is None
+
+
+def test_service_does_not_serve_truncated_reply_to_larger_request(monkeypatch):
+    monkeypatch.setattr(settings, "PREFLIGHT_ENABLED", False)
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(200, json={
+            "model": "modelo",
+            "choices": [{"message": {"content": "La evaluación formativa es"}, "finish_reason": "length"}],
+            "usage": {"completion_tokens": 5},
+        })
+
+    async def scenario():
+        service = VLLMService(api_urls=["http://replica"])
+        service.cache = None
+        service.semantic_cache = SemanticCache(HashingEmbedder(512))
+        await service.semantic_cache.start()
+        replica = service.router.replicas[0]
+        replica.client = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url=replica.url)
+        short = await service.chat_completion(SAME[0][1], max_tokens=5, temperature=0)
+        again = await service.chat_completion(SAME[0][0], max_tokens=5, temperature=0)
+        longer = await service.chat_completion(SAME[0][0], max_tokens=500, temperature=0)
+        return short["cached"], again["cached"], longer["cached"]
+
+    assert asyncio.run(scenario()) == (False, True, False)
+    assert len(calls) == 2
@@ -0,0 +1,146 @@
+"""
+Pruebas de las sesiones de conversación: cuándo se crean y los almacenes
+"""
+import asyncio
+import threading
+
+import pytest
+
+import app as app_module
+from models import ChatMessage, ChatRequest
+from services.session_store import InMemorySessionStore, SQLiteSessionStore
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = InMemorySessionStore()
+    monkeypatch.setattr(app_module, "session_store", store)
+    return store
+
+
+def chat_turn(request: ChatRequest):
+    """_resolve_history + _save_turn como en /chat, con una respuesta fija"""
+    async def run():
+        session_id, history = await app_module._resolve_history(request)
+        await app_module._save_turn(session_id, request, "respuesta")
+        return session_id, history
+    return asyncio.run(run())
+
+
+def messages(role_content):
+    return [ChatMessage(role=role, content=content) for role, content in role_content]
+
+
+def test_one_shot_request_creates_no_session(store):
+    for _ in range(3):
+        session_id, history = chat_turn(ChatRequest(message="hola"))
+        assert session_id is None and history is None
+    assert len(store) == 0
+
+
+def test_explicit_flag_creates_session_and_continues_it(store):
+    session_id, history = chat_turn(ChatRequest(message="hola", session=True))
+    assert session_id and history == []
+    again, history = chat_turn(ChatRequest(message="¿y después?", session_id=session_id))
+    assert again == session_id
+    assert [m.content for m in history] == ["hola", "respuesta"]
+    assert len(store) == 1
+
+
+def test_client_history_is_not_stored(store):
+    history = messages([("user", "hola"), ("assistant", "qué tal")])
+    session_id, used = chat_turn(ChatRequest(message="adiós", conversation_history=history, session=True))
+    assert used == history and session_id is None
+    assert len(store) == 0
+
+
+def test_memory_store_expires_and_trims():
+    async def run():
+        store = InMemorySessionStore(ttl=0.01, max_messages=2)
+        await store.append("s", messages([("user", "1"), ("assistant", "2"), ("user", "3")]))
+        kept = await store.get("s")
+        await asyncio.sleep(0.02)
+        return kept, await store.get("s")
+
+    kept, expired = asyncio.run(run())
+    assert [m.content for m in kept] == ["2", "3"]
+    assert expired == []
+
+
+def test_memory_store_evicts_least_recently_used():
+    async def run():
+        store = InMemorySessionStore(max_sessions=2)
+        await store.append("a", messages([("user", "a")]))
+        await store.append("b", messages([("user", "b")]))
+        await store.get("a")
+        await store.append("c", messages([("user", "c")]))
+        return [await store.get(s) for s in ("a", "b", "c")], store.evictions
+
+    (a, b, c), evictions = asyncio.run(run())
+    assert a and not b and c
+    assert evictions == 1
+
+
+def test_sqlite_store_persists(tmp_path):
+    path = str(tmp_path / "sessions.db")
+
+    async def write():
+        store = SQLiteSessionStore(path)
+        await store.append("s", messages([("user", "hola")]))
+        await store.close()
+
+    async def read():
+        store = SQLiteSessionStore(path)
+        try:
+            history = await store.get("s")
+            await store.delete("s")
+            return history, await store.get("s")
+        finally:
+            await store.close()
+
+    asyncio.run(write())
+    history, deleted = asyncio.run(read())
+    assert [m.content for m in history] == ["hola"]
+    assert deleted == []
+
+
+def test_sqlite_store_never_queries_on_the_event_loop(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    loop_thread = threading.get_ident()
+    query_threads = []
+
+    class TracingConnection:
+        """Anota el hilo de cada consulta y la delega en la conexión real"""
+
+        def __init__(self, conn):
+            self._conn = conn
+
+        def __getattr__(self, name):
+            attr = getattr(self._conn, name)
+            if callable(attr):
+                def traced(*args, **kwargs):
+                    query_threads.append(threading.get_ident())
+                    return attr(*args, **kwargs)
+                return traced
+            return attr
+
+        def __enter__(self):
+            return self._conn.__enter__()
+
+        def __exit__(self, *exc):
+            return self._conn.__exit__(*exc)
+
+    store._conn = TracingConnection(store._conn)
+
+    async def run():
+        assert threading.get_ident() == loop_thread
+        await store.append("s", messages([("user", "hola")]))
+        await store.get("s")
+        stats = await store.stats()
+        await store.delete("s")
+        await store.close()
+        return stats
+
+    stats = asyncio.run(run())
+    assert stats["sessions"] == 1
+    assert query_threads and loop_thread not in query_threads
@@ -0,0 +1,128 @@
+"""
+Pruebas de la coalescencia de peticiones en vuelo: líder y seguidores,
+errores, cancelación del líder y streams compartidos
+"""
+import asyncio
+
+import pytest
+
+from services.singleflight import SingleFlight
+
+
+def test_followers_share_the_leader_result():
+    calls = []
+
+    async def scenario():
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def fn():
+            calls.append(1)
+            await release.wait()
+            return {"response": "ok"}
+
+        waiters = [asyncio.ensure_future(flight.do("k", fn)) for _ in range(5)]
+        await asyncio.sleep(0)
+        in_flight = flight.stats()["in_flight"]
+        release.set()
+        results = await asyncio.gather(*waiters)
+        return results, in_flight, flight.stats()
+
+    results, in_flight, stats = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert in_flight == 1
+    assert stats == {"in_flight": 0, "leaders": 1, "coalesced": 4}
+
+
+def test_leader_error_reaches_every_follower_and_is_not_cached():
+    calls = []
+
+    async def scenario():
+        flight = SingleFlight()
+
+        async def fail():
+            calls.append(1)
+            await asyncio.sleep(0)
+            raise RuntimeError("vLLM caído")
+
+        results = await asyncio.gather(*(flight.do("k", fail) for _ in range(3)), return_exceptions=True)
+        # La clave se libera: la siguiente petición vuelve a llamar
+        retry = await flight.do("k", lambda: asyncio.sleep(0, result="ok"))
+        return results, retry
+
+    results, retry = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert retry == "ok"
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    async def scenario():
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def fn():
+            await release.wait()
+            return "ok"
+
+        leader = asyncio.ensure_future(flight.do("k", fn))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.do("k", fn))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        return leader, await follower
+
+    leader, result = asyncio.run(scenario())
+    assert leader.cancelled()
+    assert result == "ok"
+
+
+def test_different_keys_do_not_coalesce():
+    async def scenario():
+        flight = SingleFlight()
+        return await asyncio.gather(
+            flight.do("a", lambda: asyncio.sleep(0, result="a")),
+            flight.do("b", lambda: asyncio.sleep(0, result="b")),
+        ), flight.stats()
+
+    results, stats = asyncio.run(scenario())
+    assert results == ["a", "b"]
+    assert stats["leaders"] == 2 and stats["coalesced"] == 0
+
+
+def test_late_stream_subscriber_replays_events_and_sees_errors():
+    async def scenario():
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def source():
+            yield {"delta": "a"}
+            await release.wait()
+            yield {"delta": "b"}
+            raise RuntimeError("corte")
+
+        async def collect(events):
+            received = []
+            try:
+                async for event in events:
+                    received.append(event["delta"])
+            except RuntimeError as e:
+                received.append(str(e))
+            return received
+
+        first = asyncio.ensure_future(collect(flight.stream("k", source)))
+        await asyncio.sleep(0.01)
+        assert flight.has_stream("k")
+        late = asyncio.ensure_future(collect(flight.subscribe("k")))
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(first, late)
+        await asyncio.sleep(0)
+        return results, flight.has_stream("k")
+
+    (first, late), still_open = asyncio.run(scenario())
+    assert first == late == ["a", "b", "corte"]
+    assert not still_open
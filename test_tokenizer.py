@@ -0,0 +1,46 @@
+"""
+Pruebas del conteo de tokens mientras el tokenizer se carga en segundo plano
+"""
+import asyncio
+import threading
+
+from services.tokenizer import TokenCounter
+
+
+class SlowCounter(TokenCounter):
+    """Tokenizer que tarda en cargar hasta que se abre `release` (un token por palabra)"""
+
+    def __init__(self):
+        super().__init__("/modelo", chars_per_token=1.0)
+        self.release = threading.Event()
+
+    def _load_tokenizer(self):
+        assert self.release.wait(5)
+        return (lambda text: len(text.split())), "slow"
+
+
+def test_counts_are_estimated_without_blocking_while_loading():
+    async def scenario():
+        counter = SlowCounter()
+        loading = asyncio.create_task(counter.load_async())
+        await asyncio.sleep(0.01)
+        # Con el hilo de carga bloqueado, contar no debe esperar a la carga
+        during = counter.count_text("dos palabras"), counter.backend
+        counter.release.set()
+        await loading
+        after = counter.count_text("dos palabras"), counter.backend
+        return during, after, counter.stats()
+
+    (during_count, during_backend), (after_count, after_backend), stats = asyncio.run(scenario())
+    assert during_count == len("dos palabras")
+    assert "estimate" in during_backend
+    # La estimación no quedó memorizada: después cuenta el tokenizer real
+    assert (after_count, after_backend) == (2, "slow")
+    assert stats["cache_size"] == 1
+
+
+def test_count_loads_lazily_without_background_load():
+    counter = SlowCounter()
+    counter.release.set()
+    assert counter.count_text("tres palabras aquí") == 3
+    assert counter.backend == "slow"
@@ -0,0 +1,137 @@
+"""
+Pruebas del reparto entre réplicas de vLLM: afinidad, failover y conteo de
+peticiones en curso
+"""
+import asyncio
+
+import httpx
+import pytest
+
+from services.circuit_breaker import CircuitBreaker
+from services.retry import RetryBudget, RetryPolicy
+from services.upstream_router import UpstreamRouter
+from services.vllm_service import VLLMService
+
+URLS = ["http://replica-a", "http://replica-b"]
+PAYLOAD = {"model": "m", "messages": [], "max_tokens": 1, "temperature": 0.0, "stream": False}
+
+
+def service_with(handler, urls=URLS) -> VLLMService:
+    """VLLMService cuyas réplicas responden con `handler` (sin red)"""
+    service = VLLMService(api_urls=urls)
+    for replica in service.router.replicas:
+        replica.client = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url=replica.url)
+    return service
+
+
+def outstanding(service: VLLMService):
+    return [replica.outstanding for replica in service.router.replicas]
+
+
+def preferring(service: VLLMService, url: str) -> str:
+    """Clave de afinidad cuya réplica preferida es `url`"""
+    return next(k for k in map(str, range(100)) if service.router._ring_order(k)[0].url == url)
+
+
+def completion_response(request: httpx.Request) -> httpx.Response:
+    return httpx.Response(200, json={"model": "m", "choices": [{"message": {"content": "ok"}}]})
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_cancelled_send_releases_replica(stream):
+    started = asyncio.Event()
+
+    async def hang(request):
+        started.set()
+        await asyncio.sleep(3600)
+
+    service = service_with(hang)
+
+    async def run():
+        task = asyncio.create_task(service._send("/v1/chat/completions", PAYLOAD, stream=stream))
+        await started.wait()
+        assert sum(outstanding(service)) == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert outstanding(service) == [0, 0]
+    assert all(replica.errors == 0 for replica in service.router.replicas)
+
+
+def test_successful_send_releases_replica():
+    service = service_with(completion_response)
+    response, replica = asyncio.run(service._send("/v1/chat/completions", PAYLOAD))
+    assert response.status_code == 200
+    assert outstanding(service) == [0, 0]
+    assert replica.latency.count == 1
+
+
+def test_stream_send_hands_replica_to_caller():
+    service = service_with(completion_response)
+
+    async def run():
+        response, replica = await service._send("/v1/chat/completions", PAYLOAD, stream=True)
+        assert replica.outstanding == 1
+        await response.aclose()
+        service.router.release(replica, 0.1)
+
+    asyncio.run(run())
+    assert outstanding(service) == [0, 0]
+
+
+def test_connect_error_fails_over_to_other_replica():
+    def handler(request):
+        if request.url.host == "replica-a":
+            raise httpx.ConnectError("connection refused", request=request)
+        return completion_response(request)
+
+    service = service_with(handler)
+    # La clave de afinidad fija el orden: probar con una que prefiera replica-a
+    response, replica = asyncio.run(
+        service._send("/v1/chat/completions", PAYLOAD, affinity_key=preferring(service, URLS[0]))
+    )
+    assert replica.url == URLS[1]
+    assert outstanding(service) == [0, 0]
+    assert service.router.replicas[0].errors == 1
+    # No llegó a enviarse: el failover no gasta presupuesto de reintentos
+    assert service.retry_policy.retries == 0
+
+
+@pytest.mark.parametrize("error", [httpx.ReadError, httpx.RemoteProtocolError])
+@pytest.mark.parametrize("budget,reaches_b", [(0.0, False), (1.0, True)])
+def test_transport_error_fails_over_only_through_retry_budget(error, budget, reaches_b):
+    hosts = []
+
+    def handler(request):
+        hosts.append(request.url.host)
+        if request.url.host == "replica-a":
+            raise error("conexión cortada", request=request)
+        return completion_response(request)
+
+    service = service_with(handler)
+    service.retry_policy = RetryPolicy(
+        base_delay=0, max_delay=0, budget=RetryBudget(ratio=0.0, min_per_second=0.0, max_balance=budget)
+    )
+    send = service._send("/v1/chat/completions", PAYLOAD, affinity_key=preferring(service, URLS[0]))
+    if reaches_b:
+        _, replica = asyncio.run(send)
+        assert replica.url == URLS[1]
+        assert service.retry_policy.retries == 1
+    else:
+        # Sin presupuesto no se reenvía a otra réplica una petición que
+        # replica-a pudo estar ya generando
+        with pytest.raises(error):
+            asyncio.run(send)
+        assert service.retry_policy.budget.exhausted == 1
+    assert hosts == ["replica-a", "replica-b"][:1 + reaches_b]
+    assert outstanding(service) == [0, 0]
+
+
+def test_affinity_is_sticky_and_bounded():
+    router = UpstreamRouter(URLS, breaker_factory=CircuitBreaker, load_factor=1.25, min_load=2)
+    first = router.acquire("sesion-1")
+    assert router.acquire("sesion-1") is first
+    # Con la réplica preferida por encima del límite de carga se usa la otra
+    assert router.acquire("sesion-1") is not first
@@ -0,0 +1,48 @@
+"""
+Pruebas del calentamiento: espera a vLLM con el monitor de salud y peticiones
+sintéticas a cada réplica
+"""
+import asyncio
+
+import httpx
+
+from services.vllm_service import VLLMService
+from services.warmup import DONE, Warmup
+
+URLS = ["http://replica-a", "http://replica-b"]
+
+
+def test_warmup_waits_on_the_health_monitor_without_probing_again():
+    hits = []
+
+    def handler(request):
+        hits.append((request.url.host, request.url.path))
+        if request.url.path == "/health":
+            return httpx.Response(200)
+        return httpx.Response(200, json={"model": "m", "choices": [{"message": {"content": "ok"}}]})
+
+    async def scenario():
+        service = VLLMService(api_urls=URLS)
+        for replica in service.router.replicas:
+            replica.client = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url=replica.url)
+        probes = []
+        service.health_monitor.probe = lambda: probes.append(1) or asyncio.sleep(0, result=True)
+
+        warmup = Warmup(service, requests=2, connections=3, timeout=5.0)
+        warmup.start()
+        await asyncio.sleep(0.05)
+        # vLLM todavía no se ha visto sano: el calentamiento espera sin sondear
+        waiting = warmup.state, probes[:], [path for _, path in hits]
+        await service.health_monitor.check_now()
+        await asyncio.wait_for(warmup._task, timeout=5.0)
+        return waiting, probes, warmup
+
+    (state, probes_before, hits_before), probes, warmup = asyncio.run(scenario())
+    assert state == "running" and probes_before == [] and hits_before == []
+    # Un único sondeo, el del monitor
+    assert len(probes) == 1
+    assert warmup.state == DONE
+    assert warmup.sent == 4 and warmup.opened_connections == 6
+    assert sorted(host for host, path in hits if path == "/v1/chat/completions") == [
+        "replica-a", "replica-a", "replica-b", "replica-b"
+    ]